@@ -0,0 +1,149 @@
+"""
+Асинхронный доступ к базе данных для FastAPI
+
+Эндпоинты объявлены как async def, и синхронный вызов db_manager внутри них
+блокирует цикл событий — вместе с ним останавливаются воркеры очереди,
+рассылка прогресса и все остальные запросы. AsyncDatabase выполняет вызовы
+в отдельном ограниченном пуле потоков и замеряет время каждого запроса.
+
+Размер пула ограничивает и число соединений для чтения: у каждого потока
+пула своё долгоживущее соединение (см. DatabaseManager.get_connection).
+
+Использование:
+    files = await async_db.get_downloaded_tracks(limit=100)
+    queue = await async_db.run(download_queue_manager.get_queue, limit)
+"""
+
+import asyncio
+import functools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+from db_manager import DatabaseManager, db_manager
+
+logger = logging.getLogger("async_db")
+
+# Потоков для запросов к БД (записи всё равно идут через поток-писатель)
+DB_EXECUTOR_WORKERS = 4
+
+# Запросы дольше этого времени (секунды) попадают в лог
+SLOW_QUERY_THRESHOLD = 0.5
+
+
+class AsyncDatabase:
+    """Асинхронный фасад над DatabaseManager на ограниченном пуле потоков"""
+
+    def __init__(self, db: DatabaseManager, max_workers: int = DB_EXECUTOR_WORKERS):
+        self.db = db
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="db-query"
+        )
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._pending = 0
+        self._queries: Dict[str, Dict] = {}
+
+    async def run(self, func: Callable, *args, name: str = None, **kwargs) -> Any:
+        """
+        Выполнить синхронную функцию работы с БД в пуле потоков
+
+        Args:
+            func: Метод db_manager или любая функция, работающая с БД
+            name: Имя запроса для статистики (по умолчанию имя функции)
+
+        Returns:
+            Результат функции (исключение пробрасывается)
+        """
+        name = name or getattr(func, "__name__", "query")
+        submitted = time.perf_counter()
+        with self._lock:
+            self._pending += 1
+
+        state = {"started": False}
+
+        def call():
+            started = time.perf_counter()
+            with self._lock:
+                state["started"] = True
+                self._pending -= 1
+                self._in_flight += 1
+            try:
+                return func(*args, **kwargs)
+            finally:
+                finished = time.perf_counter()
+                with self._lock:
+                    self._in_flight -= 1
+                self._record(name, finished - started, started - submitted)
+
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(self._executor, call)
+        except asyncio.CancelledError:
+            # Отменённый до старта вызов так и не покинет очередь пула
+            with self._lock:
+                if not state["started"]:
+                    self._pending -= 1
+            raise
+
+    def __getattr__(self, name: str):
+        # await async_db.<метод db_manager>(...) — тот же вызов, но в пуле потоков
+        attr = getattr(self.db, name)
+        if not callable(attr):
+            return attr
+
+        @functools.wraps(attr)
+        async def wrapper(*args, **kwargs):
+            return await self.run(attr, *args, name=name, **kwargs)
+
+        return wrapper
+
+    def _record(self, name: str, duration: float, wait: float):
+        with self._lock:
+            stats = self._queries.setdefault(
+                name,
+                {"calls": 0, "total": 0.0, "max": 0.0, "wait": 0.0, "slow": 0},
+            )
+            stats["calls"] += 1
+            stats["total"] += duration
+            stats["wait"] += wait
+            stats["max"] = max(stats["max"], duration)
+            if duration >= SLOW_QUERY_THRESHOLD:
+                stats["slow"] += 1
+
+        if duration >= SLOW_QUERY_THRESHOLD:
+            logger.warning(f"🐢 Медленный запрос к БД {name}: {duration:.2f} с")
+
+    def stats(self) -> Dict:
+        """Загрузка пула и время выполнения запросов по именам"""
+        with self._lock:
+            queries = {
+                name: {
+                    "calls": s["calls"],
+                    "avg_ms": round(s["total"] / s["calls"] * 1000, 2),
+                    "max_ms": round(s["max"] * 1000, 2),
+                    "avg_wait_ms": round(s["wait"] / s["calls"] * 1000, 2),
+                    "slow": s["slow"],
+                }
+                for name, s in self._queries.items()
+            }
+            return {
+                "workers": self.max_workers,
+                "in_flight": self._in_flight,
+                "pending": self._pending,
+                "slow_threshold_ms": int(SLOW_QUERY_THRESHOLD * 1000),
+                "queries": dict(
+                    sorted(queries.items(), key=lambda item: -item[1]["avg_ms"])
+                ),
+            }
+
+    def shutdown(self):
+        """Дождаться выполняющихся запросов и остановить пул"""
+        self._executor.shutdown(wait=True)
+
+
+# Глобальный асинхронный фасад БД
+async_db = AsyncDatabase(db_manager)
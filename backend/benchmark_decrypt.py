@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк расшифровки AES-128-CTR: исходная однопоточная схема
+(чтение файла целиком) против параллельной расшифровки сегментами через mmap
+
+Создаёт зашифрованные тестовые файлы 50/100/200 МБ во временной директории,
+проверяет побайтовое совпадение результатов и печатает время.
+
+Запуск: python benchmark_decrypt.py [--sizes 50 100 200] [--workers 4]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from Crypto.Cipher import AES
+from Crypto.Util import Counter
+
+from yandex_direct_api import DECRYPT_WORKERS, decrypt_file
+
+
+def single_thread_decrypt(encrypted_path: str, decrypted_path: str, key: str):
+    """Исходная схема decrypt_track: весь файл в память, одна расшифровка"""
+    with open(encrypted_path, 'rb') as f:
+        encrypted_data = bytearray(f.read())
+    cipher = AES.new(bytes.fromhex(key), AES.MODE_CTR, counter=Counter.new(128, initial_value=0))
+    decrypted_data = cipher.decrypt(bytes(encrypted_data))
+    with open(decrypted_path, 'wb') as f:
+        f.write(decrypted_data)
+
+
+def make_fixture(path: str, size_mb: int, key: str):
+    """Создаёт зашифрованный файл заданного размера (нечётный хвост для проверки границ)"""
+    cipher = AES.new(bytes.fromhex(key), AES.MODE_CTR, counter=Counter.new(128, initial_value=0))
+    remaining = size_mb * 1024 * 1024 + 13
+    with open(path, 'wb') as f:
+        while remaining > 0:
+            chunk = os.urandom(min(remaining, 4 * 1024 * 1024))
+            f.write(cipher.encrypt(chunk))
+            remaining -= len(chunk)
+
+
+def timed(func, *args, **kwargs) -> float:
+    start = time.perf_counter()
+    func(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк расшифровки AES-CTR")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[50, 100, 200], help="Размеры файлов, МБ")
+    parser.add_argument('--workers', type=int, default=DECRYPT_WORKERS, help="Потоков для параллельной расшифровки")
+    args = parser.parse_args()
+
+    key = os.urandom(16).hex()
+
+    print(f"\n{'='*80}")
+    print(f"🔐 Бенчмарк расшифровки AES-128-CTR (потоков: {args.workers}, CPU: {os.cpu_count()})")
+    print(f"{'='*80}\n")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for size_mb in args.sizes:
+            encrypted = os.path.join(tmp, f"fixture_{size_mb}.encrypted")
+            single_out = os.path.join(tmp, f"fixture_{size_mb}.single")
+            parallel_out = os.path.join(tmp, f"fixture_{size_mb}.parallel")
+
+            make_fixture(encrypted, size_mb, key)
+
+            single_time = timed(single_thread_decrypt, encrypted, single_out, key)
+            parallel_time = timed(decrypt_file, encrypted, parallel_out, key, workers=args.workers)
+
+            with open(single_out, 'rb') as a, open(parallel_out, 'rb') as b:
+                identical = a.read() == b.read()
+
+            print(f"📦 {size_mb} МБ:")
+            print(f"   • Однопоточно:  {single_time:.3f} с ({size_mb / single_time:.0f} МБ/с)")
+            print(f"   • Параллельно:  {parallel_time:.3f} с ({size_mb / parallel_time:.0f} МБ/с)")
+            print(f"   • Ускорение:    x{single_time / parallel_time:.2f}")
+            print(f"   • Совпадение:   {'✅ побайтово идентично' if identical else '❌ РАЗЛИЧАЕТСЯ'}\n")
+
+            for path in (encrypted, single_out, parallel_out):
+                os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
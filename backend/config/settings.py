@@ -47,3 +47,76 @@ def get_debug() -> bool:
     """Получить режим отладки из переменных окружения"""
     return os.getenv("DEBUG", "True").lower() == "true"
 
+
+
+def get_download_workers() -> int:
+    """Получить количество параллельных загрузок по умолчанию из переменных окружения"""
+    return int(os.getenv("DOWNLOAD_WORKERS", "3"))
+
+
+def get_http_settings() -> dict:
+    """Получить настройки пула HTTP-соединений из переменных окружения"""
+    return {
+        # Сколько хостов держать в пуле (пулы сверх лимита вытесняются)
+        "pool_connections": int(os.getenv("HTTP_POOL_CONNECTIONS", "10")),
+        # Сколько keep-alive соединений держать на один хост
+        "pool_maxsize": int(os.getenv("HTTP_POOL_MAXSIZE", "16")),
+        "connect_timeout": float(os.getenv("HTTP_CONNECT_TIMEOUT", "10")),
+        "read_timeout": float(os.getenv("HTTP_READ_TIMEOUT", "30")),
+    }
+
+
+def get_playlist_cache_ttl() -> int:
+    """Получить время жизни кэша состава плейлистов (секунды) из переменных окружения"""
+    return int(os.getenv("PLAYLIST_CACHE_TTL", "600"))
+
+
+def get_prefetch_ttl() -> float:
+    """Получить срок жизни предзагруженных ссылок на скачивание (секунды) из переменных окружения"""
+    # Подписанные ссылки живут недолго: запас меньше их реального срока
+    return float(os.getenv("PREFETCH_TTL", "120"))
+
+
+def get_track_metadata_ttl() -> int:
+    """Получить время жизни кэша метаданных треков (секунды) из переменных окружения"""
+    return int(os.getenv("TRACK_METADATA_TTL", str(7 * 24 * 3600)))
+
+
+def get_yandex_api_settings() -> dict:
+    """Получить ограничения запросов к API Яндекс.Музыки из переменных окружения"""
+    return {
+        # Методы каталога: треки, плейлисты, лайки, аккаунт (запросов в секунду на аккаунт)
+        "catalog": {
+            "rate": float(os.getenv("YANDEX_API_RATE", "5")),
+            # Сколько запросов можно сделать подряд без ожидания
+            "burst": int(os.getenv("YANDEX_API_BURST", "5")),
+        },
+        # Информация о загрузке (download-info, get-file-info)
+        "download_info": {
+            "rate": float(os.getenv("YANDEX_DOWNLOAD_INFO_RATE", "2")),
+            "burst": int(os.getenv("YANDEX_DOWNLOAD_INFO_BURST", "4")),
+        },
+        # Хранилище: прямые ссылки и файлы треков
+        "storage": {
+            "rate": float(os.getenv("YANDEX_STORAGE_RATE", "5")),
+            "burst": int(os.getenv("YANDEX_STORAGE_BURST", "10")),
+        },
+        # Сколько раз повторять запрос после ответа 429
+        "retries": int(os.getenv("YANDEX_API_RETRIES", "2")),
+        # Максимальная пауза после 429 без заголовка Retry-After (секунды)
+        "max_cooldown": float(os.getenv("YANDEX_API_MAX_COOLDOWN", "60")),
+        # Сколько батчей метаданных треков запрашивать одновременно
+        "resolve_concurrency": int(os.getenv("YANDEX_RESOLVE_CONCURRENCY", "4")),
+    }
+
+
+def get_cover_cache_settings() -> dict:
+    """Получить настройки загрузки и дискового кэша обложек из переменных окружения"""
+    default_dir = Path(__file__).parent.parent / "data" / "cover_cache"
+    return {
+        "dir": os.getenv("COVER_CACHE_DIR", str(default_dir)),
+        # Максимальный размер кэша (МБ), сверх него удаляются давно не использованные
+        "max_bytes": int(float(os.getenv("COVER_CACHE_MAX_MB", "256")) * 1024 * 1024),
+        # Сколько обложек скачивать одновременно
+        "workers": int(os.getenv("COVER_FETCH_WORKERS", "4")),
+    }
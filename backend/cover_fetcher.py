@@ -0,0 +1,263 @@
+"""
+Фоновая загрузка обложек с дисковым кэшем
+
+Раньше обложка скачивалась синхронно при сохранении каждого трека — прямо
+перед записью в БД, и у треков одного альбома одна и та же картинка
+скачивалась заново. Теперь:
+
+- загрузка обложки запускается в пуле потоков, как только трек начал
+  скачиваться (prefetch), и к сохранению трека обложка уже готова;
+- одновременные запросы одной обложки объединяются: URL обложки строится
+  из cover_uri альбома, поэтому треки альбома ждут один и тот же запрос;
+- скачанные обложки лежат в дисковом кэше, ограниченном по размеру:
+  при переполнении удаляются давно не использованные (LRU).
+
+Использование:
+    cover_fetcher.prefetch(track["cover"])           # не блокирует
+    cover_data = cover_fetcher.get(track["cover"])   # кэш или ожидание загрузки
+"""
+
+import hashlib
+import logging
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from typing import Dict, Optional
+
+from config.settings import get_cover_cache_settings
+from utils.http_client import http_client
+
+logger = logging.getLogger("cover_fetcher")
+
+# Таймаут HTTP-запроса обложки (секунды)
+COVER_FETCH_TIMEOUT = 10
+
+
+class CoverFetcher:
+    """Загрузка обложек в фоне с объединением запросов и LRU-кэшем на диске"""
+
+    def __init__(
+        self,
+        cache_dir: str,
+        max_bytes: int,
+        workers: int = 4,
+        timeout: float = COVER_FETCH_TIMEOUT,
+    ):
+        """
+        Args:
+            cache_dir: Директория кэша обложек
+            max_bytes: Максимальный размер кэша в байтах
+            workers: Сколько обложек скачивать одновременно
+            timeout: Таймаут HTTP-запроса обложки
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(workers, 1), thread_name_prefix="cover-fetch"
+        )
+        self._lock = threading.Lock()
+        self._inflight: Dict[str, Future] = {}
+        # Ключ → размер файла; порядок — от давно использованных к недавним
+        self._index: "OrderedDict[str, int]" = OrderedDict()
+        self._size = 0
+        self._loaded = False
+        self._stats = {
+            "hits": 0,
+            "fetched": 0,
+            "deduplicated": 0,
+            "failed": 0,
+            "evicted": 0,
+            "bytes_fetched": 0,
+        }
+
+    @staticmethod
+    def cache_key(url: str) -> str:
+        """Ключ кэша по URL обложки"""
+        return hashlib.sha256(url.strip().encode("utf-8")).hexdigest()[:32]
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key)
+
+    def _ensure_loaded(self):
+        """Прочитать содержимое кэша с диска (один раз, под блокировкой)"""
+        if self._loaded:
+            return
+        self._loaded = True
+        os.makedirs(self.cache_dir, exist_ok=True)
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if not entry.is_file():
+                continue
+            if entry.name.endswith(".tmp"):
+                # Недописанный файл от прерванной загрузки
+                try:
+                    os.remove(entry.path)
+                except OSError:
+                    pass
+                continue
+            stat = entry.stat()
+            entries.append((stat.st_mtime, entry.name, stat.st_size))
+        # Время изменения файла — время последнего использования (см. _read)
+        for _, key, size in sorted(entries):
+            self._index[key] = size
+            self._size += size
+        self._evict()
+
+    def _evict(self):
+        """Удалить давно не использованные обложки сверх лимита (под блокировкой)"""
+        while self._size > self.max_bytes and self._index:
+            key, size = self._index.popitem(last=False)
+            self._size -= size
+            self._stats["evicted"] += 1
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+
+    def _read(self, key: str) -> Optional[bytes]:
+        """Обложка из кэша или None"""
+        with self._lock:
+            self._ensure_loaded()
+            if key not in self._index:
+                return None
+            self._index.move_to_end(key)
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            # Порядок LRU переживает перезапуск: mtime обновляется при каждом чтении
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                size = self._index.pop(key, None)
+                if size is not None:
+                    self._size -= size
+            return None
+        with self._lock:
+            self._stats["hits"] += 1
+        return data
+
+    def _store(self, key: str, data: bytes):
+        """Сохранить обложку в кэш (запись через временный файл)"""
+        path = self._path(key)
+        tmp_path = f"{path}.{uuid.uuid4().hex[:8]}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"⚠️  Не удалось сохранить обложку в кэш: {e}")
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+        with self._lock:
+            self._size -= self._index.pop(key, 0)
+            self._index[key] = len(data)
+            self._size += len(data)
+            self._evict()
+
+    def _fetch(self, key: str, url: str) -> Optional[bytes]:
+        """Скачать обложку и положить в кэш (выполняется в пуле потоков)"""
+        try:
+            response = http_client.get(url, timeout=self.timeout)
+            if response.status_code != 200 or not response.content:
+                logger.warning(
+                    f"⚠️  Не удалось скачать обложку {url}: статус {response.status_code}"
+                )
+                with self._lock:
+                    self._stats["failed"] += 1
+                return None
+            data = response.content
+            self._store(key, data)
+            with self._lock:
+                self._stats["fetched"] += 1
+                self._stats["bytes_fetched"] += len(data)
+            return data
+        except Exception as e:
+            logger.warning(f"⚠️  Ошибка скачивания обложки {url}: {e}")
+            with self._lock:
+                self._stats["failed"] += 1
+            return None
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+
+    def _submit(self, key: str, url: str) -> Future:
+        """Запустить загрузку или присоединиться к уже идущей"""
+        with self._lock:
+            future = self._inflight.get(key)
+            if future is not None:
+                self._stats["deduplicated"] += 1
+                return future
+            # Пока ждали блокировку, обложку мог положить в кэш другой поток
+            if key in self._index:
+                future = Future()
+                future.set_result(None)
+                return future
+            future = self._executor.submit(self._fetch, key, url)
+            self._inflight[key] = future
+            return future
+
+    def prefetch(self, url: Optional[str]) -> None:
+        """Начать загрузку обложки в фоне, если её нет в кэше"""
+        if not url:
+            return
+        key = self.cache_key(url)
+        with self._lock:
+            self._ensure_loaded()
+            if key in self._index:
+                return
+        self._submit(key, url)
+
+    def get(self, url: Optional[str], timeout: Optional[float] = None) -> Optional[bytes]:
+        """
+        Получить обложку: из кэша или дождавшись загрузки
+
+        Args:
+            url: URL обложки
+            timeout: Сколько ждать загрузки (по умолчанию таймаут запроса);
+                по истечении возвращается None, а загрузка продолжается в фоне
+
+        Returns:
+            Содержимое обложки или None
+        """
+        if not url:
+            return None
+        key = self.cache_key(url)
+        data = self._read(key)
+        if data is not None:
+            return data
+
+        future = self._submit(key, url)
+        try:
+            data = future.result(timeout if timeout is not None else self.timeout)
+        except FutureTimeoutError:
+            logger.warning(f"⏱️  Обложка {url} не загрузилась вовремя")
+            return None
+        # Результат объединённого запроса мог получить другой поток — читаем из кэша
+        return data if data is not None else self._read(key)
+
+    def stats(self) -> Dict:
+        """Размер кэша, попадания и объём скачанных обложек"""
+        with self._lock:
+            return {
+                "cache_dir": self.cache_dir,
+                "entries": len(self._index),
+                "size_bytes": self._size,
+                "max_bytes": self.max_bytes,
+                "in_flight": len(self._inflight),
+                **self._stats,
+            }
+
+
+# Глобальный загрузчик обложек
+_settings = get_cover_cache_settings()
+cover_fetcher = CoverFetcher(
+    _settings["dir"], _settings["max_bytes"], workers=_settings["workers"]
+)
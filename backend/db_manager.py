@@ -2,13 +2,49 @@
 Простой менеджер базы данных для работы с SQLite
 """
 
-import json
+import hashlib
+import re
 import sqlite3
 import os
+import threading
+import time
 from datetime import datetime
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
 from contextlib import contextmanager
 
+from db_writer import DatabaseWriter
+from utils.pagination import decode_cursor
+
+# Сколько ID подставлять в один запрос IN (...)
+SQL_IN_CHUNK = 500
+
+# Строк за один шаг переноса обложек из downloaded_tracks в covers
+COVER_MIGRATION_BATCH = 500
+
+# PRAGMA, которые применяются один раз при открытии соединения
+CONNECTION_PRAGMAS = (
+    # WAL: параллельное чтение и запись
+    "PRAGMA journal_mode=WAL",
+    # В режиме WAL NORMAL безопасен и не делает fsync на каждый коммит
+    "PRAGMA synchronous=NORMAL",
+    # Ждём до 30 секунд, пока база разблокируется
+    "PRAGMA busy_timeout=30000",
+    # Кэш страниц ~16 МБ на соединение
+    "PRAGMA cache_size=-16000",
+    # Чтение файла БД через mmap (до 256 МБ)
+    "PRAGMA mmap_size=268435456",
+    # Временные таблицы и индексы в памяти
+    "PRAGMA temp_store=MEMORY",
+    # INSERT OR REPLACE вызывает триггеры удаления — агрегаты file_stats не расходятся
+    "PRAGMA recursive_triggers=ON",
+)
+
+# Размер кэша подготовленных выражений sqlite3 на соединение
+STATEMENT_CACHE_SIZE = 256
+
+# Веса колонок полнотекстового поиска в bm25: title, artist, album, genre, label
+SEARCH_RANK_WEIGHTS = (10.0, 5.0, 2.0, 1.0, 1.0)
+
 
 class DatabaseManager:
     """Менеджер базы данных"""
@@ -21,23 +57,141 @@ class DatabaseManager:
             os.makedirs(data_dir, exist_ok=True)
             db_path = os.path.join(data_dir, "yandex_music.db")
         self.db_path = db_path
+
+        # Пул соединений для чтения: долгоживущее соединение на каждый поток
+        self._local = threading.local()
+        self._pool_lock = threading.Lock()
+        self._connections: Dict[int, sqlite3.Connection] = {}
+        self._pool_stats = {
+            "created": 0,
+            "acquired": 0,
+            "reused": 0,
+            "closed": 0,
+        }
+
+        # Все изменения идут через один поток-писатель с групповыми коммитами
+        self.writer = DatabaseWriter(self._open_connection)
+
+        # Полнотекстовый поиск (FTS5 может быть не собран в SQLite)
+        self.fts_enabled = False
+
         self._init_database()
 
+    def _open_connection(self) -> sqlite3.Connection:
+        """Открыть соединение и один раз применить PRAGMA"""
+        # check_same_thread=False: соединение потока может закрыть другой поток (очистка пула)
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=30.0,
+            check_same_thread=False,
+            cached_statements=STATEMENT_CACHE_SIZE,
+        )
+        conn.row_factory = sqlite3.Row
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def _thread_connection(self) -> sqlite3.Connection:
+        """Соединение текущего потока (создаётся при первом обращении)"""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            with self._pool_lock:
+                self._pool_stats["acquired"] += 1
+                self._pool_stats["reused"] += 1
+            return conn
+
+        conn = self._open_connection()
+        self._local.conn = conn
+        self._local.depth = 0
+
+        thread_id = threading.get_ident()
+        with self._pool_lock:
+            self._pool_stats["acquired"] += 1
+            self._pool_stats["created"] += 1
+            # Идентификатор мог остаться от завершившегося потока
+            previous = self._connections.get(thread_id)
+            if previous is not None and previous is not conn:
+                self._close_quietly(previous)
+            self._connections[thread_id] = conn
+            self._prune_dead_threads()
+        return conn
+
+    def _prune_dead_threads(self):
+        """Закрыть соединения потоков, которые уже завершились (под _pool_lock)"""
+        alive = {thread.ident for thread in threading.enumerate()}
+        for thread_id in [tid for tid in self._connections if tid not in alive]:
+            self._close_quietly(self._connections.pop(thread_id))
+
+    def _close_quietly(self, conn: sqlite3.Connection):
+        try:
+            conn.close()
+            self._pool_stats["closed"] += 1
+        except sqlite3.Error:
+            pass
+
     @contextmanager
     def get_connection(self):
-        """Контекстный менеджер для подключения к БД"""
-        # timeout=30.0 позволяет ждать до 30 секунд, пока база разблокируется
-        # check_same_thread=False позволяет использовать одно подключение из разных потоков
-        conn = sqlite3.connect(self.db_path, timeout=30.0, check_same_thread=False)
-        conn.row_factory = sqlite3.Row
-        # Включаем WAL режим для параллельного чтения и записи
-        conn.execute("PRAGMA journal_mode=WAL")
-        # Оптимизируем для многопоточного доступа
-        conn.execute("PRAGMA busy_timeout=30000")  # 30 секунд
+        """
+        Контекстный менеджер для подключения к БД
+
+        Возвращает долгоживущее соединение текущего потока. Вложенные вызовы
+        в одном потоке получают то же соединение. Незакоммиченная транзакция
+        откатывается при выходе из внешнего блока — как раньше при закрытии.
+        """
+        conn = self._thread_connection()
+        self._local.depth += 1
         try:
             yield conn
         finally:
-            conn.close()
+            self._local.depth -= 1
+            if self._local.depth == 0:
+                self._reset_connection(conn)
+
+    def write(self, operation):
+        """
+        Выполнить операцию записи в потоке-писателе и дождаться результата
+
+        Операция получает соединение писателя и не вызывает commit/rollback:
+        транзакцией управляет писатель (групповой коммит). Исключение
+        операции пробрасывается вызывающему, остальная пачка не страдает.
+        """
+        return self.writer.run(operation)
+
+    def write_async(self, operation):
+        """Поставить операцию записи в очередь, не дожидаясь коммита (Future)"""
+        return self.writer.submit(operation)
+
+    @staticmethod
+    def _reset_connection(conn: sqlite3.Connection):
+        """Вернуть соединение в пул в исходном состоянии"""
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            pass
+        conn.row_factory = sqlite3.Row
+
+    def get_pool_stats(self) -> Dict:
+        """Статистика пула соединений"""
+        with self._pool_lock:
+            stats = dict(self._pool_stats)
+            stats["open_connections"] = len(self._connections)
+            stats["thread_connections"] = len(self._connections)
+        stats["reuse_rate"] = (
+            round(stats["reused"] / stats["acquired"], 3) if stats["acquired"] else 0.0
+        )
+        stats["statement_cache_size"] = STATEMENT_CACHE_SIZE
+        stats["writer"] = self.writer.stats()
+        return stats
+
+    def close_all(self):
+        """Дописать очередь записи и закрыть все соединения (остановка приложения)"""
+        self.writer.stop()
+        with self._pool_lock:
+            for conn in self._connections.values():
+                self._close_quietly(conn)
+            self._connections.clear()
+        self._local = threading.local()
 
     def _init_database(self):
         """Инициализация таблиц БД"""
@@ -106,7 +260,7 @@ class DatabaseManager:
                     file_size REAL,
                     format TEXT,
                     quality TEXT,
-                    cover_data BLOB,
+                    cover_hash TEXT,
                     download_date TEXT DEFAULT CURRENT_TIMESTAMP,
                     last_checked TEXT DEFAULT CURRENT_TIMESTAMP,
                     is_available INTEGER DEFAULT 1
@@ -135,11 +289,62 @@ class DatabaseManager:
             """
             )
 
-            # Миграция: добавляем поле cover_data если его нет
-            try:
-                cursor.execute(
-                    "ALTER TABLE downloaded_tracks ADD COLUMN cover_data BLOB"
+            # Кэш списков треков плейлистов (снимок состава плейлиста и его ревизия)
+            cursor.execute(
+                """
+                CREATE TABLE IF NOT EXISTS playlist_cache (
+                    playlist_id TEXT PRIMARY KEY,
+                    playlist_name TEXT,
+                    track_count INTEGER NOT NULL DEFAULT 0,
+                    revision INTEGER,
+                    fetched_at REAL NOT NULL
+                )
+            """
+            )
+            cursor.execute(
+                """
+                CREATE TABLE IF NOT EXISTS playlist_cache_tracks (
+                    playlist_id TEXT NOT NULL,
+                    position INTEGER NOT NULL,
+                    track_id TEXT NOT NULL,
+                    available INTEGER NOT NULL DEFAULT 1,
+                    PRIMARY KEY (playlist_id, position)
+                ) WITHOUT ROWID
+            """
+            )
+
+            # Кэш метаданных треков из API Яндекс.Музыки
+            # data — JSON объекта Track для восстановления без запроса к API
+            cursor.execute(
+                """
+                CREATE TABLE IF NOT EXISTS track_metadata (
+                    track_id TEXT PRIMARY KEY,
+                    title TEXT,
+                    artists TEXT,
+                    album TEXT,
+                    year INTEGER,
+                    genre TEXT,
+                    label TEXT,
+                    isrc TEXT,
+                    duration INTEGER,
+                    cover_uri TEXT,
+                    available INTEGER,
+                    data TEXT NOT NULL,
+                    fetched_at REAL NOT NULL
                 )
+            """
+            )
+
+            # Миграция: ревизия плейлиста в снимке для инкрементальной синхронизации
+            try:
+                cursor.execute("ALTER TABLE playlist_cache ADD COLUMN revision INTEGER")
+            except sqlite3.OperationalError:
+                # Поле уже существует
+                pass
+
+            # Миграция: ссылка на обложку в хранилище covers вместо BLOB в строке
+            try:
+                cursor.execute("ALTER TABLE downloaded_tracks ADD COLUMN cover_hash TEXT")
             except sqlite3.OperationalError:
                 # Поле уже существует
                 pass
@@ -151,6 +356,19 @@ class DatabaseManager:
                 # Поле уже существует
                 pass
 
+            # Миграция: поля аренды (lease) строк очереди для атомарного захвата воркерами
+            # lease_expires_at и heartbeat_at хранятся как unix-время (REAL)
+            for column_sql in (
+                "ALTER TABLE download_queue ADD COLUMN lease_owner TEXT",
+                "ALTER TABLE download_queue ADD COLUMN lease_expires_at REAL",
+                "ALTER TABLE download_queue ADD COLUMN heartbeat_at REAL",
+            ):
+                try:
+                    cursor.execute(column_sql)
+                except sqlite3.OperationalError:
+                    # Поле уже существует
+                    pass
+
             # Миграция: добавляем новые поля метаданных в downloaded_tracks
             try:
                 cursor.execute("ALTER TABLE downloaded_tracks ADD COLUMN year INTEGER")
@@ -204,6 +422,31 @@ class DatabaseManager:
             cursor.execute(
                 "CREATE INDEX IF NOT EXISTS idx_download_queue_track_id ON download_queue(track_id)"
             )
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_download_queue_lease ON download_queue(status, lease_expires_at)"
+            )
+
+            # Индексы для постраничной выдачи по курсору: (created_at, id) и
+            # (playlist_id, download_date, id) — id входит в индекс как rowid
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_download_queue_created ON download_queue(created_at)"
+            )
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_downloaded_tracks_playlist_date "
+                "ON downloaded_tracks(playlist_id, download_date)"
+            )
+
+            # Составные индексы для проверки дубликатов при массовом добавлении в очередь
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_download_queue_track_playlist ON download_queue(track_id, playlist_id)"
+            )
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_downloaded_tracks_track_playlist ON downloaded_tracks(track_id, playlist_id)"
+            )
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS idx_downloaded_tracks_title_artist_playlist "
+                "ON downloaded_tracks(title, artist, playlist_id)"
+            )
 
             # Индексы для новых полей метаданных
             cursor.execute(
@@ -216,8 +459,312 @@ class DatabaseManager:
                 "CREATE INDEX IF NOT EXISTS idx_downloaded_tracks_label ON downloaded_tracks(label)"
             )
 
+            self._init_file_stats(cursor)
+            self._init_search_index(cursor)
+            covers_migrated = self._init_cover_store(cursor)
+
             conn.commit()
 
+            if covers_migrated:
+                # Возвращаем файлу БД место, которое занимали обложки в строках
+                print("Сжатие базы данных после переноса обложек...")
+                conn.execute("VACUUM")
+
+    def _init_file_stats(self, cursor):
+        """
+        Таблица агрегатов статистики файлов и триггеры, которые её поддерживают
+
+        file_stats хранит количество и размер файлов всего ('total'), по
+        форматам ('format') и по качеству ('quality'). Триггеры на
+        downloaded_tracks обновляют агрегаты при каждой вставке, удалении и
+        изменении формата/качества/размера, поэтому чтение статистики не
+        зависит от размера библиотеки.
+        """
+        cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'file_stats'"
+        )
+        is_new = cursor.fetchone() is None
+
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS file_stats (
+                dimension TEXT NOT NULL,
+                key TEXT NOT NULL,
+                count INTEGER NOT NULL DEFAULT 0,
+                size REAL NOT NULL DEFAULT 0,
+                PRIMARY KEY (dimension, key)
+            )
+        """
+        )
+
+        # Добавить строку NEW в агрегаты
+        add_new = """
+            INSERT INTO file_stats (dimension, key, count, size)
+            VALUES ('total', '', 1, COALESCE(NEW.file_size, 0))
+            ON CONFLICT(dimension, key) DO UPDATE
+            SET count = count + 1, size = size + excluded.size;
+
+            INSERT INTO file_stats (dimension, key, count, size)
+            SELECT 'format', NEW.format, 1, COALESCE(NEW.file_size, 0)
+            WHERE NEW.format IS NOT NULL
+            ON CONFLICT(dimension, key) DO UPDATE
+            SET count = count + 1, size = size + excluded.size;
+
+            INSERT INTO file_stats (dimension, key, count, size)
+            SELECT 'quality', NEW.quality, 1, COALESCE(NEW.file_size, 0)
+            WHERE NEW.quality IS NOT NULL
+            ON CONFLICT(dimension, key) DO UPDATE
+            SET count = count + 1, size = size + excluded.size;
+        """
+        # Вычесть строку OLD из агрегатов
+        remove_old = """
+            UPDATE file_stats
+            SET count = count - 1, size = size - COALESCE(OLD.file_size, 0)
+            WHERE (dimension = 'total' AND key = '')
+               OR (dimension = 'format' AND key = OLD.format)
+               OR (dimension = 'quality' AND key = OLD.quality);
+        """
+
+        cursor.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS trg_downloaded_tracks_stats_insert
+            AFTER INSERT ON downloaded_tracks
+            BEGIN {add_new} END
+        """
+        )
+        cursor.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS trg_downloaded_tracks_stats_delete
+            AFTER DELETE ON downloaded_tracks
+            BEGIN {remove_old} END
+        """
+        )
+        cursor.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS trg_downloaded_tracks_stats_update
+            AFTER UPDATE OF file_size, format, quality ON downloaded_tracks
+            BEGIN {remove_old} {add_new} END
+        """
+        )
+
+        # Существующая библиотека: заполняем агрегаты один раз полным пересчётом
+        if is_new:
+            self._rebuild_file_stats(cursor)
+
+    def _init_search_index(self, cursor):
+        """
+        Полнотекстовый индекс FTS5 по библиотеке
+
+        downloaded_tracks_fts — индекс с внешним содержимым (сами строки
+        хранятся только в downloaded_tracks) по title/artist/album/genre/label.
+        Токенизатор unicode61 приводит к одному регистру любые алфавиты,
+        включая кириллицу, и убирает диакритику латиницы (Crème → creme).
+        Префиксные индексы ускоряют поиск по началу слова. Триггеры
+        поддерживают индекс в актуальном виде.
+        """
+        cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'downloaded_tracks_fts'"
+        )
+        is_new = cursor.fetchone() is None
+
+        try:
+            cursor.execute(
+                """
+                CREATE VIRTUAL TABLE IF NOT EXISTS downloaded_tracks_fts USING fts5(
+                    title, artist, album, genre, label,
+                    content='downloaded_tracks',
+                    content_rowid='id',
+                    tokenize='unicode61 remove_diacritics 2',
+                    prefix='2 3'
+                )
+            """
+            )
+        except sqlite3.OperationalError as e:
+            # Поиск продолжит работать через LIKE
+            print(f"FTS5 недоступен, поиск по библиотеке без индекса: {e}")
+            return
+
+        columns = "title, artist, album, genre, label"
+        new_values = "NEW.title, NEW.artist, NEW.album, NEW.genre, NEW.label"
+        old_values = "OLD.title, OLD.artist, OLD.album, OLD.genre, OLD.label"
+        delete_old = f"""
+            INSERT INTO downloaded_tracks_fts (downloaded_tracks_fts, rowid, {columns})
+            VALUES ('delete', OLD.id, {old_values});
+        """
+        insert_new = f"""
+            INSERT INTO downloaded_tracks_fts (rowid, {columns})
+            VALUES (NEW.id, {new_values});
+        """
+
+        cursor.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS trg_downloaded_tracks_fts_insert
+            AFTER INSERT ON downloaded_tracks
+            BEGIN {insert_new} END
+        """
+        )
+        cursor.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS trg_downloaded_tracks_fts_delete
+            AFTER DELETE ON downloaded_tracks
+            BEGIN {delete_old} END
+        """
+        )
+        cursor.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS trg_downloaded_tracks_fts_update
+            AFTER UPDATE OF {columns} ON downloaded_tracks
+            BEGIN {delete_old} {insert_new} END
+        """
+        )
+
+        # Существующая библиотека: строим индекс по всем строкам один раз
+        if is_new:
+            cursor.execute(
+                "INSERT INTO downloaded_tracks_fts (downloaded_tracks_fts) VALUES ('rebuild')"
+            )
+
+        self.fts_enabled = True
+
+    def _init_cover_store(self, cursor) -> bool:
+        """
+        Хранилище обложек с адресацией по содержимому
+
+        Каждая обложка хранится в covers один раз под своим SHA-256, строки
+        downloaded_tracks ссылаются на неё через cover_hash. Треки одного
+        альбома делят одну обложку, а таблица треков не тянет за собой
+        страницы переполнения с картинками при сканировании и поиске.
+        Обложка удаляется триггером, когда на неё не остаётся ссылок.
+
+        Returns:
+            True, если обложки были перенесены из старого столбца cover_data
+        """
+        cursor.execute(
+            """
+            CREATE TABLE IF NOT EXISTS covers (
+                hash TEXT PRIMARY KEY,
+                data BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                created_at TEXT DEFAULT CURRENT_TIMESTAMP
+            )
+        """
+        )
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_downloaded_tracks_cover_hash ON downloaded_tracks(cover_hash)"
+        )
+
+        # Удалить обложку OLD, если на неё больше никто не ссылается
+        prune_old = """
+            DELETE FROM covers
+            WHERE hash = OLD.cover_hash
+              AND NOT EXISTS (
+                  SELECT 1 FROM downloaded_tracks WHERE cover_hash = OLD.cover_hash
+              );
+        """
+        cursor.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS trg_downloaded_tracks_cover_delete
+            AFTER DELETE ON downloaded_tracks
+            WHEN OLD.cover_hash IS NOT NULL
+            BEGIN {prune_old} END
+        """
+        )
+        cursor.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS trg_downloaded_tracks_cover_update
+            AFTER UPDATE OF cover_hash ON downloaded_tracks
+            WHEN OLD.cover_hash IS NOT NULL AND OLD.cover_hash IS NOT NEW.cover_hash
+            BEGIN {prune_old} END
+        """
+        )
+
+        cursor.execute("PRAGMA table_info(downloaded_tracks)")
+        if "cover_data" not in {row[1] for row in cursor.fetchall()}:
+            return False
+
+        # Старая схема: переносим BLOB-ы порциями и удаляем столбец
+        moved = 0
+        while True:
+            cursor.execute(
+                "SELECT id, cover_data FROM downloaded_tracks WHERE cover_data IS NOT NULL LIMIT ?",
+                (COVER_MIGRATION_BATCH,),
+            )
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            for track_row_id, data in rows:
+                cursor.execute(
+                    "UPDATE downloaded_tracks SET cover_hash = ?, cover_data = NULL WHERE id = ?",
+                    (self.store_cover(cursor, data), track_row_id),
+                )
+            moved += len(rows)
+
+        try:
+            cursor.execute("ALTER TABLE downloaded_tracks DROP COLUMN cover_data")
+        except sqlite3.OperationalError as e:
+            # SQLite старше 3.35: столбец остаётся, но уже пустой
+            print(f"Не удалось удалить столбец cover_data: {e}")
+
+        if moved:
+            print(f"Обложки перенесены в хранилище covers: {moved} треков")
+        return moved > 0
+
+    @staticmethod
+    def store_cover(conn, data: Optional[bytes]) -> Optional[str]:
+        """
+        Сохранить обложку в covers (внутри операции записи)
+
+        Returns:
+            SHA-256 обложки для столбца cover_hash или None, если обложки нет
+        """
+        if not data:
+            return None
+        cover_hash = hashlib.sha256(data).hexdigest()
+        conn.execute(
+            "INSERT OR IGNORE INTO covers (hash, data, size) VALUES (?, ?, ?)",
+            (cover_hash, data, len(data)),
+        )
+        return cover_hash
+
+    @staticmethod
+    def _search_query(search: str) -> Optional[str]:
+        """
+        Запрос FTS5 из строки поиска пользователя
+
+        Каждое слово ищется по префиксу ("битл" найдёт "Битлз"), все слова
+        обязательны. Слова берутся в кавычки, поэтому символы синтаксиса FTS5
+        в строке поиска не ломают запрос.
+
+        Returns:
+            Строка MATCH или None, если в поиске нет ни одного слова
+        """
+        words = re.findall(r"\w+", search)
+        if not words:
+            return None
+        return " ".join(f'"{word}"*' for word in words)
+
+    @staticmethod
+    def _rebuild_file_stats(cursor):
+        """Пересчитать file_stats по всей таблице downloaded_tracks"""
+        cursor.execute("DELETE FROM file_stats")
+        cursor.execute(
+            """
+            INSERT INTO file_stats (dimension, key, count, size)
+            SELECT 'total', '', COUNT(*), COALESCE(SUM(file_size), 0)
+            FROM downloaded_tracks
+        """
+        )
+        for dimension in ("format", "quality"):
+            cursor.execute(
+                f"""
+                INSERT INTO file_stats (dimension, key, count, size)
+                SELECT '{dimension}', {dimension}, COUNT(*), COALESCE(SUM(file_size), 0)
+                FROM downloaded_tracks
+                WHERE {dimension} IS NOT NULL
+                GROUP BY {dimension}
+            """
+            )
+
     # Методы для работы с токенами
     def get_all_tokens(self) -> List[Dict]:
         """Получить все токены"""
@@ -285,7 +832,8 @@ class DatabaseManager:
         is_active: bool = True,
     ) -> int:
         """Сохранить токен"""
-        with self.get_connection() as conn:
+
+        def operation(conn):
             cursor = conn.cursor()
 
             # Деактивируем все токены если новый активный
@@ -319,13 +867,14 @@ class DatabaseManager:
                     (name, token, token_type, username, int(is_active), now, now),
                 )
                 token_id = cursor.lastrowid
-
-            conn.commit()
             return token_id
 
+        return self.write(operation)
+
     def activate_token(self, token_id: int) -> bool:
         """Активировать токен"""
-        with self.get_connection() as conn:
+
+        def operation(conn):
             cursor = conn.cursor()
 
             # Деактивируем все токены
@@ -340,13 +889,14 @@ class DatabaseManager:
             """,
                 (datetime.now().isoformat(), token_id),
             )
-
-            conn.commit()
             return cursor.rowcount > 0
 
+        return self.write(operation)
+
     def deactivate_token(self, token_id: int) -> bool:
         """Деактивировать токен"""
-        with self.get_connection() as conn:
+
+        def operation(conn):
             cursor = conn.cursor()
 
             # Деактивируем конкретный токен
@@ -358,32 +908,36 @@ class DatabaseManager:
             """,
                 (token_id,),
             )
-
-            conn.commit()
             return cursor.rowcount > 0
 
+        return self.write(operation)
+
     def rename_token(self, token_id: int, new_name: str) -> bool:
         """Переименовать токен"""
-        with self.get_connection() as conn:
+
+        def operation(conn):
             cursor = conn.cursor()
 
             cursor.execute(
                 "UPDATE saved_tokens SET name = ? WHERE id = ?", (new_name, token_id)
             )
-            conn.commit()
             return cursor.rowcount > 0
 
+        return self.write(operation)
+
     def update_token_username(self, token_id: int, username: str) -> bool:
         """Обновить username токена"""
-        with self.get_connection() as conn:
+
+        def operation(conn):
             cursor = conn.cursor()
             cursor.execute(
                 "UPDATE saved_tokens SET username = ? WHERE id = ?",
                 (username, token_id),
             )
-            conn.commit()
             return cursor.rowcount > 0
 
+        return self.write(operation)
+
     def get_token_by_id(self, token_id: int) -> Optional[Dict]:
         """Получить токен по ID"""
         with self.get_connection() as conn:
@@ -411,12 +965,14 @@ class DatabaseManager:
 
     def delete_token(self, token_id: int) -> bool:
         """Удалить токен"""
-        with self.get_connection() as conn:
+
+        def operation(conn):
             cursor = conn.cursor()
             cursor.execute("DELETE FROM saved_tokens WHERE id = ?", (token_id,))
-            conn.commit()
             return cursor.rowcount > 0
 
+        return self.write(operation)
+
     # Методы для работы с едиными аккаунтами Яндекс.Музыки
     def get_all_accounts(self) -> List[Dict]:
         """Получить все аккаунты"""
@@ -505,7 +1061,8 @@ class DatabaseManager:
         subscription_details: str = None,
     ) -> int:
         """Сохранить аккаунт"""
-        with self.get_connection() as conn:
+
+        def operation(conn):
             cursor = conn.cursor()
 
             # Деактивируем все аккаунты если новый активный
@@ -567,13 +1124,14 @@ class DatabaseManager:
                     ),
                 )
                 account_id = cursor.lastrowid
-
-            conn.commit()
             return account_id
 
+        return self.write(operation)
+
     def activate_account(self, account_id: int) -> bool:
         """Активировать аккаунт"""
-        with self.get_connection() as conn:
+
+        def operation(conn):
             cursor = conn.cursor()
 
             # Деактивируем все аккаунты
@@ -588,13 +1146,14 @@ class DatabaseManager:
             """,
                 (datetime.now().isoformat(), datetime.now().isoformat(), account_id),
             )
-
-            conn.commit()
             return cursor.rowcount > 0
 
+        return self.write(operation)
+
     def deactivate_account(self, account_id: int) -> bool:
         """Деактивировать аккаунт"""
-        with self.get_connection() as conn:
+
+        def operation(conn):
             cursor = conn.cursor()
 
             # Деактивируем конкретный аккаунт
@@ -606,33 +1165,37 @@ class DatabaseManager:
             """,
                 (datetime.now().isoformat(), account_id),
             )
-
-            conn.commit()
             return cursor.rowcount > 0
 
+        return self.write(operation)
+
     def rename_account(self, account_id: int, new_name: str) -> bool:
         """Переименовать аккаунт"""
-        with self.get_connection() as conn:
+
+        def operation(conn):
             cursor = conn.cursor()
 
             cursor.execute(
                 "UPDATE yandex_accounts SET name = ?, updated_at = ? WHERE id = ?",
                 (new_name, datetime.now().isoformat(), account_id),
             )
-            conn.commit()
             return cursor.rowcount > 0
 
+        return self.write(operation)
+
     def update_account_username(self, account_id: int, username: str) -> bool:
         """Обновить username аккаунта"""
-        with self.get_connection() as conn:
+
+        def operation(conn):
             cursor = conn.cursor()
             cursor.execute(
                 "UPDATE yandex_accounts SET username = ?, updated_at = ? WHERE id = ?",
                 (username, datetime.now().isoformat(), account_id),
             )
-            conn.commit()
             return cursor.rowcount > 0
 
+        return self.write(operation)
+
     def update_account_subscription_info(
         self,
         account_id: int,
@@ -641,7 +1204,8 @@ class DatabaseManager:
         subscription_details: str = None,
     ) -> bool:
         """Обновить информацию о подписке аккаунта"""
-        with self.get_connection() as conn:
+
+        def operation(conn):
             cursor = conn.cursor()
             cursor.execute(
                 """
@@ -658,9 +1222,10 @@ class DatabaseManager:
                     account_id,
                 ),
             )
-            conn.commit()
             return cursor.rowcount > 0
 
+        return self.write(operation)
+
     def get_account_by_id(self, account_id: int) -> Optional[Dict]:
         """Получить аккаунт по ID"""
         with self.get_connection() as conn:
@@ -695,12 +1260,14 @@ class DatabaseManager:
 
     def delete_account(self, account_id: int) -> bool:
         """Удалить аккаунт"""
-        with self.get_connection() as conn:
+
+        def operation(conn):
             cursor = conn.cursor()
             cursor.execute("DELETE FROM yandex_accounts WHERE id = ?", (account_id,))
-            conn.commit()
             return cursor.rowcount > 0
 
+        return self.write(operation)
+
     # Методы для работы с настройками
     def get_setting(self, key: str, default: str = None) -> Optional[str]:
         """Получить настройку"""
@@ -712,7 +1279,8 @@ class DatabaseManager:
 
     def save_setting(self, key: str, value: str):
         """Сохранить настройку"""
-        with self.get_connection() as conn:
+
+        def operation(conn):
             cursor = conn.cursor()
 
             cursor.execute(
@@ -723,7 +1291,7 @@ class DatabaseManager:
                 (key, value, datetime.now().isoformat()),
             )
 
-            conn.commit()
+        self.write(operation)
 
     def get_all_settings(self) -> Dict[str, str]:
         """Получить все настройки"""
@@ -733,61 +1301,40 @@ class DatabaseManager:
             return {row[0]: row[1] for row in cursor.fetchall()}
 
     # Методы для работы с файлами и загрузками
-    def get_file_statistics(self) -> Dict:
-        """Получить статистику файлов"""
+    def get_file_totals(self) -> Tuple[int, float]:
+        """Количество файлов и их общий размер в МБ (из агрегатов file_stats)"""
         with self.get_connection() as conn:
             cursor = conn.cursor()
-
-            # Проверяем, существует ли таблица downloaded_tracks
             cursor.execute(
-                """
-                SELECT name FROM sqlite_master 
-                WHERE type='table' AND name='downloaded_tracks'
-            """
+                "SELECT count, size FROM file_stats WHERE dimension = 'total' AND key = ''"
             )
-            if not cursor.fetchone():
-                # Если таблица не существует, возвращаем пустую статистику
-                return {
-                    "totalFiles": 0,
-                    "totalSize": 0,
-                    "byFormat": {},
-                    "byQuality": {},
-                }
-
-            # Получаем общую статистику
-            cursor.execute("SELECT COUNT(*) FROM downloaded_tracks")
-            total_files = cursor.fetchone()[0]
+            row = cursor.fetchone()
+        if not row:
+            return 0, 0
+        return row[0], round(row[1], 2) or 0
 
-            cursor.execute(
-                "SELECT SUM(file_size) FROM downloaded_tracks WHERE file_size IS NOT NULL"
-            )
-            total_size = cursor.fetchone()[0] or 0
+    def get_file_statistics(self) -> Dict:
+        """Получить статистику файлов (из агрегатов file_stats)"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT dimension, key, count, size FROM file_stats")
 
-            # Статистика по форматам
-            cursor.execute(
-                """
-                SELECT format, COUNT(*) as count, SUM(file_size) as size
-                FROM downloaded_tracks 
-                WHERE format IS NOT NULL
-                GROUP BY format
-            """
-            )
+            total_files = 0
+            total_size = 0
             by_format = {}
-            for row in cursor.fetchall():
-                by_format[row[0]] = {"count": row[1], "size": row[2] or 0}
-
-            # Статистика по качеству
-            cursor.execute(
-                """
-                SELECT quality, COUNT(*) as count
-                FROM downloaded_tracks 
-                WHERE quality IS NOT NULL
-                GROUP BY quality
-            """
-            )
             by_quality = {}
-            for row in cursor.fetchall():
-                by_quality[row[0]] = row[1]
+            for dimension, key, count, size in cursor.fetchall():
+                # Размеры накапливаются сложением REAL — округляем как file_size
+                size = round(size, 2) or 0
+                if dimension == "total":
+                    total_files, total_size = count, size
+                elif count <= 0:
+                    # Формат/качество, файлов которых больше нет
+                    continue
+                elif dimension == "format":
+                    by_format[key] = {"count": count, "size": size}
+                elif dimension == "quality":
+                    by_quality[key] = count
 
             return {
                 "totalFiles": total_files,
@@ -797,29 +1344,19 @@ class DatabaseManager:
             }
 
     def update_file_statistics(self) -> Dict:
-        """Обновить и вернуть статистику файлов"""
-        # Получаем свежую статистику
-        stats = self.get_file_statistics()
-
-        # Сохраняем обновленную статистику в настройки для кэширования
-        with self.get_connection() as conn:
-            cursor = conn.cursor()
-
-            cursor.execute(
-                """
-                INSERT OR REPLACE INTO settings (key, value, updated_at) 
-                VALUES ('file_statistics', ?, ?)
-            """,
-                (json.dumps(stats), datetime.now().isoformat()),
-            )
-
-            conn.commit()
+        """
+        Пересчитать агрегаты статистики файлов и вернуть статистику
 
-        return stats
+        Агрегаты поддерживаются триггерами, полный пересчёт нужен только для
+        принудительного обновления (например, после ручного изменения БД).
+        """
+        self.write(lambda conn: self._rebuild_file_stats(conn.cursor()))
+        return self.get_file_statistics()
 
     def clear_download_queue(self) -> int:
         """Очистить очередь загрузок (удалить все треки из очереди)"""
-        with self.get_connection() as conn:
+
+        def operation(conn):
             cursor = conn.cursor()
 
             # Получаем количество записей перед удалением
@@ -828,13 +1365,15 @@ class DatabaseManager:
 
             # Удаляем все записи из очереди
             cursor.execute("DELETE FROM download_queue")
-            conn.commit()
 
             return count
 
+        return self.write(operation)
+
     def clear_download_queue_by_status(self, status: str) -> int:
         """Очистить очередь загрузок по статусу"""
-        with self.get_connection() as conn:
+
+        def operation(conn):
             cursor = conn.cursor()
 
             # Получаем количество записей перед удалением
@@ -845,18 +1384,20 @@ class DatabaseManager:
 
             # Удаляем записи с указанным статусом
             cursor.execute("DELETE FROM download_queue WHERE status = ?", (status,))
-            conn.commit()
 
             return count
 
+        return self.write(operation)
+
     def clear_file_statistics(self) -> bool:
         """Очистить статистику файлов (удалить кэшированную статистику)"""
         try:
-            with self.get_connection() as conn:
+            def operation(conn):
                 cursor = conn.cursor()
                 cursor.execute("DELETE FROM settings WHERE key = 'file_statistics'")
-                conn.commit()
                 return True
+
+            return self.write(operation)
         except Exception as e:
             print(f"Ошибка очистки статистики файлов: {e}")
             return False
@@ -879,7 +1420,7 @@ class DatabaseManager:
             cursor.execute(
                 """
                 SELECT track_id, title, artist, album, file_path, file_size, format, quality, 
-                       CASE WHEN cover_data IS NOT NULL THEN 1 ELSE 0 END as has_cover, 
+                       CASE WHEN cover_hash IS NOT NULL THEN 1 ELSE 0 END as has_cover, 
                        download_date, year, genre, label, isrc, duration, version
                 FROM downloaded_tracks
                 ORDER BY download_date DESC
@@ -975,34 +1516,33 @@ class DatabaseManager:
                         }
                     )
 
-            # Удаляем записи о несуществующих файлах
-            deleted_count = 0
-            if missing_files:
-                for missing_file in missing_files:
-                    # Удаляем из downloaded_tracks
-                    cursor.execute(
-                        "DELETE FROM downloaded_tracks WHERE id = ?",
-                        (missing_file["id"],),
-                    )
-
-                    # Также удаляем из download_queue если есть
-                    cursor.execute(
-                        "DELETE FROM download_queue WHERE track_id = ? AND playlist_id = ?",
-                        (missing_file["track_id"], missing_file["playlist_id"]),
-                    )
+        # Удаляем записи о несуществующих файлах (проверка файлов — вне потока записи)
+        def operation(conn):
+            cursor = conn.cursor()
+            for missing_file in missing_files:
+                # Удаляем из downloaded_tracks
+                cursor.execute(
+                    "DELETE FROM downloaded_tracks WHERE id = ?",
+                    (missing_file["id"],),
+                )
 
-                    deleted_count += 1
+                # Также удаляем из download_queue если есть
+                cursor.execute(
+                    "DELETE FROM download_queue WHERE track_id = ? AND playlist_id = ?",
+                    (missing_file["track_id"], missing_file["playlist_id"]),
+                )
+            return len(missing_files)
 
-                conn.commit()
+        deleted_count = self.write(operation) if missing_files else 0
 
-            return {
-                "total_checked": total_files,
-                "existing_files": len(existing_files),
-                "missing_files": len(missing_files),
-                "deleted_records": deleted_count,
-                "missing_file_details": missing_files,
-                "checked_tables": ["downloaded_tracks"],
-            }
+        return {
+            "total_checked": total_files,
+            "existing_files": len(existing_files),
+            "missing_files": len(missing_files),
+            "deleted_records": deleted_count,
+            "missing_file_details": missing_files,
+            "checked_tables": ["downloaded_tracks"],
+        }
 
     def get_downloaded_tracks(
         self,
@@ -1014,8 +1554,23 @@ class DatabaseManager:
         search: str = None,
         limit: int = 100,
         offset: int = 0,
+        after: str = None,
     ) -> List[Dict]:
-        """Получить список загруженных треков"""
+        """
+        Получить список загруженных треков
+
+        Поиск идёт по полнотекстовому индексу (по началу слов в названии,
+        исполнителе, альбоме, жанре и лейбле), результаты упорядочены по
+        релевантности. Без FTS5 — прежний поиск через LIKE.
+
+        Без поиска треки идут от новых к старым по (download_date, id), и
+        следующая страница запрашивается курсором after (см.
+        utils/pagination.py) — глубина страницы не влияет на её стоимость.
+        Результаты поиска упорядочены по релевантности и листаются через offset.
+
+        Raises:
+            ValueError: Некорректный курсор after
+        """
         with self.get_connection() as conn:
             cursor = conn.cursor()
 
@@ -1030,44 +1585,64 @@ class DatabaseManager:
                 return []
 
             query = """
-                SELECT track_id, title, artist, album, playlist_id, file_path, file_size, format, quality, 
-                       CASE WHEN cover_data IS NOT NULL THEN 1 ELSE 0 END as has_cover, 
-                       download_date, year, genre, label, isrc, duration, version
-                FROM downloaded_tracks
+                SELECT d.id, d.track_id, d.title, d.artist, d.album, d.playlist_id, d.file_path,
+                       d.file_size, d.format, d.quality,
+                       CASE WHEN d.cover_hash IS NOT NULL THEN 1 ELSE 0 END as has_cover, 
+                       d.download_date, d.year, d.genre, d.label, d.isrc, d.duration, d.version
+                FROM downloaded_tracks d
             """
             params = []
             conditions = []
 
+            match = self._search_query(search) if search and self.fts_enabled else None
+            if match:
+                # Кандидаты берутся из индекса, а не полным сканированием таблицы
+                query += " JOIN downloaded_tracks_fts ON downloaded_tracks_fts.rowid = d.id"
+                conditions.append("downloaded_tracks_fts MATCH ?")
+                params.append(match)
+                weights = ", ".join(str(weight) for weight in SEARCH_RANK_WEIGHTS)
+            elif search:
+                conditions.append("(d.title LIKE ? OR d.artist LIKE ? OR d.album LIKE ?)")
+                search_pattern = f"%{search}%"
+                params.extend([search_pattern, search_pattern, search_pattern])
+
             if playlist_id:
-                conditions.append("playlist_id = ?")
+                conditions.append("d.playlist_id = ?")
                 params.append(playlist_id)
 
             if quality:
-                conditions.append("quality = ?")
+                conditions.append("d.quality = ?")
                 params.append(quality)
 
             if year:
-                conditions.append("year = ?")
+                conditions.append("d.year = ?")
                 params.append(year)
 
             if genre:
-                conditions.append("genre = ?")
+                conditions.append("d.genre = ?")
                 params.append(genre)
 
             if label:
-                conditions.append("label = ?")
+                conditions.append("d.label = ?")
                 params.append(label)
 
-            if search:
-                conditions.append("(title LIKE ? OR artist LIKE ? OR album LIKE ?)")
-                search_pattern = f"%{search}%"
-                params.extend([search_pattern, search_pattern, search_pattern])
-
-            if conditions:
+            if match:
                 query += " WHERE " + " AND ".join(conditions)
-
-            query += " ORDER BY download_date DESC LIMIT ? OFFSET ?"
-            params.extend([limit, offset])
+                query += (
+                    f" ORDER BY bm25(downloaded_tracks_fts, {weights}), d.download_date DESC"
+                    " LIMIT ? OFFSET ?"
+                )
+                params.extend([limit, offset])
+            else:
+                # Keyset: продолжаем сразу после последней строки предыдущей страницы
+                if after:
+                    conditions.append("(d.download_date, d.id) < (?, ?)")
+                    params.extend(decode_cursor(after, 2))
+                    offset = 0
+                if conditions:
+                    query += " WHERE " + " AND ".join(conditions)
+                query += " ORDER BY d.download_date DESC, d.id DESC LIMIT ? OFFSET ?"
+                params.extend([limit, offset])
 
             cursor.execute(query, params)
 
@@ -1075,30 +1650,286 @@ class DatabaseManager:
             for row in cursor.fetchall():
                 tracks.append(
                     {
-                        "track_id": row[0],
-                        "title": row[1],
-                        "artist": row[2],
-                        "album": row[3],
-                        "playlist_id": row[4],
-                        "file_path": row[5],
-                        "file_size": row[6],
-                        "format": row[7],
-                        "quality": row[8],
-                        "has_cover": bool(row[9]),
-                        "download_date": row[10],
-                        "year": row[11],
-                        "genre": row[12],
-                        "label": row[13],
-                        "isrc": row[14],
-                        "duration": row[15],
-                        "version": row[16],
+                        "id": row[0],
+                        "track_id": row[1],
+                        "title": row[2],
+                        "artist": row[3],
+                        "album": row[4],
+                        "playlist_id": row[5],
+                        "file_path": row[6],
+                        "file_size": row[7],
+                        "format": row[8],
+                        "quality": row[9],
+                        "has_cover": bool(row[10]),
+                        "download_date": row[11],
+                        "year": row[12],
+                        "genre": row[13],
+                        "label": row[14],
+                        "isrc": row[15],
+                        "duration": row[16],
+                        "version": row[17],
                     }
                 )
 
             return tracks
 
-    def get_download_queue(self) -> List[Dict]:
-        """Получить очередь загрузок"""
+    def get_track_metadata(
+        self, track_ids: List[str], max_age: float = None
+    ) -> Dict[str, Dict]:
+        """
+        Получить метаданные треков из кэша
+
+        Args:
+            track_ids: ID треков
+            max_age: Максимальный возраст записи в секундах (None — любой)
+
+        Returns:
+            Словарь track_id -> запись кэша (только найденные и не устаревшие)
+        """
+        min_fetched_at = time.time() - max_age if max_age is not None else 0
+        ids = list(dict.fromkeys(str(track_id) for track_id in track_ids))
+        result = {}
+
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            for i in range(0, len(ids), SQL_IN_CHUNK):
+                chunk = ids[i : i + SQL_IN_CHUNK]
+                placeholders = ", ".join("?" * len(chunk))
+                cursor.execute(
+                    f"""
+                    SELECT track_id, title, artists, album, year, genre, label, isrc,
+                           duration, cover_uri, available, data, fetched_at
+                    FROM track_metadata
+                    WHERE track_id IN ({placeholders}) AND fetched_at >= ?
+                """,
+                    (*chunk, min_fetched_at),
+                )
+                columns = [description[0] for description in cursor.description]
+                for row in cursor.fetchall():
+                    result[row[0]] = dict(zip(columns, row))
+
+        return result
+
+    def save_track_metadata(self, rows: List[Dict]):
+        """
+        Сохранить метаданные треков в кэш
+
+        Args:
+            rows: Записи с ключами столбцов track_metadata (кроме fetched_at)
+        """
+        fetched_at = time.time()
+        values = [
+            (
+                row["track_id"],
+                row.get("title"),
+                row.get("artists"),
+                row.get("album"),
+                row.get("year"),
+                row.get("genre"),
+                row.get("label"),
+                row.get("isrc"),
+                row.get("duration"),
+                row.get("cover_uri"),
+                1 if row.get("available", True) else 0,
+                row["data"],
+                fetched_at,
+            )
+            for row in rows
+        ]
+
+        self.write(
+            lambda conn: conn.executemany(
+                """
+                INSERT OR REPLACE INTO track_metadata
+                (track_id, title, artists, album, year, genre, label, isrc,
+                 duration, cover_uri, available, data, fetched_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+                values,
+            )
+        )
+
+    def save_playlist_tracks(
+        self, playlist_id: str, tracks: List[Dict], revision: int = None
+    ):
+        """
+        Сохранить состав плейлиста в кэш
+
+        Args:
+            playlist_id: ID плейлиста в Яндекс.Музыке
+            tracks: Треки в формате YandexMusicClient.get_playlist_tracks
+            revision: Ревизия плейлиста, которой соответствует состав
+        """
+        playlist_name = (
+            tracks[0].get("playlist_name", "Unknown Playlist") if tracks else None
+        )
+        rows = [
+            (playlist_id, position, track["id"], 1 if track.get("available", False) else 0)
+            for position, track in enumerate(tracks)
+            if track.get("id")
+        ]
+
+        def operation(conn):
+            conn.execute(
+                "DELETE FROM playlist_cache_tracks WHERE playlist_id = ?", (playlist_id,)
+            )
+            conn.executemany(
+                """
+                INSERT INTO playlist_cache_tracks (playlist_id, position, track_id, available)
+                VALUES (?, ?, ?, ?)
+            """,
+                rows,
+            )
+            conn.execute(
+                """
+                INSERT OR REPLACE INTO playlist_cache
+                (playlist_id, playlist_name, track_count, revision, fetched_at)
+                VALUES (?, ?, ?, ?, ?)
+            """,
+                (playlist_id, playlist_name, len(rows), revision, time.time()),
+            )
+
+        self.write(operation)
+
+    def get_playlist_snapshot(self, playlist_id: str) -> Optional[Dict]:
+        """
+        Получить сохранённый снимок состава плейлиста
+
+        Returns:
+            Словарь с ревизией и списком (track_id, available) в порядке
+            плейлиста или None, если снимка нет
+        """
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT playlist_name, revision, fetched_at FROM playlist_cache WHERE playlist_id = ?",
+                (playlist_id,),
+            )
+            row = cursor.fetchone()
+            if not row:
+                return None
+
+            cursor.execute(
+                """
+                SELECT track_id, available FROM playlist_cache_tracks
+                WHERE playlist_id = ?
+                ORDER BY position
+            """,
+                (playlist_id,),
+            )
+            return {
+                "playlist_name": row[0],
+                "revision": row[1],
+                "fetched_at": row[2],
+                "tracks": [(track_id, bool(available)) for track_id, available in cursor.fetchall()],
+            }
+
+    def get_playlist_track_stats(
+        self, playlist_id: str, max_age: float = None
+    ) -> Optional[Dict]:
+        """
+        Статистика плейлиста по кэшу его состава
+
+        Доступные треки плейлиста сопоставляются с очередью и загруженными
+        треками одним запросом. Трек в очереди не считается загруженным.
+
+        Args:
+            playlist_id: ID плейлиста в Яндекс.Музыке
+            max_age: Максимальный возраст кэша в секундах (None — любой)
+
+        Returns:
+            Словарь со счётчиками или None, если кэша нет или он устарел
+        """
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT playlist_name, fetched_at FROM playlist_cache WHERE playlist_id = ?",
+                (playlist_id,),
+            )
+            cached = cursor.fetchone()
+            if not cached:
+                return None
+            playlist_name, fetched_at = cached
+            if max_age is not None and time.time() - fetched_at > max_age:
+                return None
+
+            cursor.execute(
+                """
+                WITH candidates AS (
+                    SELECT c.track_id,
+                           EXISTS (
+                               SELECT 1 FROM download_queue q
+                               WHERE q.track_id = c.track_id AND q.playlist_id = :name
+                           ) AS queued,
+                           EXISTS (
+                               SELECT 1 FROM downloaded_tracks d
+                               WHERE d.track_id = c.track_id AND d.playlist_id = :name
+                           ) AS downloaded
+                    FROM playlist_cache_tracks c
+                    WHERE c.playlist_id = :playlist_id AND c.available = 1
+                )
+                SELECT COUNT(*),
+                       COALESCE(SUM(queued), 0),
+                       COALESCE(SUM(downloaded AND NOT queued), 0)
+                FROM candidates
+            """,
+                {"playlist_id": playlist_id, "name": playlist_name},
+            )
+            total_tracks, queued_tracks, downloaded_tracks = cursor.fetchone()
+
+        return {
+            "playlist_id": playlist_id,
+            "total_tracks": total_tracks,
+            "queued_tracks": queued_tracks,
+            "downloaded_tracks": downloaded_tracks,
+            "available_tracks": total_tracks - queued_tracks - downloaded_tracks,
+            "cached_at": datetime.fromtimestamp(fetched_at).isoformat(),
+        }
+
+    def get_track_cover(self, track_id: str) -> Optional[bytes]:
+        """Получить обложку загруженного трека из хранилища covers"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                SELECT c.data
+                FROM downloaded_tracks d
+                JOIN covers c ON c.hash = d.cover_hash
+                WHERE d.track_id = ?
+                LIMIT 1
+            """,
+                (track_id,),
+            )
+            row = cursor.fetchone()
+            return row[0] if row else None
+
+    def set_track_cover(self, track_id: str, data: bytes):
+        """
+        Сохранить обложку загруженного трека (без ожидания коммита)
+
+        Returns:
+            Future с числом обновлённых строк
+        """
+
+        def operation(conn):
+            cover_hash = self.store_cover(conn, data)
+            return conn.execute(
+                "UPDATE downloaded_tracks SET cover_hash = ? WHERE track_id = ?",
+                (cover_hash, track_id),
+            ).rowcount
+
+        return self.write_async(operation)
+
+    def get_download_queue(self, limit: int = None, after: str = None) -> List[Dict]:
+        """
+        Получить очередь загрузок
+
+        Args:
+            limit: Размер страницы; без него возвращается вся очередь
+            after: Курсор предыдущей страницы (ключ created_at, id)
+
+        Постранично очередь отдаётся по возрастанию (created_at, id)
+        """
         with self.get_connection() as conn:
             cursor = conn.cursor()
 
@@ -1112,13 +1943,21 @@ class DatabaseManager:
             if not cursor.fetchone():
                 return []
 
-            cursor.execute(
-                """
+            query = """
                 SELECT id, track_id, title, artist, album, playlist_id, cover, status, progress, quality, error_message, created_at, updated_at
                 FROM download_queue
-                ORDER BY created_at DESC
             """
-            )
+            params = []
+            if limit:
+                if after:
+                    query += " WHERE (created_at, id) > (?, ?)"
+                    params.extend(decode_cursor(after, 2))
+                query += " ORDER BY created_at, id LIMIT ?"
+                params.append(limit)
+            else:
+                query += " ORDER BY created_at DESC"
+
+            cursor.execute(query, params)
 
             queue = []
             for row in cursor.fetchall():
@@ -1144,7 +1983,8 @@ class DatabaseManager:
 
     def retry_download(self, track_id: str) -> bool:
         """Повторить загрузку трека"""
-        with self.get_connection() as conn:
+
+        def operation(conn):
             cursor = conn.cursor()
 
             # Проверяем, существует ли таблица download_queue
@@ -1160,18 +2000,20 @@ class DatabaseManager:
             cursor.execute(
                 """
                 UPDATE download_queue 
-                SET status = 'pending', progress = 0, error_message = NULL, updated_at = ?
+                SET status = 'pending', progress = 0, error_message = NULL, updated_at = ?,
+                    lease_owner = NULL, lease_expires_at = NULL, heartbeat_at = NULL
                 WHERE track_id = ?
             """,
                 (datetime.now().isoformat(), track_id),
             )
-
-            conn.commit()
             return cursor.rowcount > 0
 
+        return self.write(operation)
+
     def cancel_download(self, track_id: str) -> bool:
         """Отменить загрузку трека"""
-        with self.get_connection() as conn:
+
+        def operation(conn):
             cursor = conn.cursor()
 
             # Проверяем, существует ли таблица download_queue
@@ -1185,12 +2027,14 @@ class DatabaseManager:
                 return False
 
             cursor.execute("DELETE FROM download_queue WHERE track_id = ?", (track_id,))
-            conn.commit()
             return cursor.rowcount > 0
 
+        return self.write(operation)
+
     def update_download_progress(self, track_id: str, progress: int) -> bool:
         """Обновить прогресс загрузки трека"""
-        with self.get_connection() as conn:
+
+        def operation(conn):
             cursor = conn.cursor()
 
             # Проверяем, существует ли таблица download_queue
@@ -1212,10 +2056,303 @@ class DatabaseManager:
             """,
                 (progress, datetime.now().isoformat(), track_id),
             )
-
-            conn.commit()
             return cursor.rowcount > 0
 
+        return self.write(operation)
+
+    # Аренда (lease) строк очереди: захват, продление, освобождение
+    def claim_next_download(self, owner: str, lease_seconds: float) -> Optional[Dict]:
+        """
+        Атомарно захватить следующий трек очереди
+
+        Берётся самая старая строка в статусе queued либо downloading с истёкшей
+        арендой (воркер упал). Выборка и обновление выполняются потоком-писателем
+        в одной транзакции BEGIN IMMEDIATE, поэтому ни другой воркер, ни другой
+        процесс с той же БД не получит ту же строку.
+
+        Args:
+            owner: Идентификатор владельца аренды (хост:pid:экземпляр:воркер)
+            lease_seconds: Срок аренды в секундах
+
+        Returns:
+            Строка очереди или None, если захватывать нечего
+        """
+
+        def operation(conn):
+            cursor = conn.cursor()
+            now = time.time()
+
+            cursor.execute(
+                """
+                SELECT id, track_id, title, artist, album, playlist_id, cover, quality
+                FROM download_queue
+                WHERE status = 'queued'
+                   OR (status = 'downloading'
+                       AND (lease_expires_at IS NULL OR lease_expires_at < ?))
+                ORDER BY created_at ASC, id ASC
+                LIMIT 1
+            """,
+                (now,),
+            )
+            row = cursor.fetchone()
+
+            if not row:
+                return None
+
+            cursor.execute(
+                """
+                UPDATE download_queue
+                SET status = 'downloading', progress = 0, error_message = NULL,
+                    lease_owner = ?, lease_expires_at = ?, heartbeat_at = ?,
+                    updated_at = ?
+                WHERE id = ?
+            """,
+                (
+                    owner,
+                    now + lease_seconds,
+                    now,
+                    datetime.now().isoformat(),
+                    row["id"],
+                ),
+            )
+
+            return {
+                "db_id": row["id"],
+                "track_id": row["track_id"],
+                "title": row["title"],
+                "artist": row["artist"],
+                "album": row["album"],
+                "playlist": row["playlist_id"],
+                "cover": row["cover"],
+                "quality": row["quality"],
+                "lease_owner": owner,
+            }
+
+        return self.write(operation)
+
+    def bulk_enqueue_tracks(
+        self, tracks: List[Dict], quality: str, status: str = "queued"
+    ) -> Dict[str, int]:
+        """
+        Массово добавить треки в очередь одной транзакцией
+
+        Кандидаты загружаются во временную таблицу, дубликаты отсеиваются
+        запросами над множествами (JOIN с download_queue и downloaded_tracks),
+        новые строки вставляются одним INSERT ... SELECT.
+
+        Трек считается:
+          • existing — уже есть в очереди для этого плейлиста (или повторяется в списке);
+          • already_downloaded — уже скачан для этого плейлиста (по track_id
+            либо по названию и исполнителю).
+
+        Args:
+            tracks: List[{id, title, artist, album, playlist_name, cover}]
+            quality: Качество загрузки
+            status: Статус новых строк очереди
+
+        Returns:
+            {added, existing, already_downloaded}
+        """
+        now = datetime.now().isoformat()
+        candidates = [
+            (
+                seq,
+                str(track["id"]),
+                track["title"],
+                track["artist"],
+                track.get("album", "Unknown Album"),
+                track.get("playlist_name", "Unknown Playlist"),
+                track.get("cover"),
+            )
+            for seq, track in enumerate(tracks)
+        ]
+
+        def operation(conn):
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                CREATE TEMP TABLE IF NOT EXISTS enqueue_candidates (
+                    seq INTEGER PRIMARY KEY,
+                    track_id TEXT NOT NULL,
+                    title TEXT,
+                    artist TEXT,
+                    album TEXT,
+                    playlist_id TEXT,
+                    cover TEXT,
+                    outcome TEXT
+                )
+            """
+            )
+            cursor.execute(
+                "CREATE INDEX IF NOT EXISTS temp.idx_enqueue_candidates_key "
+                "ON enqueue_candidates(track_id, playlist_id, seq)"
+            )
+
+            cursor.execute("DELETE FROM enqueue_candidates")
+            cursor.executemany(
+                """
+                INSERT INTO enqueue_candidates
+                (seq, track_id, title, artist, album, playlist_id, cover)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+                candidates,
+            )
+
+            # Уже в очереди для этого плейлиста
+            cursor.execute(
+                """
+                UPDATE enqueue_candidates SET outcome = 'existing'
+                WHERE EXISTS (
+                    SELECT 1 FROM download_queue q
+                    WHERE q.track_id = enqueue_candidates.track_id
+                      AND q.playlist_id = enqueue_candidates.playlist_id
+                )
+            """
+            )
+
+            # Уже скачан для этого плейлиста (по ID или по названию и исполнителю)
+            cursor.execute(
+                """
+                UPDATE enqueue_candidates SET outcome = 'already_downloaded'
+                WHERE outcome IS NULL
+                  AND (
+                    EXISTS (
+                        SELECT 1 FROM downloaded_tracks d
+                        WHERE d.track_id = enqueue_candidates.track_id
+                          AND d.playlist_id = enqueue_candidates.playlist_id
+                    )
+                    OR EXISTS (
+                        SELECT 1 FROM downloaded_tracks d
+                        WHERE d.title = enqueue_candidates.title
+                          AND d.artist = enqueue_candidates.artist
+                          AND d.playlist_id = enqueue_candidates.playlist_id
+                    )
+                  )
+            """
+            )
+
+            # Повторы внутри списка: добавляется только первое вхождение
+            cursor.execute(
+                """
+                UPDATE enqueue_candidates SET outcome = 'existing'
+                WHERE outcome IS NULL
+                  AND seq > (
+                    SELECT MIN(c.seq) FROM enqueue_candidates c
+                    WHERE c.track_id = enqueue_candidates.track_id
+                      AND c.playlist_id = enqueue_candidates.playlist_id
+                  )
+            """
+            )
+
+            cursor.execute(
+                """
+                INSERT INTO download_queue (
+                    track_id, title, artist, album, playlist_id, cover,
+                    status, progress, quality, created_at, updated_at
+                )
+                SELECT track_id, title, artist, album, playlist_id, cover,
+                       ?, 0, ?, ?, ?
+                FROM enqueue_candidates
+                WHERE outcome IS NULL
+                ORDER BY seq
+            """,
+                (status, quality, now, now),
+            )
+            added = cursor.rowcount
+
+            cursor.execute(
+                """
+                SELECT outcome, COUNT(*) FROM enqueue_candidates
+                WHERE outcome IS NOT NULL
+                GROUP BY outcome
+            """
+            )
+            counts = dict(cursor.fetchall())
+
+            cursor.execute("DELETE FROM enqueue_candidates")
+
+            return {
+                "added": added,
+                "existing": counts.get("existing", 0),
+                "already_downloaded": counts.get("already_downloaded", 0),
+            }
+
+        return self.write(operation)
+
+    def get_next_queued_tracks(self, limit: int) -> List[Dict]:
+        """Следующие треки очереди в порядке захвата (для предзагрузки ссылок)"""
+        with self.get_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                SELECT track_id, quality
+                FROM download_queue
+                WHERE status = 'queued'
+                ORDER BY created_at ASC, id ASC
+                LIMIT ?
+            """,
+                (limit,),
+            )
+            return [
+                {"track_id": row[0], "quality": row[1] or "lossless"}
+                for row in cursor.fetchall()
+            ]
+
+    def renew_download_leases(self, owner_prefix: str, lease_seconds: float) -> int:
+        """Продлить аренду всех строк, захваченных воркерами данного процесса (heartbeat)"""
+
+        def operation(conn):
+            cursor = conn.cursor()
+            now = time.time()
+            cursor.execute(
+                """
+                UPDATE download_queue
+                SET lease_expires_at = ?, heartbeat_at = ?
+                WHERE status = 'downloading' AND substr(lease_owner, 1, ?) = ?
+            """,
+                (now + lease_seconds, now, len(owner_prefix) + 1, owner_prefix + ":"),
+            )
+            return cursor.rowcount
+
+        return self.write(operation)
+
+    def release_download_leases(self, owner_prefix: str) -> int:
+        """Вернуть в queued треки, захваченные воркерами данного процесса (остановка очереди)"""
+
+        def operation(conn):
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                UPDATE download_queue
+                SET status = 'queued', progress = 0, updated_at = ?,
+                    lease_owner = NULL, lease_expires_at = NULL, heartbeat_at = NULL
+                WHERE status = 'downloading' AND substr(lease_owner, 1, ?) = ?
+            """,
+                (datetime.now().isoformat(), len(owner_prefix) + 1, owner_prefix + ":"),
+            )
+            return cursor.rowcount
+
+        return self.write(operation)
+
+    def recover_expired_leases(self) -> int:
+        """Вернуть в queued треки, аренда которых истекла (упавшие воркеры/процессы)"""
+
+        def operation(conn):
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                UPDATE download_queue
+                SET status = 'queued', progress = 0, updated_at = ?,
+                    lease_owner = NULL, lease_expires_at = NULL, heartbeat_at = NULL
+                WHERE status = 'downloading'
+                  AND (lease_expires_at IS NULL OR lease_expires_at < ?)
+            """,
+                (datetime.now().isoformat(), time.time()),
+            )
+            return cursor.rowcount
+
+        return self.write(operation)
+
     def get_download_queue_stats(self) -> Dict:
         """Получить статистику очереди загрузок"""
         with self.get_connection() as conn:
@@ -1279,7 +2416,7 @@ class DatabaseManager:
         if not track_ids:
             return 0
 
-        with self.get_connection() as conn:
+        def operation(conn):
             cursor = conn.cursor()
 
             # Создаем плейсхолдеры для IN запроса
@@ -1292,9 +2429,10 @@ class DatabaseManager:
             )
 
             removed_count = cursor.rowcount
-            conn.commit()
             return removed_count
 
+        return self.write(operation)
+
     def bulk_remove_from_queue(
         self, track_ids: List[str], batch_size: int = 1000
     ) -> int:
@@ -1316,7 +2454,7 @@ class DatabaseManager:
         if not track_ids:
             return 0
 
-        with self.get_connection() as conn:
+        def operation(conn):
             cursor = conn.cursor()
 
             # Создаем плейсхолдеры для IN запроса
@@ -1333,12 +2471,14 @@ class DatabaseManager:
             )
 
             updated_count = cursor.rowcount
-            conn.commit()
             return updated_count
 
+        return self.write(operation)
+
     def clear_completed_downloads(self) -> int:
         """Очистить завершенные загрузки из очереди"""
-        with self.get_connection() as conn:
+
+        def operation(conn):
             cursor = conn.cursor()
 
             # Проверяем, существует ли таблица download_queue
@@ -1354,10 +2494,11 @@ class DatabaseManager:
             # Удаляем завершенные загрузки
             cursor.execute("DELETE FROM download_queue WHERE status = 'completed'")
             deleted_count = cursor.rowcount
-            conn.commit()
 
             return deleted_count
 
+        return self.write(operation)
+
     def get_playlist_settings(self) -> Dict:
         """
         Получить настройки обработки плейлистов
@@ -1400,7 +2541,8 @@ class DatabaseManager:
         Returns:
             True если успешно
         """
-        with self.get_connection() as conn:
+
+        def operation(conn):
             cursor = conn.cursor()
 
             for key, value in settings.items():
@@ -1424,10 +2566,9 @@ class DatabaseManager:
                 """,
                     (db_key, db_value),
                 )
-
-            conn.commit()
             return True
 
+        return self.write(operation)
 
 # Глобальный экземпляр менеджера БД
 db_manager = DatabaseManager()
@@ -0,0 +1,275 @@
+"""
+Единственный поток записи в SQLite с групповыми коммитами
+
+SQLite допускает одного писателя за раз. Когда пишут обработчики запросов,
+воркеры очереди и фоновые потоки, они соревнуются за блокировку базы и ждут
+друг друга через busy_timeout. Здесь все изменения идут через один поток:
+операции попадают в очередь, поток выполняет их пачкой в одной транзакции
+и делает один COMMIT на всю пачку (group commit).
+
+Пачка собирается в коротком окне: не дольше WRITE_BATCH_WINDOW секунд и не
+больше WRITE_BATCH_MAX операций; если новых операций нет дольше
+WRITE_BATCH_IDLE, пачка коммитится сразу. Каждая операция выполняется в своей
+точке сохранения (SAVEPOINT), поэтому ошибка одной операции не откатывает
+остальные.
+Вызывающий получает Future, который завершается после COMMIT.
+"""
+
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+logger = logging.getLogger("db_writer")
+
+# Окно сбора пачки после первой операции (секунды)
+WRITE_BATCH_WINDOW = 0.005
+
+# Пачка закрывается раньше окна, если очередь простаивает столько секунд
+WRITE_BATCH_IDLE = 0.0005
+
+# Максимум операций в одной транзакции
+WRITE_BATCH_MAX = 256
+
+# Операция записи: получает соединение писателя, не делает commit/rollback сама
+WriteOperation = Callable[[sqlite3.Connection], Any]
+
+
+class DatabaseWriter:
+    """Поток-писатель: очередь операций и групповые коммиты"""
+
+    def __init__(
+        self,
+        connect: Callable[[], sqlite3.Connection],
+        batch_window: float = WRITE_BATCH_WINDOW,
+        batch_max: int = WRITE_BATCH_MAX,
+        batch_idle: float = WRITE_BATCH_IDLE,
+    ):
+        """
+        Args:
+            connect: Функция, открывающая соединение писателя
+            batch_window: Окно сбора пачки в секундах
+            batch_max: Максимум операций в пачке
+            batch_idle: Простой очереди, после которого пачка коммитится
+        """
+        self.connect = connect
+        self.batch_window = batch_window
+        self.batch_max = batch_max
+        self.batch_idle = batch_idle
+        self._queue: "queue.Queue[Optional[tuple]]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._conn: Optional[sqlite3.Connection] = None
+        self._stats = {
+            "operations": 0,
+            "batches": 0,
+            "failed_operations": 0,
+            "failed_batches": 0,
+            "max_batch": 0,
+            "busy_seconds": 0.0,
+            "wait_seconds": 0.0,
+        }
+
+    # Постановка операций в очередь
+    def submit(self, operation: WriteOperation) -> Future:
+        """
+        Поставить операцию в очередь записи
+
+        Returns:
+            Future с результатом операции (после COMMIT пачки)
+        """
+        future: Future = Future()
+        if self.in_writer_thread():
+            # Вложенный вызов из операции — выполняем в текущей транзакции
+            try:
+                future.set_result(operation(self._conn))
+            except BaseException as e:
+                future.set_exception(e)
+            return future
+
+        self._ensure_started()
+        self._queue.put((operation, future, time.perf_counter()))
+        return future
+
+    def run(self, operation: WriteOperation, timeout: Optional[float] = None) -> Any:
+        """Выполнить операцию и дождаться результата (исключение пробрасывается)"""
+        return self.submit(operation).result(timeout)
+
+    def execute(self, sql: str, params: Sequence = ()) -> Future:
+        """Поставить в очередь один SQL-запрос, Future вернёт rowcount"""
+        return self.submit(lambda conn: conn.execute(sql, params).rowcount)
+
+    def in_writer_thread(self) -> bool:
+        return self._thread is not None and threading.current_thread() is self._thread
+
+    # Жизненный цикл потока
+    def _ensure_started(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="db-writer", daemon=True
+                )
+                self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        """Выполнить оставшиеся операции и остановить поток"""
+        with self._lock:
+            thread = self._thread
+            if thread is None or not thread.is_alive():
+                return
+            self._queue.put(None)
+        thread.join(timeout)
+
+    def _run(self):
+        try:
+            self._conn = self.connect()
+        except sqlite3.Error as e:
+            logger.error(f"❌ Не удалось открыть соединение для записи: {e}")
+            self._fail_pending(e)
+            return
+        try:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    break
+                if not self._run_batch(item):
+                    break
+        finally:
+            try:
+                self._conn.close()
+            except sqlite3.Error:
+                pass
+            self._conn = None
+
+    # Выполнение пачки
+    def _run_batch(self, first: tuple) -> bool:
+        """
+        Выполнить пачку операций в одной транзакции
+
+        Returns:
+            False, если в очереди встретился сигнал остановки
+        """
+        conn = self._conn
+        batch: List[tuple] = []
+        results: List[tuple] = []
+        keep_running = True
+        started = time.perf_counter()
+        deadline = started + self.batch_window
+
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+        except sqlite3.Error as e:
+            logger.error(f"❌ Не удалось начать транзакцию записи: {e}")
+            self._fail(first, e)
+            return True
+
+        item = first
+        while True:
+            batch.append(item)
+            results.append(self._apply(conn, item, len(batch)))
+
+            if len(batch) >= self.batch_max:
+                break
+            remaining = deadline - time.perf_counter()
+            try:
+                item = (
+                    self._queue.get(timeout=min(remaining, self.batch_idle))
+                    if remaining > 0
+                    else self._queue.get_nowait()
+                )
+            except queue.Empty:
+                break
+            if item is None:
+                keep_running = False
+                break
+
+        try:
+            conn.commit()
+        except sqlite3.Error as e:
+            logger.error(f"❌ Ошибка группового коммита ({len(batch)} операций): {e}")
+            try:
+                conn.rollback()
+            except sqlite3.Error:
+                pass
+            with self._lock:
+                self._stats["failed_batches"] += 1
+            for entry in batch:
+                self._fail(entry, e)
+            return keep_running
+
+        finished = time.perf_counter()
+        with self._lock:
+            self._stats["batches"] += 1
+            self._stats["operations"] += len(batch)
+            self._stats["max_batch"] = max(self._stats["max_batch"], len(batch))
+            self._stats["busy_seconds"] += finished - started
+            self._stats["wait_seconds"] += sum(started - entry[2] for entry in batch)
+
+        # Результаты отдаём только после COMMIT: вызывающий видит записанные данные
+        for (_, future, _), (ok, value) in zip(batch, results):
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+        return keep_running
+
+    def _apply(self, conn: sqlite3.Connection, item: tuple, index: int) -> tuple:
+        """Выполнить одну операцию в своей точке сохранения"""
+        operation = item[0]
+        savepoint = f"op_{index}"
+        conn.execute(f"SAVEPOINT {savepoint}")
+        try:
+            value = operation(conn)
+        except Exception as e:
+            conn.execute(f"ROLLBACK TO {savepoint}")
+            conn.execute(f"RELEASE {savepoint}")
+            with self._lock:
+                self._stats["failed_operations"] += 1
+            return False, e
+        conn.execute(f"RELEASE {savepoint}")
+        return True, value
+
+    def _fail_pending(self, error: BaseException):
+        """Завершить ошибкой все операции, ждущие в очереди"""
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if item is not None:
+                self._fail(item, error)
+
+    def _fail(self, item: tuple, error: BaseException):
+        with self._lock:
+            self._stats["failed_operations"] += 1
+        future = item[1]
+        if not future.done():
+            future.set_exception(error)
+
+    def stats(self) -> Dict:
+        """Размеры пачек, время ожидания и глубина очереди записи"""
+        with self._lock:
+            stats = dict(self._stats)
+        batches = stats["batches"]
+        operations = stats["operations"]
+        return {
+            "running": self._thread is not None and self._thread.is_alive(),
+            "queue_depth": self._queue.qsize(),
+            "batch_window_ms": round(self.batch_window * 1000, 1),
+            "batch_max": self.batch_max,
+            "operations": operations,
+            "batches": batches,
+            "avg_batch": round(operations / batches, 2) if batches else 0.0,
+            "max_batch": stats["max_batch"],
+            "failed_operations": stats["failed_operations"],
+            "failed_batches": stats["failed_batches"],
+            "avg_wait_ms": round(stats["wait_seconds"] / operations * 1000, 2)
+            if operations
+            else 0.0,
+            "busy_seconds": round(stats["busy_seconds"], 3),
+        }
@@ -0,0 +1,97 @@
+"""
+Стадии конвейера загрузки
+
+Трек проходит три стадии, каждая со своим пулом воркеров:
+  • fetch   — сетевая часть: получение ссылки, скачивание и расшифровка на лету;
+  • process — CPU-часть: конвертация FLAC-MP4 → FLAC и определение качества;
+  • persist — обложка, запись в downloaded_tracks и обновление статистики.
+
+Стадии связаны ограниченными очередями, поэтому пока один трек
+конвертируется, следующий уже скачивается. Если стадия не успевает,
+очередь перед ней заполняется и предыдущая стадия ждёт (backpressure).
+Глубина очереди и загрузка воркеров каждой стадии видны через API.
+"""
+
+import asyncio
+import os
+import time
+from typing import Dict, Optional, Set
+
+# Воркеры стадии обработки: конвертация нагружает CPU и диск
+PROCESS_WORKERS = max(1, min(2, os.cpu_count() or 1))
+
+# Запись в SQLite идёт через одного писателя
+PERSIST_WORKERS = 1
+
+# Ёмкость очереди перед стадией persist
+PERSIST_QUEUE_SIZE = 8
+
+
+class PipelineStage:
+    """Стадия конвейера: ограниченная входная очередь и учёт занятости воркеров"""
+
+    def __init__(self, name: str, workers: int, queue_size: Optional[int] = None):
+        self.name = name
+        self.workers = workers
+        # У стадии fetch входной очереди нет — она забирает треки из БД
+        self.queue: Optional[asyncio.Queue] = (
+            asyncio.Queue(maxsize=queue_size) if queue_size else None
+        )
+        self.processed = 0
+        self.errors = 0
+        self.started_at = time.monotonic()
+        self._busy_time = 0.0
+        self._active: Dict[str, float] = {}
+        self._waiting: Set[str] = set()
+
+    @property
+    def track_ids(self) -> Set[str]:
+        """Треки, которые сейчас обрабатываются или ждут в очереди стадии"""
+        return set(self._active) | self._waiting
+
+    async def put(self, job: Dict) -> None:
+        """Передать трек в очередь стадии (ждёт, если очередь заполнена)"""
+        track_id = job["track"]["track_id"]
+        self._waiting.add(track_id)
+        try:
+            await self.queue.put(job)
+        except asyncio.CancelledError:
+            self._waiting.discard(track_id)
+            raise
+
+    async def get(self) -> Dict:
+        """Взять следующий трек из очереди стадии"""
+        job = await self.queue.get()
+        self._waiting.discard(job["track"]["track_id"])
+        return job
+
+    def begin(self, track_id: str) -> None:
+        """Воркер стадии взял трек в работу"""
+        self._active[track_id] = time.monotonic()
+
+    def end(self, track_id: str, success: bool = True) -> None:
+        """Воркер стадии закончил работу с треком"""
+        started = self._active.pop(track_id, None)
+        if started is not None:
+            self._busy_time += time.monotonic() - started
+        if success:
+            self.processed += 1
+        else:
+            self.errors += 1
+
+    def stats(self) -> Dict:
+        """Глубина очереди и загрузка стадии"""
+        now = time.monotonic()
+        busy_time = self._busy_time + sum(now - t for t in self._active.values())
+        elapsed = max(now - self.started_at, 1e-6)
+        return {
+            "name": self.name,
+            "workers": self.workers,
+            "busy": len(self._active),
+            "queue_depth": self.queue.qsize() if self.queue is not None else None,
+            "queue_capacity": self.queue.maxsize if self.queue is not None else None,
+            "processed": self.processed,
+            "errors": self.errors,
+            # Доля времени, которое воркеры стадии были заняты с момента запуска
+            "utilization": round(min(busy_time / (elapsed * self.workers), 1.0), 3),
+        }
@@ -0,0 +1,181 @@
+"""
+Предзагрузка информации для скачивания следующих треков очереди
+
+Перед первым байтом аудио download_track последовательно запрашивает
+метаданные трека, список форматов (подписанный HMAC запрос) и прямую ссылку
+(XML). Пока воркеры качают текущие треки, предзагрузчик заранее выполняет эти
+запросы для следующих K треков очереди, и воркер начинает скачивание сразу.
+
+Подписанные ссылки живут недолго, поэтому у записей есть срок жизни: записи,
+которые скоро истекут, обновляются, а истёкшие воркеру не отдаются.
+"""
+
+import asyncio
+import logging
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from config.settings import get_prefetch_ttl
+
+logger = logging.getLogger("download_queue")
+
+# Сколько следующих треков очереди предзагружать (не меньше числа воркеров)
+PREFETCH_AHEAD = 4
+
+# Запись обновляется заранее, если до истечения осталось меньше этого времени
+# (но не больше четверти срока жизни записи)
+PREFETCH_REFRESH_MARGIN = 30.0
+
+# Пауза между проходами предзагрузчика (секунды)
+PREFETCH_INTERVAL = 1.0
+
+
+class DownloadPrefetcher:
+    """Кэш заранее полученных метаданных, форматов и ссылок для скачивания"""
+
+    def __init__(
+        self,
+        resolver: Callable[[str, str], Optional[Dict]],
+        ahead: int = PREFETCH_AHEAD,
+        ttl: Optional[float] = None,
+    ):
+        """
+        Args:
+            resolver: Функция (track_id, quality) → данные для download_track
+                (YandexMusicClient.prefetch_download)
+            ahead: Сколько следующих треков предзагружать
+            ttl: Срок жизни записи в секундах (по умолчанию PREFETCH_TTL из окружения)
+        """
+        self.resolver = resolver
+        self.ahead = ahead
+        self.ttl = ttl if ttl is not None else get_prefetch_ttl()
+        self.refresh_margin = min(PREFETCH_REFRESH_MARGIN, self.ttl / 4)
+        self._lock = threading.Lock()
+        self._entries: Dict[Tuple[str, str], Dict] = {}
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.resolved = 0
+        self.failed = 0
+
+    def take(self, track_id: str, quality: str) -> Optional[Dict]:
+        """
+        Забрать предзагруженные данные трека (запись удаляется из кэша)
+
+        Returns:
+            Данные для download_track(prefetched=...) или None
+        """
+        with self._lock:
+            entry = self._entries.pop((track_id, quality), None)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry["expires_at"] <= time.time():
+                self.expired += 1
+                return None
+            self.hits += 1
+            return entry["data"]
+
+    def _needs_refresh(self, key: Tuple[str, str], now: float) -> bool:
+        """Нет записи или она скоро истечёт"""
+        entry = self._entries.get(key)
+        return entry is None or entry["expires_at"] - now < self.refresh_margin
+
+    async def prefetch(self, upcoming: List[Dict]) -> int:
+        """
+        Предзагрузить данные для следующих треков очереди
+
+        Запросы выполняются по одному, чтобы не увеличивать нагрузку на API
+        сверх той, что создают воркеры.
+
+        Args:
+            upcoming: Следующие треки очереди [{track_id, quality}, ...]
+
+        Returns:
+            Количество обновлённых записей
+        """
+        keys = [(item["track_id"], item["quality"]) for item in upcoming[: self.ahead]]
+
+        with self._lock:
+            # Записи треков, удалённых из очереди, просто истекают. Выпавшие из окна
+            # сразу не удаляем: трек мог быть только что захвачен воркером
+            now = time.time()
+            for key, entry in list(self._entries.items()):
+                if entry["expires_at"] <= now:
+                    del self._entries[key]
+
+        refreshed = 0
+        for key in keys:
+            with self._lock:
+                if not self._needs_refresh(key, time.time()):
+                    continue
+
+            data = await asyncio.to_thread(self.resolver, *key)
+            if data is None:
+                self.failed += 1
+                continue
+
+            with self._lock:
+                self._entries[key] = {
+                    "data": data,
+                    "fetched_at": time.time(),
+                    "expires_at": time.time() + self.ttl,
+                }
+            self.resolved += 1
+            refreshed += 1
+
+        return refreshed
+
+    async def run(
+        self,
+        get_upcoming: Callable[[int], List[Dict]],
+        is_running: Callable[[], bool],
+        is_paused: Callable[[], bool] = lambda: False,
+    ):
+        """
+        Фоновый цикл предзагрузки
+
+        Args:
+            get_upcoming: Функция (limit) → следующие треки очереди
+            is_running: Продолжать ли работу
+            is_paused: Очередь на паузе — ссылки не запрашиваем, они успеют истечь
+        """
+        try:
+            while is_running():
+                if is_paused():
+                    await asyncio.sleep(PREFETCH_INTERVAL)
+                    continue
+                try:
+                    upcoming = await asyncio.to_thread(get_upcoming, self.ahead)
+                    if upcoming:
+                        await self.prefetch(upcoming)
+                except Exception as e:
+                    logger.warning(f"⚠️  Ошибка предзагрузки треков: {e}")
+                await asyncio.sleep(PREFETCH_INTERVAL)
+        except asyncio.CancelledError:
+            pass
+
+    def clear(self) -> None:
+        """Сбросить кэш (остановка очереди)"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        """Попадания в кэш и состояние записей"""
+        now = time.time()
+        with self._lock:
+            cached = len(self._entries)
+            fresh = sum(1 for entry in self._entries.values() if entry["expires_at"] > now)
+        requests_total = self.hits + self.misses + self.expired
+        return {
+            "ahead": self.ahead,
+            "cached": cached,
+            "fresh": fresh,
+            "hits": self.hits,
+            "misses": self.misses,
+            "expired": self.expired,
+            "resolved": self.resolved,
+            "failed": self.failed,
+            "hit_rate": round(self.hits / requests_total, 3) if requests_total else 0.0,
+        }
@@ -1,38 +1,130 @@
 """
 Менеджер очереди загрузок с поддержкой FLAC
-Поштучная обработка треков с возможностью паузы/возобновления
+Конвейер загрузки: скачивание, обработка и сохранение идут параллельно
+в отдельных пулах воркеров с возможностью паузы/возобновления
 """
 
 import asyncio
 import logging
 import os
+import socket
+import threading
+import time
+import uuid
 from datetime import datetime
 from typing import Optional, Dict, List, Callable
 from pathlib import Path
 
+from config.settings import get_download_workers
+from cover_fetcher import cover_fetcher
 from db_manager import DatabaseManager, db_manager
-from yandex_client import YandexMusicClient
+from download_prefetcher import PREFETCH_AHEAD, DownloadPrefetcher
+from download_pipeline import (
+    PERSIST_QUEUE_SIZE,
+    PERSIST_WORKERS,
+    PROCESS_WORKERS,
+    PipelineStage,
+)
+from progress_registry import progress_registry
+from queue_events import queue_events
+from resumable_download import DownloadStopped
+from utils.pagination import decode_cursor
+from utils.rate_limiter import cancel_scope
+from yandex_client import PENDING_MUX_SUFFIX, YandexMusicClient
 
 logger = logging.getLogger("download_queue")
 download_logger = logging.getLogger("download")
 
+# Ограничение на количество одновременных загрузок (защита от бана по rate limit)
+MAX_DOWNLOAD_WORKERS = 8
+
+# Аренда строки очереди: воркер продлевает её heartbeat'ом, пока скачивает трек.
+# Если процесс упал, строка возвращается в работу после истечения аренды.
+LEASE_SECONDS = 60
+HEARTBEAT_INTERVAL = 15
+
 
 class DownloadQueueManager:
-    """Менеджер очереди загрузок с поштучной обработкой"""
+    """Менеджер очереди загрузок с пулом параллельных воркеров"""
 
     def __init__(
         self,
         db_manager: DatabaseManager,
         yandex_client: YandexMusicClient,
         download_path: str,
+        max_workers: Optional[int] = None,
     ):
         self.db = db_manager
         self.client = yandex_client
         self.download_path = download_path
         self.is_running = False
         self.is_paused = False
-        self.current_track_id: Optional[str] = None
-        self.worker_task: Optional[asyncio.Task] = None
+        # Остановка: прерывает текущие скачивания (запросы к API и чтение чанков)
+        self.stop_event = threading.Event()
+        # Явно заданное количество воркеров (иначе берётся из настроек при старте)
+        self._configured_workers = max_workers
+        self.max_workers = self._resolve_max_workers()
+        # Состояние каждого воркера: {worker_id: {status, track_id, title, ...}}
+        self.workers: Dict[int, Dict] = {}
+        self.worker_tasks: List[asyncio.Task] = []
+        self.heartbeat_task: Optional[asyncio.Task] = None
+        # Стадии конвейера (fetch → process → persist) и их воркеры
+        self.stages: Dict[str, PipelineStage] = {}
+        self.stage_tasks: List[asyncio.Task] = []
+        self.pipeline_task: Optional[asyncio.Task] = None
+        # Предзагрузка метаданных и подписанных ссылок следующих треков
+        # (клиент берётся при вызове: менеджер может быть создан без клиента)
+        self.prefetcher = DownloadPrefetcher(
+            lambda track_id, quality: self.client.prefetch_download(track_id, quality)
+        )
+        self.prefetch_task: Optional[asyncio.Task] = None
+        # Уникальный идентификатор экземпляра: префикс владельца аренды у всех воркеров
+        self.instance_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+    def _resolve_max_workers(self) -> int:
+        """Определить количество воркеров: аргумент → настройка download_workers → DOWNLOAD_WORKERS"""
+        value = self._configured_workers
+        if value is None:
+            try:
+                value = int(
+                    self.db.get_setting("download_workers", str(get_download_workers()))
+                )
+            except (TypeError, ValueError):
+                value = get_download_workers()
+        return max(1, min(int(value), MAX_DOWNLOAD_WORKERS))
+
+    @property
+    def active_track_ids(self) -> List[str]:
+        """ID треков, которые сейчас скачиваются или ждут обработки в конвейере"""
+        track_ids = [
+            state["track_id"]
+            for state in self.workers.values()
+            if state.get("track_id")
+        ]
+        for name in ("process", "persist"):
+            if name in self.stages:
+                track_ids.extend(
+                    track_id
+                    for track_id in self.stages[name].track_ids
+                    if track_id not in track_ids
+                )
+        return track_ids
+
+    def _set_worker_state(self, worker_id: int, **fields):
+        """Обновить состояние воркера"""
+        state = self.workers.setdefault(
+            worker_id,
+            {
+                "worker_id": worker_id,
+                "status": "idle",
+                "track_id": None,
+                "title": None,
+                "artist": None,
+                "progress": 0,
+                "started_at": None,
+            },
+        )
+        state.update(fields)
 
     def clear_queue(
         self, clear_completed: bool = True, clear_pending: bool = True
@@ -59,6 +151,7 @@ class DownloadQueueManager:
             cleared_count += self.db.clear_download_queue_by_status("error")
 
         logger.info(f"✅ Очищено из очереди: {cleared_count} треков")
+        queue_events.publish("queue_changed")
 
         return {
             "cleared": cleared_count,
@@ -95,12 +188,12 @@ class DownloadQueueManager:
                 logger.info(f"🗑️  Статистика файлов очищена для новой сессии")
             except Exception as e:
                 logger.warning(f"⚠️  Не удалось очистить статистику файлов: {e}")
-        added = 0
-        skipped = 0
-        duplicates = []
 
-        with self.db.get_connection() as conn:
+        def operation(conn):
             cursor = conn.cursor()
+            added = 0
+            skipped = 0
+            duplicates = []
 
             for track in tracks:
                 # Проверяем, нет ли уже в очереди
@@ -134,9 +227,12 @@ class DownloadQueueManager:
                 )
                 added += 1
 
-            conn.commit()
+            return added, skipped, duplicates
+
+        added, skipped, duplicates = self.db.write(operation)
 
         logger.info(f"✅ Добавлено в очередь: {added} треков (пропущено: {skipped})")
+        queue_events.publish("queue_changed")
 
         return {
             "added": added,
@@ -145,8 +241,20 @@ class DownloadQueueManager:
             "cleared": cleared_count,
         }
 
-    def get_queue(self, limit: Optional[int] = None) -> List[Dict]:
-        """Получить список треков в очереди"""
+    def get_queue(
+        self, limit: Optional[int] = None, after: Optional[str] = None
+    ) -> List[Dict]:
+        """
+        Получить список треков в очереди
+
+        Args:
+            limit: Размер страницы; без него возвращается вся очередь
+            after: Курсор предыдущей страницы (ключ created_at, id)
+
+        Вся очередь сортируется по статусу. Постранично — по (created_at, id):
+        сортировка по статусу не даёт стабильного ключа, а индекс
+        idx_download_queue_created позволяет начать страницу с любого места
+        """
         with self.db.get_connection() as conn:
             cursor = conn.cursor()
 
@@ -154,28 +262,41 @@ class DownloadQueueManager:
                 SELECT id, track_id, title, artist, album, playlist_id, cover, status, progress, 
                        quality, error_message, created_at, updated_at
                 FROM download_queue
-                ORDER BY 
-                    CASE status
-                        WHEN 'downloading' THEN 1
-                        WHEN 'pending' THEN 2
-                        WHEN 'paused' THEN 3
-                        WHEN 'error' THEN 4
-                        WHEN 'completed' THEN 5
-                    END,
-                    created_at ASC
             """
+            params = []
 
             if limit:
-                query += f" LIMIT {limit}"
+                if after:
+                    query += " WHERE (created_at, id) > (?, ?)"
+                    params.extend(decode_cursor(after, 2))
+                query += " ORDER BY created_at, id LIMIT ?"
+                params.append(limit)
+            else:
+                query += """
+                    ORDER BY 
+                        CASE status
+                            WHEN 'downloading' THEN 1
+                            WHEN 'pending' THEN 2
+                            WHEN 'paused' THEN 3
+                            WHEN 'error' THEN 4
+                            WHEN 'completed' THEN 5
+                        END,
+                        created_at ASC
+                """
 
-            cursor.execute(query)
+            cursor.execute(query, params)
             columns = [description[0] for description in cursor.description]
             rows = cursor.fetchall()
 
-            return [dict(zip(columns, row)) for row in rows]
+            # Прогресс активных загрузок берём из памяти — в БД он обновляется редко
+            return progress_registry.overlay([dict(zip(columns, row)) for row in rows])
 
     def get_stats(self) -> Dict:
         """Получить статистику очереди"""
+        # Общая статистика библиотеки — из агрегатов, без прохода по downloaded_tracks
+        total_files_in_db, total_size_mb = self.db.get_file_totals()
+        total_size_gb = round(total_size_mb / 1024, 2) if total_size_mb > 0 else 0
+
         with self.db.get_connection() as conn:
             cursor = conn.cursor()
 
@@ -205,17 +326,6 @@ class DownloadQueueManager:
             cursor.execute("SELECT COUNT(*) FROM download_queue")
             queue_total = cursor.fetchone()[0]
 
-            # Получаем общее количество файлов в БД
-            cursor.execute("SELECT COUNT(*) FROM downloaded_tracks")
-            total_files_in_db = cursor.fetchone()[0]
-
-            # Получаем общий размер файлов в БД
-            cursor.execute(
-                "SELECT SUM(file_size) FROM downloaded_tracks WHERE file_size IS NOT NULL"
-            )
-            total_size_mb = cursor.fetchone()[0] or 0
-            total_size_gb = round(total_size_mb / 1024, 2) if total_size_mb > 0 else 0
-
             return {
                 # Общая статистика (вся база данных)
                 "general_stats": {
@@ -233,40 +343,102 @@ class DownloadQueueManager:
                     "total_in_queue": queue_total,
                 },
                 # Состояние системы
-                "system_state": {
-                    "is_running": self.is_running,
-                    "is_paused": self.is_paused,
-                    "current_track_id": self.current_track_id,
-                },
+                "system_state": self._get_system_state(),
             }
 
-    def clear_completed(self) -> int:
-        """Удалить завершённые треки из очереди"""
+    def _get_system_state(self) -> Dict:
+        """Состояние пула воркеров"""
+        return {
+            "is_running": self.is_running,
+            "is_paused": self.is_paused,
+            "max_workers": self.max_workers,
+            "active_workers": sum(1 for task in self.worker_tasks if not task.done()),
+            "active_track_ids": self.active_track_ids,
+            "workers": [
+                dict(self.workers[worker_id]) for worker_id in sorted(self.workers)
+            ],
+            "pipeline": self.get_pipeline_stats(),
+        }
+
+    def get_pipeline_stats(self) -> List[Dict]:
+        """Глубина очередей и загрузка стадий конвейера (поиск узкого места)"""
+        return [stage.stats() for stage in self.stages.values()]
+
+    def get_session_counters(self) -> Dict:
+        """Счётчики очереди по статусам одним запросом (для push-событий)"""
+        counters = {
+            "pending": 0,
+            "queued": 0,
+            "downloading": 0,
+            "completed": 0,
+            "errors": 0,
+            "total_in_queue": 0,
+        }
         with self.db.get_connection() as conn:
             cursor = conn.cursor()
-            cursor.execute("DELETE FROM download_queue WHERE status = 'completed'")
-            deleted = cursor.rowcount
-            conn.commit()
+            cursor.execute(
+                "SELECT status, COUNT(*) FROM download_queue GROUP BY status"
+            )
+            for status, count in cursor.fetchall():
+                key = "errors" if status == "error" else status
+                if key in counters:
+                    counters[key] = count
+                counters["total_in_queue"] += count
+        return counters
+
+    def _publish_stats(self):
+        """Отправить подписчикам актуальные счётчики очереди и состояние воркеров"""
+        if not queue_events.has_subscribers:
+            return
+        try:
+            queue_events.publish(
+                "stats",
+                {
+                    "session_stats": self.get_session_counters(),
+                    "system_state": self._get_system_state(),
+                },
+            )
+        except Exception as e:
+            logger.warning(f"⚠️  Не удалось отправить статистику очереди: {e}")
+
+    def clear_completed(self) -> int:
+        """Удалить завершённые треки из очереди"""
+        deleted = self.db.write(
+            lambda conn: conn.execute(
+                "DELETE FROM download_queue WHERE status = 'completed'"
+            ).rowcount
+        )
 
         logger.info(f"🗑️  Удалено завершённых треков: {deleted}")
+        queue_events.publish("queue_changed")
         return deleted
 
     def remove_track(self, track_id: str) -> bool:
         """Удалить трек из очереди"""
-        with self.db.get_connection() as conn:
-            cursor = conn.cursor()
+        # Нельзя удалить трек который сейчас скачивается
+        if track_id in self.active_track_ids:
+            logger.warning(
+                f"⚠️  Нельзя удалить трек {track_id} - он сейчас скачивается"
+            )
+            return False
 
-            # Нельзя удалить трек который сейчас скачивается
-            if self.current_track_id == track_id:
-                logger.warning(
-                    f"⚠️  Нельзя удалить трек {track_id} - он сейчас скачивается"
-                )
-                return False
+        # И трек, который держит под арендой воркер другого процесса
+        def operation(conn):
+            cursor = conn.cursor()
+            cursor.execute(
+                """
+                DELETE FROM download_queue
+                WHERE track_id = ?
+                  AND NOT (status = 'downloading' AND lease_expires_at >= ?)
+            """,
+                (track_id, time.time()),
+            )
+            return cursor.rowcount > 0
 
-            cursor.execute("DELETE FROM download_queue WHERE track_id = ?", (track_id,))
-            deleted = cursor.rowcount > 0
-            conn.commit()
+        deleted = self.db.write(operation)
 
+        if deleted:
+            queue_events.publish("queue_changed")
         return deleted
 
     async def start(self):
@@ -275,43 +447,35 @@ class DownloadQueueManager:
             logger.info("⚠️  Воркер уже запущен")
             return {"status": "already_running"}
 
-        # Переводим треки из pending в queued (если есть)
-        # И возвращаем зависшие треки из downloading в queued
-        with self.db.get_connection() as conn:
-            cursor = conn.cursor()
+        # После остановки уже скачанные треки дообрабатываются — ждём, пока
+        # предыдущий запуск не отпустит свои треки и файлы
+        if self.pipeline_task and not self.pipeline_task.done():
+            logger.info("⏳ Ждём завершения обработки уже скачанных треков")
+            await asyncio.shield(self.pipeline_task)
 
-            # Переводим pending в queued
-            cursor.execute(
+        # Переводим треки из pending в queued (если есть)
+        await asyncio.to_thread(
+            self.db.write,
+            lambda conn: conn.execute(
                 """
                 UPDATE download_queue 
                 SET status = 'queued', updated_at = ?
                 WHERE status = 'pending'
             """,
                 (datetime.now().isoformat(),),
-            )
+            ),
+        )
 
-            # Возвращаем зависшие треки из downloading в queued
-            cursor.execute(
-                """
-                UPDATE download_queue 
-                SET status = 'queued', progress = 0, updated_at = ?
-                WHERE status = 'downloading'
-            """,
-                (datetime.now().isoformat(),),
+        # Возвращаем в queued только треки с истёкшей арендой:
+        # живые аренды принадлежат воркерам другого процесса с той же БД
+        reset_count = await asyncio.to_thread(self.db.recover_expired_leases)
+        if reset_count > 0:
+            logger.info(
+                f"🔄 Возвращено {reset_count} зависших треков из downloading в queued"
             )
 
-            # Получаем количество возвращенных треков
-            reset_count = cursor.rowcount
-
-            conn.commit()
-
-            if reset_count > 0:
-                logger.info(
-                    f"🔄 Возвращено {reset_count} зависших треков из downloading в queued"
-                )
-
         # Проверяем есть ли треки для загрузки (queued + downloading) ПОСЛЕ обновления статусов
-        stats = self.get_stats()
+        stats = await asyncio.to_thread(self.get_stats)
         session_stats = stats.get("session_stats", {})
         queued_count = session_stats.get("queued", 0)
         downloading_count = session_stats.get("downloading", 0)
@@ -319,14 +483,81 @@ class DownloadQueueManager:
         if queued_count == 0 and downloading_count == 0:
             return {"status": "empty", "message": "Нет треков для загрузки"}
 
-        # Запускаем воркер
+        # Запускаем пул воркеров (количество перечитываем из настроек)
+        self.max_workers = self._resolve_max_workers()
         self.is_running = True
         self.is_paused = False
-        self.worker_task = asyncio.create_task(self._worker())
+        self.stop_event = threading.Event()
+        self.workers = {}
+        self.stages = {
+            "fetch": PipelineStage("fetch", self.max_workers),
+            # Очередь на обработку не больше числа качающих воркеров:
+            # если конвертация отстаёт, скачивание притормаживает
+            "process": PipelineStage("process", PROCESS_WORKERS, self.max_workers),
+            "persist": PipelineStage("persist", PERSIST_WORKERS, PERSIST_QUEUE_SIZE),
+        }
+        self.worker_tasks = [
+            asyncio.create_task(self._worker(worker_id))
+            for worker_id in range(1, self.max_workers + 1)
+        ]
+        self.stage_tasks = [
+            asyncio.create_task(
+                self._stage_worker("process", self._process_track, "persist")
+            )
+            for _ in range(PROCESS_WORKERS)
+        ] + [
+            asyncio.create_task(self._stage_worker("persist", self._persist_track))
+            for _ in range(PERSIST_WORKERS)
+        ]
+        # Аренду продлеваем, пока конвейер не досчитает все треки (и после stop)
+        self.heartbeat_task = asyncio.create_task(self._heartbeat())
+        self.pipeline_task = asyncio.create_task(self._run_pipeline())
+        # Каждому воркеру — хотя бы по одному предзагруженному треку
+        self.prefetcher.ahead = max(PREFETCH_AHEAD, self.max_workers)
+        self.prefetch_task = asyncio.create_task(
+            self.prefetcher.run(
+                self.db.get_next_queued_tracks,
+                lambda: self.is_running,
+                lambda: self.is_paused,
+            )
+        )
+
+        logger.info(
+            f"🚀 Запущена загрузка {session_stats.get('queued', 0)} треков "
+            f"({self.max_workers} воркеров, обработка: {PROCESS_WORKERS})"
+        )
+        queue_events.publish("queue_changed")
+        self._publish_stats()
+
+        return {
+            "status": "started",
+            "queued": session_stats.get("queued", 0),
+            "workers": self.max_workers,
+        }
+
+    def _request_stop(self) -> int:
+        """
+        Остановить запуск: новые треки не захватываются, текущие скачивания прерываются
 
-        logger.info(f"🚀 Запущена загрузка {session_stats.get('queued', 0)} треков")
+        Уже скачанные треки дообрабатываются стадиями process и persist
+        (задачи не отменяются: конвертация в потоке всё равно дописала бы
+        файл). Прерванные скачивания возвращаются в очередь самим воркером,
+        когда поток загрузки действительно завершится.
 
-        return {"status": "started", "queued": session_stats.get("queued", 0)}
+        Returns:
+            Сколько скачанных треков ещё ждут обработки
+        """
+        self.is_running = False
+        self.is_paused = False
+        self.stop_event.set()
+        if self.prefetch_task and not self.prefetch_task.done():
+            self.prefetch_task.cancel()
+        self.prefetcher.clear()
+        return sum(
+            len(self.stages[name].track_ids)
+            for name in ("process", "persist")
+            if name in self.stages
+        )
 
     def pause(self):
         """Приостановить загрузку"""
@@ -335,6 +566,7 @@ class DownloadQueueManager:
 
         self.is_paused = True
         logger.info("⏸️  Загрузка приостановлена")
+        self._publish_stats()
 
         return {"status": "paused"}
 
@@ -348,6 +580,7 @@ class DownloadQueueManager:
 
         self.is_paused = False
         logger.info("▶️  Загрузка возобновлена")
+        self._publish_stats()
 
         return {"status": "resumed"}
 
@@ -356,25 +589,24 @@ class DownloadQueueManager:
         if not self.is_running:
             return {"status": "not_running"}
 
-        self.is_running = False
-        self.is_paused = False
-
-        if self.worker_task:
-            self.worker_task.cancel()
+        finishing = self._request_stop()
 
-        logger.info("🛑 Загрузка остановлена")
+        if finishing:
+            logger.info(f"🛑 Загрузка остановлена, дообрабатываются скачанные треки: {finishing}")
+        else:
+            logger.info("🛑 Загрузка остановлена")
+        queue_events.publish("queue_changed")
+        self._publish_stats()
 
-        return {"status": "stopped"}
+        return {"status": "stopped", "finishing": finishing}
 
     def restart(self):
         """Принудительно перезапустить воркер загрузки"""
         logger.info("🔄 Принудительный перезапуск воркера загрузки")
 
-        # Останавливаем текущий воркер
+        # Останавливаем текущие воркеры (start дождётся обработки скачанных треков)
         if self.is_running:
-            self.is_running = False
-            if self.worker_task:
-                self.worker_task.cancel()
+            self._request_stop()
 
         # Сбрасываем состояние паузы
         self.is_paused = False
@@ -395,83 +627,165 @@ class DownloadQueueManager:
             # Если нет цикла событий, создаем новый
             return asyncio.run(self.start())
 
-    async def _worker(self):
-        """Фоновый воркер для поштучной обработки очереди"""
-        logger.info("👷 Воркер загрузки запущен")
+    async def _worker(self, worker_id: int):
+        """Фоновый воркер пула: забирает треки из очереди, пока они есть"""
+        logger.info(f"👷 Воркер #{worker_id} запущен")
+        self._set_worker_state(worker_id, status="idle")
 
         try:
             while self.is_running:
                 # Проверяем паузу
                 if self.is_paused:
+                    self._set_worker_state(worker_id, status="paused")
                     await asyncio.sleep(1)
                     continue
 
-                # Получаем следующий трек
-                next_track = self._get_next_track()
+                # Захватываем следующий трек под аренду (атомарно в БД)
+                next_track = await asyncio.to_thread(
+                    self.db.claim_next_download,
+                    f"{self.instance_id}:w{worker_id}",
+                    LEASE_SECONDS,
+                )
 
                 if not next_track:
                     # Нет треков для загрузки
-                    logger.info("✅ Все треки обработаны")
-                    self.is_running = False
+                    logger.info(f"✅ Воркер #{worker_id}: треков больше нет")
                     break
 
-                # Скачиваем трек
-                await self._download_track(next_track)
+                # Скачиваем трек и передаём его стадии обработки
+                # (если очередь обработки заполнена — ждём)
+                job = await self._download_track(next_track, worker_id)
+                if job:
+                    await self.stages["process"].put(job)
 
                 # Небольшая пауза между треками
                 await asyncio.sleep(0.5)
 
         except asyncio.CancelledError:
-            logger.info("⏹️  Воркер отменён")
+            logger.info(f"⏹️  Воркер #{worker_id} отменён")
         except Exception as e:
-            logger.error(f"❌ Ошибка в воркере: {e}")
+            logger.error(f"❌ Ошибка в воркере #{worker_id}: {e}")
             import traceback
 
             logger.error(traceback.format_exc())
         finally:
-            self.is_running = False
-            self.current_track_id = None
-            logger.info("👷 Воркер загрузки завершён")
+            # Воркеры предыдущего запуска (после restart) не трогают новое состояние
+            if asyncio.current_task() in self.worker_tasks:
+                self._set_worker_state(
+                    worker_id, status="stopped", track_id=None, progress=0
+                )
+            logger.info(f"👷 Воркер #{worker_id} завершён")
 
-    def _get_next_track(self) -> Optional[Dict]:
-        """Получить следующий трек для загрузки"""
-        with self.db.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute(
-                """
-                SELECT id, track_id, title, artist, album, playlist_id, cover, quality
-                FROM download_queue
-                WHERE status = 'queued'
-                ORDER BY created_at ASC
-                LIMIT 1
-            """
-            )
+    async def _run_pipeline(self):
+        """Дождаться воркеров скачивания и досчитать очереди стадий конвейера"""
+        worker_tasks = list(self.worker_tasks)
+        stage_tasks = list(self.stage_tasks)
+        heartbeat_task = self.heartbeat_task
+        stages = self.stages
 
-            row = cursor.fetchone()
+        try:
+            await asyncio.gather(*worker_tasks, return_exceptions=True)
+            # Скачанные треки ещё могут быть в обработке — дожидаемся их
+            await stages["process"].queue.join()
+            await stages["persist"].queue.join()
+        except asyncio.CancelledError:
+            pass
+        finally:
+            for task in stage_tasks:
+                if not task.done():
+                    task.cancel()
+            if heartbeat_task and not heartbeat_task.done():
+                heartbeat_task.cancel()
 
-            if not row:
-                return None
+            # Все воркеры запуска завершены — их аренды больше никто не держит
+            try:
+                released = await asyncio.to_thread(
+                    self.db.release_download_leases, self.instance_id
+                )
+                if released:
+                    logger.info(f"🔄 Возвращено в очередь прерванных треков: {released}")
+            except Exception as e:
+                logger.warning(f"⚠️  Не удалось освободить аренду треков: {e}")
 
-            return {
-                "db_id": row[0],
-                "track_id": row[1],
-                "title": row[2],
-                "artist": row[3],
-                "album": row[4],
-                "playlist": row[5],  # playlist_id из БД
-                "cover": row[6],
-                "quality": row[7],
-            }
+            # Конвейер предыдущего запуска (после restart) не трогает новое состояние
+            if asyncio.current_task() is self.pipeline_task:
+                if self.is_running:
+                    logger.info("✅ Все треки обработаны")
+                self.is_running = False
+                self._publish_stats()
+
+    async def _stage_worker(
+        self, stage_name: str, handler: Callable, next_stage: Optional[str] = None
+    ):
+        """Воркер стадии конвейера: берёт треки из очереди стадии и передаёт дальше"""
+        stage = self.stages[stage_name]
+        next_queue = self.stages[next_stage] if next_stage else None
+        try:
+            while True:
+                job = await stage.get()
+                track = job["track"]
+                stage.begin(track["track_id"])
+
+                success = False
+                try:
+                    success = await handler(job)
+                except Exception as e:
+                    logger.error(
+                        f"❌ Ошибка стадии {stage_name} для {track['title']}: {e}"
+                    )
+                    await self._set_track_status(track, "error", 0, error=str(e))
+                stage.end(track["track_id"], success)
+
+                try:
+                    # task_done только после передачи: иначе join() может
+                    # завершиться раньше, чем трек попадёт в следующую стадию
+                    if success and next_queue:
+                        await next_queue.put(job)
+                finally:
+                    stage.queue.task_done()
+                    self._publish_stats()
+        except asyncio.CancelledError:
+            pass
+
+    async def _heartbeat(self):
+        """Периодически продлевает аренду треков, которые скачивают воркеры процесса"""
+        try:
+            # Задачу отменяет _run_pipeline, когда все треки запуска обработаны
+            while True:
+                await asyncio.sleep(HEARTBEAT_INTERVAL)
+                try:
+                    await asyncio.to_thread(
+                        self.db.renew_download_leases, self.instance_id, LEASE_SECONDS
+                    )
+                except Exception as e:
+                    logger.warning(f"⚠️  Не удалось продлить аренду треков: {e}")
+        except asyncio.CancelledError:
+            pass
 
     def _update_track_status(
         self,
-        track_id: str,
+        track: Dict,
         status: str,
         progress: int = 0,
         error: str = None,
-    ):
-        """Обновить статус трека в БД"""
-        with self.db.get_connection() as conn:
+        wait: bool = True,
+    ) -> bool:
+        """
+        Обновить статус захваченного трека в БД
+
+        Обновление идёт по id строки и только пока аренда принадлежит нашему
+        воркеру. Завершающие статусы (completed/error) и возврат в очередь
+        (queued) освобождают аренду.
+
+        Args:
+            wait: Дождаться коммита. Промежуточный прогресс пишется без
+                ожидания — поток загрузки не блокируется на записи в БД
+
+        Returns:
+            False, если аренда потеряна (строку забрал другой воркер)
+        """
+
+        def operation(conn):
             cursor = conn.cursor()
 
             update_fields = ["status = ?", "progress = ?", "updated_at = ?"]
@@ -481,26 +795,64 @@ class DownloadQueueManager:
                 update_fields.append("error_message = ?")
                 values.append(error)
 
-            values.append(track_id)
+            if status in ("completed", "error", "queued"):
+                update_fields.extend(
+                    [
+                        "lease_owner = NULL",
+                        "lease_expires_at = NULL",
+                        "heartbeat_at = NULL",
+                    ]
+                )
+
+            values.extend([track["db_id"], track.get("lease_owner")])
 
             cursor.execute(
                 f"""
                 UPDATE download_queue
                 SET {', '.join(update_fields)}
-                WHERE track_id = ?
+                WHERE id = ? AND lease_owner IS ?
             """,
                 values,
             )
+            return cursor.rowcount > 0
 
-            conn.commit()
+        if not wait:
+
+            self.db.write_async(operation)
+            return True
+
+        updated = self.db.write(operation)
+
+        # Промежуточный прогресс уходит отдельными событиями progress
+        if updated and status != "downloading":
+            queue_events.publish(
+                "track",
+                {
+                    "id": track.get("db_id"),
+                    "track_id": track["track_id"],
+                    "status": status,
+                    "progress": progress,
+                    "error_message": error,
+                },
+            )
+        return updated
+
+    async def _set_track_status(
+        self, track: Dict, status: str, progress: int = 0, error: str = None
+    ) -> bool:
+        """_update_track_status для корутин: ожидание коммита — в отдельном потоке"""
+        return await asyncio.to_thread(
+            self._update_track_status, track, status, progress, error
+        )
 
     def _remove_track_from_queue(self, track_id: str):
-        """Удалить трек из очереди после успешной загрузки"""
-        with self.db.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("DELETE FROM download_queue WHERE track_id = ?", (track_id,))
-            conn.commit()
-            logger.info(f"🗑️  Трек {track_id} удален из очереди")
+        """Удалить трек из очереди после успешной загрузки (без ожидания коммита)"""
+        self.db.write_async(
+            lambda conn: conn.execute(
+                "DELETE FROM download_queue WHERE track_id = ?", (track_id,)
+            )
+        )
+        logger.info(f"🗑️  Трек {track_id} удален из очереди")
 
     def cleanup_completed_tracks(self, older_than_hours: int = 24):
         """
@@ -509,7 +861,8 @@ class DownloadQueueManager:
         Args:
             older_than_hours: Удалять треки старше указанного количества часов
         """
-        with self.db.get_connection() as conn:
+
+        def operation(conn):
             cursor = conn.cursor()
 
             # Удаляем завершенные треки старше указанного времени
@@ -524,87 +877,235 @@ class DownloadQueueManager:
             )
 
             deleted_count = cursor.rowcount
-            conn.commit()
 
             if deleted_count > 0:
                 logger.info(f"🗑️  Удалено {deleted_count} завершенных треков из очереди")
 
             return deleted_count
 
-    async def _download_track(self, track: Dict):
-        """Скачать один трек"""
+        return self.db.write(operation)
+
+    async def _download_track(self, track: Dict, worker_id: int = 0) -> Optional[Dict]:
+        """
+        Стадия fetch: скачать трек (с расшифровкой на лету)
+
+        Returns:
+            Задание для стадии обработки или None, если скачать не удалось
+        """
         track_id = track["track_id"]
-        self.current_track_id = track_id
+        fetch_stage = self.stages.get("fetch")
+        if fetch_stage:
+            fetch_stage.begin(track_id)
+        self._set_worker_state(
+            worker_id,
+            status="downloading",
+            track_id=track_id,
+            title=track["title"],
+            artist=track["artist"],
+            progress=0,
+            started_at=datetime.now().isoformat(),
+        )
 
         logger.info(f"📥 Начинаем загрузку: {track['title']} - {track['artist']}")
+        # Обложка качается в фоне и будет готова к сохранению трека
+        cover_fetcher.prefetch(track.get("cover"))
+        queue_events.publish(
+            "track",
+            {
+                "id": track.get("db_id"),
+                "track_id": track_id,
+                "status": "downloading",
+                "progress": 0,
+                "worker_id": worker_id,
+                "stage": "fetch",
+            },
+        )
+        self._publish_stats()
+
+        # Прогресс по чанкам живёт в памяти, в БД сбрасывается раз в несколько секунд
+        progress_registry.start(
+            track_id,
+            db_id=track.get("db_id"),
+            title=track["title"],
+            artist=track["artist"],
+            worker_id=worker_id,
+        )
 
+        job = None
         try:
-            # Обновляем статус на 'downloading'
-            self._update_track_status(track_id, "downloading", 0)
-
-            # Формируем путь для сохранения
-            artist = self._sanitize_filename(track["artist"])
-            album = (
-                self._sanitize_filename(track["album"])
-                if track["album"]
-                else "Unknown Album"
-            )
-            title = self._sanitize_filename(track["title"])
-
             # Строим путь к файлу на основе настроек
-            quality = track.get(
-                "quality", "lossless"
-            )  # Используем значение по умолчанию
+            # NULL в колонке quality — качество по умолчанию (тот же ключ, что у предзагрузчика)
+            quality = track.get("quality") or "lossless"
             output_path, track_dir = self._build_file_path(track, quality)
 
             # Создаём директорию если её нет
             track_dir.mkdir(parents=True, exist_ok=True)
 
+            stop_event = self.stop_event
+
             # Колбэк для обновления прогресса
             def progress_callback(downloaded: int, total: int):
+                if stop_event.is_set():
+                    # Прерываем чтение; частичный файл остаётся для докачки
+                    raise DownloadStopped()
                 if total > 0:
+                    flush_progress = progress_registry.update(track_id, downloaded, total)
                     progress = int((downloaded / total) * 100)
-                    self._update_track_status(track_id, "downloading", progress)
-
-            # Скачиваем трек используя существующий клиент
-            result = await asyncio.to_thread(
-                self.client.download_track,
-                track_id=track_id,
-                output_path=str(output_path),
-                quality=quality,
-                progress_callback=progress_callback,
-            )
-
-            if result:
-                # Успешно скачан
-                self._update_track_status(track_id, "completed", 100)
-
-                # Сохраняем информацию о загруженном треке в downloaded_tracks
-                logger.info(
-                    f"🔄 Вызываем _save_downloaded_track_info для {track['title']}"
-                )
-                self._save_downloaded_track_info(track, str(output_path), quality)
-
-                # НЕ удаляем трек из очереди сразу - оставляем для отображения в плашке "Завершено"
-                # Трек будет удален автоматически через некоторое время или при следующей проверке файлов
+                    # Событие только при смене процента — не больше 100 на трек
+                    if progress != self.workers[worker_id]["progress"]:
+                        self.workers[worker_id]["progress"] = progress
+                        queue_events.publish(
+                            "progress", {"track_id": track_id, "progress": progress}
+                        )
+                    if flush_progress is not None:
+                        self._update_track_status(
+                            track, "downloading", flush_progress, wait=False
+                        )
+
+            # Скачиваем трек; конвертацию в FLAC выполнит стадия обработки.
+            # Метаданные и ссылку обычно уже получил предзагрузчик
+            prefetched = self.prefetcher.take(track_id, quality)
+
+            def download():
+                # Ожидание лимитов API тоже прерывается остановкой
+                with cancel_scope(stop_event):
+                    return self.client.download_track(
+                        track_id=track_id,
+                        output_path=str(output_path),
+                        quality=quality,
+                        progress_callback=progress_callback,
+                        defer_mux=True,
+                        prefetched=prefetched,
+                    )
 
-                logger.info(f"✅ Успешно: {track['title']}")
+            result = await asyncio.to_thread(download)
+
+            if stop_event.is_set() and not result:
+                await self._requeue_stopped(track)
+            elif result:
+                job = {
+                    "track": track,
+                    "output_path": str(output_path),
+                    "result": result,
+                    "quality": quality,
+                }
             else:
                 # Ошибка загрузки
                 logger.error(f"❌ result = {result}, файл не скачан: {track['title']}")
-                self._update_track_status(
-                    track_id, "error", 0, error="Не удалось скачать файл"
+                await self._set_track_status(
+                    track, "error", 0, error="Не удалось скачать файл"
                 )
                 logger.error(f"❌ Ошибка: {track['title']}")
 
         except Exception as e:
-            logger.error(f"❌ Ошибка загрузки {track['title']}: {e}")
-            self._update_track_status(track_id, "error", 0, error=str(e))
+            if self.stop_event.is_set():
+                await self._requeue_stopped(track)
+            else:
+                logger.error(f"❌ Ошибка загрузки {track['title']}: {e}")
+                await self._set_track_status(track, "error", 0, error=str(e))
 
         finally:
-            self.current_track_id = None
+            progress_registry.finish(track_id)
+            if fetch_stage:
+                fetch_stage.end(track_id, job is not None)
+            self._set_worker_state(
+                worker_id,
+                status="idle",
+                track_id=None,
+                title=None,
+                artist=None,
+                progress=0,
+                started_at=None,
+            )
+            self._publish_stats()
+
+        return job
+
+    async def _requeue_stopped(self, track: Dict):
+        """Вернуть в очередь трек, скачивание которого прервала остановка"""
+        logger.info(f"⏹️  Скачивание прервано остановкой: {track['title']}")
+        await self._set_track_status(track, "queued", 0)
+
+    async def _process_track(self, job: Dict) -> bool:
+        """Стадия process: конвертация FLAC-MP4 → FLAC и определение качества"""
+        track = job["track"]
+        queue_events.publish(
+            "track",
+            {
+                "id": track.get("db_id"),
+                "track_id": track["track_id"],
+                "status": "downloading",
+                "progress": 100,
+                "stage": "process",
+            },
+        )
+
+        if job["result"].endswith(PENDING_MUX_SUFFIX):
+            flac_path = await asyncio.to_thread(
+                self.client.finalize_flac, job["result"], job["output_path"]
+            )
+            if not flac_path:
+                await self._set_track_status(
+                    track, "error", 0, error="Не удалось конвертировать в FLAC"
+                )
+                return False
+            job["result"] = flac_path
+
+        job["quality_info"] = await asyncio.to_thread(
+            self._probe_quality, job["output_path"], job["quality"]
+        )
+        return True
+
+    async def _persist_track(self, job: Dict) -> bool:
+        """Стадия persist: статус completed, обложка и запись в downloaded_tracks"""
+        track = job["track"]
+
+        if not await self._set_track_status(track, "completed", 100):
+            logger.warning(
+                f"⚠️  Аренда трека {track['track_id']} потеряна до завершения загрузки"
+            )
+
+        # Сохраняем информацию о загруженном треке в downloaded_tracks
+        logger.info(f"🔄 Вызываем _save_downloaded_track_info для {track['title']}")
+        await asyncio.to_thread(
+            self._save_downloaded_track_info,
+            track,
+            job["output_path"],
+            job["quality"],
+            job.get("quality_info"),
+        )
 
-    def _save_downloaded_track_info(self, track: dict, file_path: str, quality: str):
+        # НЕ удаляем трек из очереди сразу - оставляем для отображения в плашке "Завершено"
+        # Трек будет удален автоматически через некоторое время или при следующей проверке файлов
+
+        logger.info(f"✅ Успешно: {track['title']}")
+        return True
+
+    @staticmethod
+    def _probe_quality(file_path: str, quality: str) -> Dict:
+        """Определить качество скачанного файла (по файлу или по запрошенному качеству)"""
+        from audio_quality_utils import (
+            standardize_yandex_quality,
+            determine_audio_quality,
+        )
+
+        if os.path.exists(file_path):
+            quality_info = determine_audio_quality(file_path)
+        else:
+            quality_info = standardize_yandex_quality(quality)
+
+        # Если не удалось определить качество из файла, используем стандартизированное
+        if quality_info["quality_level"] == "Unknown Quality":
+            quality_info = standardize_yandex_quality(quality)
+        return quality_info
+
+    def _save_downloaded_track_info(
+        self,
+        track: dict,
+        file_path: str,
+        quality: str,
+        quality_info: Optional[Dict] = None,
+    ):
         """
         Сохраняет информацию о загруженном треке в downloaded_tracks
 
@@ -612,15 +1113,11 @@ class DownloadQueueManager:
             track: Информация о треке
             file_path: Путь к загруженному файлу
             quality: Качество загрузки
+            quality_info: Качество, уже определённое стадией обработки
         """
         try:
             import os
-            import requests
             from datetime import datetime
-            from audio_quality_utils import (
-                standardize_yandex_quality,
-                determine_audio_quality,
-            )
 
             logger.info(
                 f"💾 Сохраняем информацию о треке: {track['title']} - {track['artist']}"
@@ -633,36 +1130,19 @@ class DownloadQueueManager:
                 logger.warning(f"⚠️  Файл не найден: {file_path}")
                 file_size = 0
 
-            # Определяем качество файла
-            if os.path.exists(file_path):
-                quality_info = determine_audio_quality(file_path)
-            else:
-                quality_info = standardize_yandex_quality(quality)
+            # Определяем качество файла (если стадия обработки ещё не определила)
+            if quality_info is None:
+                quality_info = self._probe_quality(file_path, quality)
 
-            # Если не удалось определить качество из файла, используем стандартизированное
-            if quality_info["quality_level"] == "Unknown Quality":
-                quality_info = standardize_yandex_quality(quality)
+            # Обложка начала скачиваться вместе с треком (или уже есть в кэше)
+            cover_data = cover_fetcher.get(track.get("cover"))
 
-            # Получаем обложку из очереди и скачиваем её
-            cover_data = None
-            if track.get("cover"):
-                try:
-                    response = requests.get(track["cover"], timeout=10)
-                    if response.status_code == 200:
-                        cover_data = response.content
-                        logger.info(f"✅ Обложка скачана для {track['title']}")
-                except Exception as e:
-                    logger.warning(
-                        f"⚠️ Не удалось скачать обложку для {track['title']}: {e}"
-                    )
-
-            # Сохраняем в базу данных
-            with db_manager.get_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute(
+            # Сохраняем в базу данных (обложка — в общее хранилище covers)
+            db_manager.write(
+                lambda conn: conn.execute(
                     """
                     INSERT OR REPLACE INTO downloaded_tracks 
-                    (track_id, title, artist, album, playlist_id, file_path, file_size, format, quality, cover_data, download_date,
+                    (track_id, title, artist, album, playlist_id, file_path, file_size, format, quality, cover_hash, download_date,
                      year, genre, label, isrc, duration, version)
                     VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
                 """,
@@ -676,7 +1156,7 @@ class DownloadQueueManager:
                         round(file_size, 2),
                         quality_info["format"],
                         quality_info["quality_string"],
-                        cover_data,
+                        db_manager.store_cover(conn, cover_data),
                         datetime.now().isoformat(),
                         track.get("year"),
                         track.get("genre"),
@@ -686,18 +1166,11 @@ class DownloadQueueManager:
                         track.get("version"),
                     ),
                 )
-                conn.commit()
-
-                logger.info(
-                    f"✅ Информация о треке сохранена в базу данных: {track['title']}"
-                )
-
-            # Обновляем статистику файлов
-            try:
-                db_manager.update_file_statistics()
-                logger.info(f"✅ Статистика файлов обновлена для {track['title']}")
-            except Exception as e:
-                logger.warning(f"⚠️ Не удалось обновить статистику файлов: {e}")
+            )
+            # Статистику файлов (file_stats) обновляет триггер на downloaded_tracks
+            logger.info(
+                f"✅ Информация о треке сохранена в базу данных: {track['title']}"
+            )
 
         except Exception as e:
             logger.error(f"Ошибка сохранения информации о загруженном треке: {e}")
@@ -63,62 +63,62 @@ class DownloadManager:
             if not track["available"]:
                 continue
 
-            try:
-                # Добавляем трек в очередь
-                with db_manager.get_connection() as conn:
-                    cursor = conn.cursor()
+            # Получаем название плейлиста
+            playlist_name = track.get("playlist_name", "Unknown Playlist")
 
-                    # Получаем название плейлиста
-                    playlist_name = track.get("playlist_name", "Unknown Playlist")
+            def operation(conn):
+                cursor = conn.cursor()
 
-                    # Проверяем, не добавлен ли уже этот трек в очередь для этого плейлиста
-                    cursor.execute(
-                        "SELECT id FROM download_queue WHERE track_id = ? AND playlist_id = ?",
-                        (track["id"], playlist_name),
-                    )
-                    if cursor.fetchone():
-                        continue
-
-                    # Проверяем, не скачан ли уже этот трек для этого плейлиста
-                    # Сначала проверяем по track_id и playlist_id
-                    cursor.execute(
-                        "SELECT id FROM downloaded_tracks WHERE track_id = ? AND playlist_id = ?",
-                        (track["id"], playlist_name),
-                    )
-                    if cursor.fetchone():
-                        continue
+                # Проверяем, не добавлен ли уже этот трек в очередь для этого плейлиста
+                cursor.execute(
+                    "SELECT id FROM download_queue WHERE track_id = ? AND playlist_id = ?",
+                    (track["id"], playlist_name),
+                )
+                if cursor.fetchone():
+                    return False
+
+                # Проверяем, не скачан ли уже этот трек для этого плейлиста
+                # Сначала проверяем по track_id и playlist_id
+                cursor.execute(
+                    "SELECT id FROM downloaded_tracks WHERE track_id = ? AND playlist_id = ?",
+                    (track["id"], playlist_name),
+                )
+                if cursor.fetchone():
+                    return False
 
-                    # Дополнительная проверка по названию и исполнителю для этого плейлиста
-                    cursor.execute(
-                        "SELECT id FROM downloaded_tracks WHERE title = ? AND artist = ? AND playlist_id = ?",
-                        (track["title"], track["artist"], playlist_name),
-                    )
-                    if cursor.fetchone():
-                        continue
+                # Дополнительная проверка по названию и исполнителю для этого плейлиста
+                cursor.execute(
+                    "SELECT id FROM downloaded_tracks WHERE title = ? AND artist = ? AND playlist_id = ?",
+                    (track["title"], track["artist"], playlist_name),
+                )
+                if cursor.fetchone():
+                    return False
 
-                    # Добавляем трек в очередь
-                    cursor.execute(
-                        """
-                        INSERT INTO download_queue 
-                        (track_id, title, artist, album, playlist_id, cover, status, progress, quality, created_at, updated_at)
-                        VALUES (?, ?, ?, ?, ?, ?, 'pending', 0, ?, ?, ?)
-                    """,
-                        (
-                            track["id"],
-                            track["title"],
-                            track["artist"],
-                            track.get("album", "Unknown Album"),
-                            playlist_name,
-                            track.get("cover"),
-                            quality,
-                            datetime.now().isoformat(),
-                            datetime.now().isoformat(),
-                        ),
-                    )
+                # Добавляем трек в очередь
+                cursor.execute(
+                    """
+                    INSERT INTO download_queue 
+                    (track_id, title, artist, album, playlist_id, cover, status, progress, quality, created_at, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?, 'pending', 0, ?, ?, ?)
+                """,
+                    (
+                        track["id"],
+                        track["title"],
+                        track["artist"],
+                        track.get("album", "Unknown Album"),
+                        playlist_name,
+                        track.get("cover"),
+                        quality,
+                        datetime.now().isoformat(),
+                        datetime.now().isoformat(),
+                    ),
+                )
+                return True
 
-                    conn.commit()
+            try:
+                # Добавляем трек в очередь
+                if await asyncio.to_thread(db_manager.write, operation):
                     added_tracks.append(track)
-
             except Exception as e:
                 print(f"Ошибка добавления трека {track['title']} в очередь: {e}")
 
@@ -136,17 +136,17 @@ class DownloadManager:
         for index, track in enumerate(added_tracks, 1):
             try:
                 # Обновляем статус на "downloading"
-                with db_manager.get_connection() as conn:
-                    cursor = conn.cursor()
-                    cursor.execute(
+                await asyncio.to_thread(
+                    db_manager.write,
+                    lambda conn: conn.execute(
                         """
                         UPDATE download_queue 
                         SET status = 'downloading', updated_at = ?
                         WHERE track_id = ?
                     """,
                         (datetime.now().isoformat(), track["id"]),
-                    )
-                    conn.commit()
+                    ),
+                )
                 # Формируем путь для сохранения: {playlist}/{artist}/{album}
                 playlist_folder = self._sanitize_filename(playlist_name)
                 artist_folder = self._sanitize_filename(track["artist"])
@@ -178,7 +178,9 @@ class DownloadManager:
                     except Exception as e:
                         print(f"Ошибка обновления прогресса: {e}")
 
-                file_path = self.client.download_track(
+                # В отдельном потоке: колбэк прогресса пишет в БД с ожиданием коммита
+                file_path = await asyncio.to_thread(
+                    self.client.download_track,
                     track["id"],
                     str(save_path),
                     quality,
@@ -190,17 +192,17 @@ class DownloadManager:
                     self._add_metadata(file_path, track)
 
                     # Обновляем статус на "completed" в базе данных
-                    with db_manager.get_connection() as conn:
-                        cursor = conn.cursor()
-                        cursor.execute(
+                    await asyncio.to_thread(
+                        db_manager.write,
+                        lambda conn: conn.execute(
                             """
                             UPDATE download_queue 
                             SET status = 'completed', progress = 100, updated_at = ?
                             WHERE track_id = ?
                         """,
                             (datetime.now().isoformat(), track["id"]),
-                        )
-                        conn.commit()
+                        ),
+                    )
 
                     results["completed"] += 1
                     results["tracks"].append(
@@ -214,34 +216,35 @@ class DownloadManager:
                     )
                 else:
                     # Обновляем статус на "error" в базе данных
-                    with db_manager.get_connection() as conn:
-                        cursor = conn.cursor()
-                        cursor.execute(
+                    await asyncio.to_thread(
+                        db_manager.write,
+                        lambda conn: conn.execute(
                             """
                             UPDATE download_queue 
                             SET status = 'error', updated_at = ?
                             WHERE track_id = ?
                         """,
                             (datetime.now().isoformat(), track["id"]),
-                        )
-                        conn.commit()
+                        ),
+                    )
 
                     results["failed"] += 1
 
             except Exception as e:
                 print(f"Ошибка загрузки {track['title']}: {e}")
+                error = str(e)
                 # Обновляем статус на "error" в базе данных
-                with db_manager.get_connection() as conn:
-                    cursor = conn.cursor()
-                    cursor.execute(
+                await asyncio.to_thread(
+                    db_manager.write,
+                    lambda conn: conn.execute(
                         """
                         UPDATE download_queue 
                         SET status = 'error', error_message = ?, updated_at = ?
                         WHERE track_id = ?
                     """,
-                        (str(e), datetime.now().isoformat(), track["id"]),
-                    )
-                    conn.commit()
+                        (error, datetime.now().isoformat(), track["id"]),
+                    ),
+                )
 
                 results["failed"] += 1
 
@@ -0,0 +1,509 @@
+"""
+Потоковый демуксер FLAC из MP4 (flac-mp4) без ffmpeg
+
+Яндекс.Музыка отдаёт lossless как MP4 с кодеком FLAC (ISO/IEC 14496-12 +
+"Encapsulation of FLAC in ISO BMFF"). Для получения .flac достаточно:
+  • взять блоки метаданных FLAC (STREAMINFO и др.) из бокса dfLa
+    в sample entry fLaC;
+  • записать сигнатуру "fLaC", эти блоки и затем все сэмплы трека по
+    порядку — каждый сэмпл MP4 является одним FLAC-фреймом.
+
+Поддерживаются фрагментированные файлы (moof/traf/trun + mdat) и обычные
+с moov перед mdat (stsz/stsc/stco). Данные можно подавать порциями через
+feed() прямо по мере расшифровки — mdat не буферизуется целиком.
+Если moov расположен после mdat, используется demux_file(), который
+предварительно находит moov переходами по файлу.
+"""
+
+import logging
+import os
+import struct
+from collections import deque
+from typing import BinaryIO, Dict, List, Optional, Tuple
+
+download_logger = logging.getLogger("download")
+
+FLAC_SIGNATURE = b"fLaC"
+
+# Боксы, внутрь которых нужно спускаться при разборе moov/moof
+CONTAINER_BOXES = {b"trak", b"mdia", b"minf", b"stbl", b"mvex", b"traf"}
+
+# Размер порции чтения при демуксинге файла
+READ_CHUNK_SIZE = 1024 * 1024
+
+
+class FlacDemuxError(Exception):
+    """Контейнер не удалось разобрать как MP4 с FLAC"""
+
+
+def _iter_boxes(data: bytes, start: int = 0, end: Optional[int] = None):
+    """Перебор боксов в буфере: (тип, начало payload, конец бокса, начало бокса)"""
+    end = len(data) if end is None else end
+    pos = start
+    while pos + 8 <= end:
+        size, box_type = struct.unpack_from(">I4s", data, pos)
+        header = 8
+        if size == 1:
+            if pos + 16 > end:
+                raise FlacDemuxError("Обрезанный заголовок бокса")
+            size = struct.unpack_from(">Q", data, pos + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - pos
+        if size < header or pos + size > end:
+            raise FlacDemuxError(f"Некорректный размер бокса {box_type!r}")
+        yield box_type, pos + header, pos + size, pos
+        pos += size
+
+
+class FlacMp4Demuxer:
+    """Потоковое извлечение FLAC-фреймов из MP4 в выходной поток"""
+
+    def __init__(self, output: BinaryIO):
+        self.output = output
+        self.track_id: Optional[int] = None
+        self.metadata_blocks: Optional[bytes] = None
+        self.frames_written = 0
+        self.bytes_written = 0
+
+        self._buffer = bytearray()
+        self._pos = 0  # абсолютная позиция первого байта буфера во входном потоке
+        self._stream_end: Optional[int] = None  # конец текущего mdat/пропускаемого бокса
+        self._stream_is_mdat = False
+        self._moov_parsed = False
+        self._header_written = False
+        self._fragmented = False
+        self._trex_defaults: Dict[int, int] = {}
+        self._trex_default_size = 0
+        self._sample_table: Optional[Dict] = None
+        # Диапазоны сэмплов [начало, конец) в абсолютных позициях, в порядке декодирования
+        self._ranges: deque = deque()
+        self._last_range_end = 0
+
+    # ------------------------------------------------------------------ поток
+
+    def feed(self, data: bytes) -> None:
+        """Подать очередную порцию MP4 (в порядке следования в файле)"""
+        self._buffer += data
+
+        while self._buffer:
+            if self._stream_end is not None:
+                take = min(len(self._buffer), self._stream_end - self._pos)
+                if self._stream_is_mdat:
+                    self._write_ranges(self._pos, memoryview(self._buffer)[:take])
+                del self._buffer[:take]
+                self._pos += take
+                if self._pos == self._stream_end:
+                    self._stream_end = None
+                    continue
+                break
+
+            header = self._peek_box_header()
+            if header is None:
+                break
+            box_type, header_size, box_size = header
+
+            if box_type == b"mdat":
+                if not self._header_written:
+                    raise FlacDemuxError("mdat расположен перед moov — нужен demux_file()")
+                self._stream_is_mdat = True
+                self._stream_end = (
+                    self._pos + box_size if box_size else float("inf")
+                )
+                del self._buffer[:header_size]
+                self._pos += header_size
+                continue
+
+            if box_type in (b"moov", b"moof"):
+                if not box_size:
+                    raise FlacDemuxError(f"Бокс {box_type!r} без размера")
+                if len(self._buffer) < box_size:
+                    break
+                payload = bytes(self._buffer[header_size:box_size])
+                if box_type == b"moov":
+                    if not self._moov_parsed:
+                        self._parse_moov(payload, self._pos + header_size)
+                else:
+                    self._parse_moof(payload, self._pos, self._pos + header_size)
+                del self._buffer[:box_size]
+                self._pos += box_size
+                continue
+
+            # Остальные боксы (ftyp, free, sidx, mfra, ...) пропускаем потоково
+            self._stream_is_mdat = False
+            self._stream_end = self._pos + box_size if box_size else float("inf")
+
+    def close(self) -> Dict:
+        """Завершить демуксинг и проверить, что все фреймы записаны"""
+        if self._stream_end not in (None, float("inf")):
+            raise FlacDemuxError("Входной поток оборвался внутри бокса")
+        if not self._header_written:
+            raise FlacDemuxError("Не найден трек FLAC (moov/dfLa)")
+        if self._ranges:
+            raise FlacDemuxError(
+                f"Не получены данные для {len(self._ranges)} диапазонов сэмплов"
+            )
+        if self.frames_written == 0:
+            raise FlacDemuxError("В файле нет аудиофреймов")
+        return {
+            "frames": self.frames_written,
+            "bytes": self.bytes_written,
+            "fragmented": self._fragmented,
+        }
+
+    def prime_moov(self, moov_payload: bytes, payload_offset: int) -> None:
+        """Передать moov заранее (для файлов, где moov после mdat)"""
+        self._parse_moov(moov_payload, payload_offset)
+
+    def _peek_box_header(self) -> Optional[Tuple[bytes, int, int]]:
+        """Прочитать заголовок бокса из буфера, не удаляя его"""
+        if len(self._buffer) < 8:
+            return None
+        size, box_type = struct.unpack_from(">I4s", self._buffer, 0)
+        header_size = 8
+        if size == 1:
+            if len(self._buffer) < 16:
+                return None
+            size = struct.unpack_from(">Q", self._buffer, 8)[0]
+            header_size = 16
+        if size and size < header_size:
+            raise FlacDemuxError(f"Некорректный размер бокса {box_type!r}")
+        return box_type, header_size, size
+
+    def _write_ranges(self, pos: int, chunk: memoryview) -> None:
+        """Записать из порции mdat байты, попадающие в диапазоны сэмплов"""
+        chunk_end = pos + len(chunk)
+        while self._ranges:
+            start, end = self._ranges[0]
+            if start >= chunk_end:
+                break
+            if start < pos:
+                raise FlacDemuxError("Сэмпл ссылается на уже пройденные данные")
+            write_end = min(end, chunk_end)
+            self.output.write(chunk[start - pos : write_end - pos])
+            self.bytes_written += write_end - start
+            if write_end == end:
+                self._ranges.popleft()
+                self.frames_written += 1
+            else:
+                self._ranges[0] = (write_end, end)
+                break
+
+    def _add_range(self, start: int, size: int) -> None:
+        """Добавить сэмпл; соседние сэмплы не склеиваем, чтобы считать фреймы"""
+        if size <= 0:
+            return
+        if start < self._last_range_end:
+            raise FlacDemuxError("Сэмплы расположены не по порядку — потоковый режим невозможен")
+        self._ranges.append((start, start + size))
+        self._last_range_end = start + size
+
+    # ------------------------------------------------------------------ moov
+
+    def _parse_moov(self, payload: bytes, payload_offset: int) -> None:
+        """Найти трек FLAC, его dfLa и (для обычного MP4) таблицы сэмплов"""
+        for box_type, start, end, _ in _iter_boxes(payload):
+            if box_type == b"trak":
+                track = self._parse_trak(payload, start, end)
+                if track and self.metadata_blocks is None:
+                    self.track_id = track["track_id"]
+                    self.metadata_blocks = track["metadata_blocks"]
+                    self._sample_table = track.get("sample_table")
+            elif box_type == b"mvex":
+                for child, c_start, c_end, _ in _iter_boxes(payload, start, end):
+                    if child == b"trex":
+                        trex_track, _, _, default_size = struct.unpack_from(
+                            ">IIII", payload, c_start + 4
+                        )
+                        self._trex_defaults[trex_track] = default_size
+                self._fragmented = True
+
+        if self.metadata_blocks is None:
+            raise FlacDemuxError("В moov нет трека с sample entry fLaC/dfLa")
+
+        self._trex_default_size = self._trex_defaults.get(self.track_id, 0)
+        self._moov_parsed = True
+        self._write_header()
+
+        if self._sample_table and self._sample_table["sizes"]:
+            for start, size in self._sample_table_ranges(self._sample_table):
+                self._add_range(start, size)
+
+    def _parse_trak(self, data: bytes, start: int, end: int) -> Optional[Dict]:
+        """Разобрать trak: ID трека, dfLa и таблицы stbl"""
+        track_id = None
+        result: Dict = {}
+        stack = [(start, end)]
+        while stack:
+            s, e = stack.pop()
+            for box_type, b_start, b_end, _ in _iter_boxes(data, s, e):
+                if box_type == b"tkhd":
+                    version = data[b_start]
+                    offset = b_start + 4 + (16 if version == 1 else 8)
+                    track_id = struct.unpack_from(">I", data, offset)[0]
+                elif box_type == b"stsd":
+                    blocks = self._parse_stsd(data, b_start, b_end)
+                    if blocks is not None:
+                        result["metadata_blocks"] = blocks
+                elif box_type in (b"stsz", b"stsc", b"stco", b"co64"):
+                    result.setdefault("tables", {})[box_type] = (b_start, b_end)
+                elif box_type in CONTAINER_BOXES:
+                    stack.append((b_start, b_end))
+
+        if "metadata_blocks" not in result:
+            return None
+
+        result["track_id"] = track_id
+        tables = result.pop("tables", {})
+        if b"stsz" in tables and (b"stco" in tables or b"co64" in tables):
+            result["sample_table"] = self._read_sample_table(data, tables)
+        return result
+
+    @staticmethod
+    def _parse_stsd(data: bytes, start: int, end: int) -> Optional[bytes]:
+        """Найти в stsd sample entry fLaC и вернуть блоки метаданных из dfLa"""
+        # FullBox (4) + entry_count (4)
+        for entry_type, e_start, e_end, _ in _iter_boxes(data, start + 8, end):
+            if entry_type != b"fLaC":
+                continue
+            # SampleEntry (8) + AudioSampleEntry (20) → дочерние боксы
+            for child, c_start, c_end, _ in _iter_boxes(data, e_start + 28, e_end):
+                if child == b"dfLa":
+                    return bytes(data[c_start + 4 : c_end])
+        return None
+
+    @staticmethod
+    def _read_sample_table(data: bytes, tables: Dict) -> Dict:
+        """Прочитать stsz/stsc/stco(co64) обычного (нефрагментированного) MP4"""
+        s, _ = tables[b"stsz"]
+        sample_size, sample_count = struct.unpack_from(">II", data, s + 4)
+        if sample_size:
+            sizes = [sample_size] * sample_count
+        else:
+            sizes = list(struct.unpack_from(f">{sample_count}I", data, s + 12))
+
+        stsc = []
+        if b"stsc" in tables:
+            s, _ = tables[b"stsc"]
+            count = struct.unpack_from(">I", data, s + 4)[0]
+            for i in range(count):
+                first_chunk, per_chunk, _ = struct.unpack_from(">III", data, s + 8 + i * 12)
+                stsc.append((first_chunk, per_chunk))
+
+        if b"co64" in tables:
+            s, _ = tables[b"co64"]
+            count = struct.unpack_from(">I", data, s + 4)[0]
+            offsets = list(struct.unpack_from(f">{count}Q", data, s + 8))
+        else:
+            s, _ = tables[b"stco"]
+            count = struct.unpack_from(">I", data, s + 4)[0]
+            offsets = list(struct.unpack_from(f">{count}I", data, s + 8))
+
+        return {"sizes": sizes, "stsc": stsc or [(1, 1)], "chunk_offsets": offsets}
+
+    @staticmethod
+    def _sample_table_ranges(table: Dict) -> List[Tuple[int, int]]:
+        """Абсолютные позиции сэмплов по stsc/stco"""
+        sizes, stsc, offsets = table["sizes"], table["stsc"], table["chunk_offsets"]
+        ranges = []
+        sample_index = 0
+        for chunk_index, chunk_offset in enumerate(offsets, start=1):
+            per_chunk = stsc[0][1]
+            for first_chunk, count in stsc:
+                if first_chunk <= chunk_index:
+                    per_chunk = count
+                else:
+                    break
+            position = chunk_offset
+            for _ in range(per_chunk):
+                if sample_index >= len(sizes):
+                    return ranges
+                ranges.append((position, sizes[sample_index]))
+                position += sizes[sample_index]
+                sample_index += 1
+        return ranges
+
+    def _write_header(self) -> None:
+        """Записать "fLaC" и блоки метаданных (флаг последнего блока выставляется)"""
+        blocks = bytearray(self.metadata_blocks)
+        pos = 0
+        last_header = None
+        while pos + 4 <= len(blocks):
+            last_header = pos
+            length = int.from_bytes(blocks[pos + 1 : pos + 4], "big")
+            blocks[pos] &= 0x7F
+            pos += 4 + length
+        if last_header is None or pos != len(blocks):
+            raise FlacDemuxError("Повреждены блоки метаданных в dfLa")
+        if blocks[0] & 0x7F != 0:
+            raise FlacDemuxError("Первым блоком метаданных должен быть STREAMINFO")
+        blocks[last_header] |= 0x80
+
+        self.output.write(FLAC_SIGNATURE)
+        self.output.write(bytes(blocks))
+        self._header_written = True
+
+    # ------------------------------------------------------------------ moof
+
+    def _parse_moof(self, payload: bytes, moof_start: int, payload_offset: int) -> None:
+        """Разобрать moof: диапазоны сэмплов FLAC-трека во фрагменте"""
+        if not self._header_written:
+            raise FlacDemuxError("moof встретился раньше moov")
+        self._fragmented = True
+
+        for box_type, start, end, _ in _iter_boxes(payload):
+            if box_type != b"traf":
+                continue
+
+            track_id = None
+            base_offset = moof_start
+            default_size = self._trex_default_size
+            next_offset = None
+
+            for child, c_start, c_end, _ in _iter_boxes(payload, start, end):
+                if child == b"tfhd":
+                    flags = int.from_bytes(payload[c_start + 1 : c_start + 4], "big")
+                    track_id = struct.unpack_from(">I", payload, c_start + 4)[0]
+                    pos = c_start + 8
+                    if flags & 0x000001:
+                        base_offset = struct.unpack_from(">Q", payload, pos)[0]
+                        pos += 8
+                    if flags & 0x000002:
+                        pos += 4
+                    if flags & 0x000008:
+                        pos += 4
+                    if flags & 0x000010:
+                        default_size = struct.unpack_from(">I", payload, pos)[0]
+                elif child == b"trun":
+                    if track_id is not None and self.track_id is not None and track_id != self.track_id:
+                        continue
+                    next_offset = self._parse_trun(
+                        payload, c_start, base_offset, default_size, next_offset
+                    )
+
+    def _parse_trun(
+        self,
+        data: bytes,
+        start: int,
+        base_offset: int,
+        default_size: int,
+        next_offset: Optional[int],
+    ) -> int:
+        """Разобрать trun и добавить диапазоны его сэмплов"""
+        flags = int.from_bytes(data[start + 1 : start + 4], "big")
+        sample_count = struct.unpack_from(">I", data, start + 4)[0]
+        pos = start + 8
+
+        if flags & 0x001:
+            data_offset = struct.unpack_from(">i", data, pos)[0]
+            position = base_offset + data_offset
+            pos += 4
+        else:
+            position = next_offset if next_offset is not None else base_offset
+
+        if flags & 0x004:
+            pos += 4
+
+        fields = [flag for flag in (0x100, 0x200, 0x400, 0x800) if flags & flag]
+        for _ in range(sample_count):
+            size = default_size
+            for flag in fields:
+                if flag == 0x200:
+                    size = struct.unpack_from(">I", data, pos)[0]
+                pos += 4
+            if not size:
+                raise FlacDemuxError("Не удалось определить размер сэмпла")
+            self._add_range(position, size)
+            position += size
+
+        return position
+
+
+def _find_moov(source: BinaryIO) -> Optional[Tuple[bytes, int]]:
+    """Найти moov переходами по файлу (без чтения mdat)"""
+    source.seek(0, os.SEEK_END)
+    file_size = source.tell()
+    pos = 0
+    while pos + 8 <= file_size:
+        source.seek(pos)
+        header = source.read(16)
+        size, box_type = struct.unpack_from(">I4s", header, 0)
+        header_size = 8
+        if size == 1:
+            size = struct.unpack_from(">Q", header, 8)[0]
+            header_size = 16
+        elif size == 0:
+            size = file_size - pos
+        if size < header_size:
+            return None
+        if box_type == b"moov":
+            source.seek(pos + header_size)
+            return source.read(size - header_size), pos + header_size
+        pos += size
+    return None
+
+
+def demux_file(input_path: str, output_path: str) -> Dict:
+    """
+    Извлечь FLAC из MP4-файла
+
+    Результат пишется во временный файл и атомарно переименовывается.
+
+    Returns:
+        {frames, bytes, fragmented}
+
+    Raises:
+        FlacDemuxError: если файл не удалось разобрать
+    """
+    temp_output = output_path + ".demux.tmp"
+    try:
+        with open(input_path, "rb") as source, open(temp_output, "wb") as output:
+            demuxer = FlacMp4Demuxer(output)
+
+            # moov может быть в конце файла — находим его заранее
+            moov = _find_moov(source)
+            if moov is None:
+                raise FlacDemuxError("В файле нет бокса moov")
+            demuxer.prime_moov(*moov)
+
+            source.seek(0)
+            while True:
+                chunk = source.read(READ_CHUNK_SIZE)
+                if not chunk:
+                    break
+                demuxer.feed(chunk)
+            stats = demuxer.close()
+
+        os.replace(temp_output, output_path)
+        return stats
+    except (struct.error, IndexError) as e:
+        raise FlacDemuxError(f"Повреждённый MP4: {e}") from e
+    finally:
+        if os.path.exists(temp_output):
+            try:
+                os.remove(temp_output)
+            except OSError:
+                pass
+
+
+def iter_flac_frames(path: str) -> Tuple[bytes, bytes]:
+    """
+    Разделить FLAC-файл на метаданные и аудиоданные (всё после последнего блока)
+
+    Используется для сравнения аудиофреймов независимо от метаданных,
+    которые добавляет ffmpeg (VORBIS_COMMENT, PADDING).
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    if data[:4] != FLAC_SIGNATURE:
+        raise FlacDemuxError(f"{path}: нет сигнатуры fLaC")
+    pos = 4
+    while True:
+        if pos + 4 > len(data):
+            raise FlacDemuxError(f"{path}: обрезаны блоки метаданных")
+        is_last = data[pos] & 0x80
+        length = int.from_bytes(data[pos + 1 : pos + 4], "big")
+        pos += 4 + length
+        if is_last:
+            break
+    return data[:pos], data[pos:]
@@ -2,7 +2,9 @@
 Главный модуль FastAPI приложения для загрузки музыки с Яндекс.Музыки
 """
 
+import asyncio
 import os
+import threading
 from contextlib import asynccontextmanager
 from datetime import datetime
 from pathlib import Path
@@ -15,15 +17,25 @@ from config.database import (
     init_app,
     update_yandex_client,
 )
-from config.settings import get_cors_settings, get_static_dir
+from async_db import async_db
+from config.settings import (
+    get_cors_settings,
+    get_download_workers,
+    get_playlist_cache_ttl,
+    get_static_dir,
+)
+from cover_fetcher import cover_fetcher
 from db_manager import db_manager
 from download_queue_manager import DownloadQueueManager
 from downloader import DownloadManager
 from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from logger_config import get_logger, setup_logging
+from progress_registry import progress_registry
+from starlette.concurrency import run_in_threadpool
+from queue_events import KEEPALIVE_INTERVAL, queue_events
 from pydantic import BaseModel
 from routes import auth
 
@@ -53,6 +65,8 @@ async def lifespan(app: FastAPI):
     yield
     # Shutdown
     print("Приложение завершает работу")
+    async_db.shutdown()
+    db_manager.close_all()
 
 
 # Создание FastAPI приложения
@@ -85,6 +99,7 @@ from models.download import (
     PauseRequest,
     ProgressUpdateRequest,
     RemoveTracksRequest,
+    SyncPlaylistRequest,
     TrackIdRequest,
 )
 from models.playlist import Playlist, Track
@@ -111,6 +126,16 @@ from utils.cover_utils import (
     get_queue_track_cover_response,
     get_track_cover_response,
 )
+from utils.batch_resolver import ResolveCancelled
+from utils.http_client import http_client
+from utils.pagination import next_cursor, page_size
+from utils.rate_limiter import cancel_scope, yandex_api_limits
+
+# Как часто проверять, не отключился ли клиент, пока идёт получение треков
+DISCONNECT_POLL_INTERVAL = 0.5
+
+# Сколько строк сканирования файлов записывать одной операцией писателя
+SCAN_WRITE_BATCH = 200
 
 
 # Функция для обновления клиента (для обратной совместимости - использует config.database)
@@ -126,6 +151,34 @@ def update_yandex_client(token: Optional[str] = None):
     download_queue_manager = get_download_queue_manager()
 
 
+async def run_cancellable(request: Request, func, *args, **kwargs):
+    """
+    Выполнить долгое получение данных из API в пуле потоков
+
+    func получает событие cancel; если HTTP-клиент отключился, событие
+    устанавливается, и невыполненные запросы к API снимаются.
+    """
+    cancel = threading.Event()
+
+    def call():
+        # Ожидание ограничителей запросов к API тоже прерывается отменой
+        with cancel_scope(cancel):
+            return func(*args, cancel=cancel, **kwargs)
+
+    task = asyncio.ensure_future(run_in_threadpool(call))
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_INTERVAL)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                logger.info(f"🔌 Клиент отключился, отменяем {getattr(func, '__name__', func)}")
+                cancel.set()
+                raise HTTPException(status_code=499, detail="Клиент отключился")
+    finally:
+        cancel.set()
+
+
 # Эндпоинты
 @app.get("/api/health")
 async def health_check():
@@ -133,6 +186,23 @@ async def health_check():
     return {"status": "ok"}
 
 
+@app.get("/api/system/http")
+async def http_metrics():
+    """Метрики пула HTTP-соединений, ограничителей запросов к API и кэша обложек"""
+    metrics = http_client.get_metrics()
+    metrics["yandex_api_limits"] = yandex_api_limits.stats()
+    metrics["covers"] = cover_fetcher.stats()
+    return metrics
+
+
+@app.get("/api/system/db")
+async def db_pool_stats():
+    """Статистика пула соединений SQLite и времени выполнения запросов"""
+    stats = db_manager.get_pool_stats()
+    stats["async"] = async_db.stats()
+    return stats
+
+
 @app.get("/api/debug/queue")
 async def debug_queue():
     """Отладочная информация о очереди"""
@@ -198,7 +268,7 @@ async def test_token(request: TokenTest):
     try:
         # Создаем временный клиент для проверки
         test_client = YandexMusicClient(request.token)
-        success = test_client.connect()
+        success = await run_in_threadpool(test_client.connect)
 
         if success:
             # Определяем тип токена
@@ -207,16 +277,16 @@ async def test_token(request: TokenTest):
             # Сохраняем токен в базу данных
             try:
                 # Сохраняем в новую таблицу токенов
-                db_manager.save_token(
+                await async_db.save_token(
                     "Основной токен", request.token, token_type, is_active=True
                 )
                 # Также сохраняем в старую таблицу для совместимости
-                db_manager.save_setting("yandex_token", request.token)
+                await async_db.save_setting("yandex_token", request.token)
             except Exception as db_error:
                 print(f"Ошибка сохранения токена в БД: {db_error}")
 
             # Обновляем глобальный клиент
-            update_yandex_client(request.token)
+            await run_in_threadpool(update_yandex_client, request.token)
             return {"status": "success", "message": "Подключение успешно"}
         else:
             print(f"Токен не прошел проверку: {request.token[:20]}...")
@@ -239,23 +309,23 @@ async def test_dual_tokens(request: DualTokenTest):
     try:
         # Проверяем OAuth токен
         oauth_client = YandexMusicClient(request.oauth_token)
-        oauth_success = oauth_client.connect()
+        oauth_success = await run_in_threadpool(oauth_client.connect)
 
         # Проверяем Session ID токен
         session_client = YandexMusicClient(request.session_id_token)
-        session_success = session_client.connect()
+        session_success = await run_in_threadpool(session_client.connect)
 
         if oauth_success and session_success:
             # Оба токена работают - проверяем подписку через OAuth (приоритет)
             has_subscription, has_lossless_access, subscription_dict = (
-                check_subscription_status(oauth_client)
+                await run_in_threadpool(check_subscription_status, oauth_client)
             )
 
             # Если через OAuth не получилось, пробуем через Session ID
             if not has_subscription:
                 print("Пробуем проверить подписку через Session ID клиент...")
                 has_subscription, has_lossless_access, subscription_dict = (
-                    check_subscription_status(session_client)
+                    await run_in_threadpool(check_subscription_status, session_client)
                 )
 
             return {
@@ -270,7 +340,7 @@ async def test_dual_tokens(request: DualTokenTest):
         elif oauth_success:
             # Только OAuth работает - проверяем подписку через OAuth
             has_subscription, has_lossless_access, subscription_dict = (
-                check_subscription_status(oauth_client)
+                await run_in_threadpool(check_subscription_status, oauth_client)
             )
 
             return {
@@ -286,7 +356,7 @@ async def test_dual_tokens(request: DualTokenTest):
             # Только Session ID работает - проверяем подписку через Session ID
             print("OAuth не работает, проверяем подписку через Session ID...")
             has_subscription, has_lossless_access, subscription_dict = (
-                check_subscription_status(session_client)
+                await run_in_threadpool(check_subscription_status, session_client)
             )
 
             return {
@@ -383,7 +453,7 @@ async def get_token_guide():
 async def get_tokens():
     """Получить список сохраненных токенов"""
     try:
-        return db_manager.get_all_tokens()
+        return await async_db.get_all_tokens()
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -394,7 +464,7 @@ async def save_token_endpoint(request: SaveTokenRequest):
     try:
         # Проверяем токен
         test_client = YandexMusicClient(request.token)
-        success = test_client.connect()
+        success = await run_in_threadpool(test_client.connect)
 
         if not success:
             raise HTTPException(status_code=400, detail="Токен не работает")
@@ -403,7 +473,7 @@ async def save_token_endpoint(request: SaveTokenRequest):
         username = request.username
         if not username and test_client.client:
             try:
-                account = test_client.client.account_status()
+                account = await run_in_threadpool(test_client.client.account_status)
                 if account and account.account:
                     username = account.account.login
                     print(f"Получен username из токена: {username}")
@@ -414,12 +484,12 @@ async def save_token_endpoint(request: SaveTokenRequest):
         token_type = "oauth" if request.token.startswith("y0_") else "session_id"
 
         # Сохраняем токен
-        token_id = db_manager.save_token(
+        token_id = await async_db.save_token(
             request.name, request.token, token_type, username, is_active=True
         )
 
         # Обновляем глобальный клиент
-        update_yandex_client(request.token)
+        await run_in_threadpool(update_yandex_client, request.token)
 
         return {
             "status": "success",
@@ -436,12 +506,12 @@ async def save_token_endpoint(request: SaveTokenRequest):
 async def activate_token_endpoint(request: ActivateTokenRequest):
     """Активировать токен"""
     try:
-        success = db_manager.activate_token(request.token_id)
+        success = await async_db.activate_token(request.token_id)
         if not success:
             raise HTTPException(status_code=404, detail="Токен не найден")
 
         # Обновляем клиент с новым токеном
-        update_yandex_client()
+        await run_in_threadpool(update_yandex_client)
 
         return {"status": "success", "message": "Токен активирован"}
     except HTTPException:
@@ -454,12 +524,12 @@ async def activate_token_endpoint(request: ActivateTokenRequest):
 async def deactivate_token_endpoint(request: ActivateTokenRequest):
     """Деактивировать токен"""
     try:
-        success = db_manager.deactivate_token(request.token_id)
+        success = await async_db.deactivate_token(request.token_id)
         if not success:
             raise HTTPException(status_code=404, detail="Токен не найден")
 
         # Обновляем клиент
-        update_yandex_client()
+        await run_in_threadpool(update_yandex_client)
 
         return {"status": "success", "message": "Токен деактивирован"}
     except HTTPException:
@@ -472,7 +542,7 @@ async def deactivate_token_endpoint(request: ActivateTokenRequest):
 async def delete_token_endpoint(token_id: int):
     """Удалить токен"""
     try:
-        success = db_manager.delete_token(token_id)
+        success = await async_db.delete_token(token_id)
         if not success:
             raise HTTPException(status_code=404, detail="Токен не найден")
 
@@ -490,7 +560,7 @@ async def delete_token_endpoint(token_id: int):
 async def rename_token_endpoint(token_id: int, request: RenameTokenRequest):
     """Переименовать токен"""
     try:
-        success = db_manager.rename_token(token_id, request.name)
+        success = await async_db.rename_token(token_id, request.name)
         if not success:
             raise HTTPException(status_code=404, detail="Токен не найден")
 
@@ -512,7 +582,7 @@ async def update_token_username_endpoint(token_id: int):
 
         # Тестируем токен и получаем username
         test_client = YandexMusicClient(token_info["token"])
-        success = test_client.connect()
+        success = await run_in_threadpool(test_client.connect)
 
         if not success:
             raise HTTPException(status_code=400, detail="Токен не работает")
@@ -520,7 +590,7 @@ async def update_token_username_endpoint(token_id: int):
         username = None
         if test_client.client:
             try:
-                account = test_client.client.account_status()
+                account = await run_in_threadpool(test_client.client.account_status)
                 if account and account.account:
                     username = account.account.login
                     print(f"Обновлен username для токена {token_id}: {username}")
@@ -528,7 +598,7 @@ async def update_token_username_endpoint(token_id: int):
                 print(f"Не удалось получить username: {e}")
 
         if username:
-            success = db_manager.update_token_username(token_id, username)
+            success = await async_db.update_token_username(token_id, username)
             if not success:
                 raise HTTPException(
                     status_code=500, detail="Не удалось обновить username"
@@ -602,7 +672,7 @@ async def get_account_tokens(account_id: int):
 async def get_accounts():
     """Получить список аккаунтов"""
     try:
-        return db_manager.get_all_accounts()
+        return await async_db.get_all_accounts()
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -617,7 +687,7 @@ async def save_account_endpoint(request: SaveAccountRequest):
         if request.oauth_token:
             logger.info("Проверка OAuth токена...")
             test_client = YandexMusicClient(request.oauth_token)
-            if not test_client.connect():
+            if not await run_in_threadpool(test_client.connect):
                 logger.error("OAuth токен не прошел проверку")
                 raise HTTPException(
                     status_code=400, detail="OAuth токен не прошел проверку"
@@ -627,7 +697,7 @@ async def save_account_endpoint(request: SaveAccountRequest):
         if request.session_id_token:
             logger.info("Проверка Session ID токена...")
             test_client = YandexMusicClient(request.session_id_token)
-            if not test_client.connect():
+            if not await run_in_threadpool(test_client.connect):
                 logger.error("Session ID токен не прошел проверку")
                 raise HTTPException(
                     status_code=400, detail="Session ID токен не прошел проверку"
@@ -640,8 +710,8 @@ async def save_account_endpoint(request: SaveAccountRequest):
             try:
                 logger.info("Получение username из OAuth токена...")
                 test_client = YandexMusicClient(request.oauth_token)
-                if test_client.connect() and test_client.client:
-                    account = test_client.client.account_status()
+                if await run_in_threadpool(test_client.connect) and test_client.client:
+                    account = await run_in_threadpool(test_client.client.account_status)
                     if account and account.account:
                         username = account.account.login
                         logger.info(f"Получен username из OAuth токена: {username}")
@@ -652,7 +722,7 @@ async def save_account_endpoint(request: SaveAccountRequest):
         logger.info(
             f"Сохранение аккаунта в базу данных: name={request.name}, username={username}"
         )
-        account_id = db_manager.save_account(
+        account_id = await async_db.save_account(
             name=request.name,
             oauth_token=request.oauth_token,
             session_id_token=request.session_id_token,
@@ -662,7 +732,7 @@ async def save_account_endpoint(request: SaveAccountRequest):
         logger.info(f"Аккаунт успешно сохранен с ID: {account_id}")
 
         # Обновляем глобальный клиент
-        update_yandex_client()
+        await run_in_threadpool(update_yandex_client)
 
         return {
             "status": "success",
@@ -682,12 +752,12 @@ async def save_account_endpoint(request: SaveAccountRequest):
 async def activate_account_endpoint(request: ActivateAccountRequest):
     """Активировать аккаунт"""
     try:
-        success = db_manager.activate_account(request.account_id)
+        success = await async_db.activate_account(request.account_id)
         if not success:
             raise HTTPException(status_code=404, detail="Аккаунт не найден")
 
         # Обновляем глобальный клиент
-        update_yandex_client()
+        await run_in_threadpool(update_yandex_client)
 
         return {"status": "success", "message": "Аккаунт активирован"}
     except HTTPException:
@@ -700,7 +770,7 @@ async def activate_account_endpoint(request: ActivateAccountRequest):
 async def deactivate_account_endpoint(request: ActivateAccountRequest):
     """Деактивировать аккаунт"""
     try:
-        success = db_manager.deactivate_account(request.account_id)
+        success = await async_db.deactivate_account(request.account_id)
         if not success:
             raise HTTPException(status_code=404, detail="Аккаунт не найден")
 
@@ -715,7 +785,7 @@ async def deactivate_account_endpoint(request: ActivateAccountRequest):
 async def delete_account_endpoint(account_id: int):
     """Удалить аккаунт"""
     try:
-        success = db_manager.delete_account(account_id)
+        success = await async_db.delete_account(account_id)
         if not success:
             raise HTTPException(status_code=404, detail="Аккаунт не найден")
 
@@ -733,7 +803,7 @@ async def delete_account_endpoint(account_id: int):
 async def rename_account_endpoint(account_id: int, request: RenameAccountRequest):
     """Переименовать аккаунт"""
     try:
-        success = db_manager.rename_account(account_id, request.name)
+        success = await async_db.rename_account(account_id, request.name)
         if not success:
             raise HTTPException(status_code=404, detail="Аккаунт не найден")
 
@@ -758,8 +828,8 @@ async def update_account_username_endpoint(account_id: int):
         if account_info.get("oauth_token"):
             try:
                 test_client = YandexMusicClient(account_info["oauth_token"])
-                if test_client.connect() and test_client.client:
-                    account = test_client.client.account_status()
+                if await run_in_threadpool(test_client.connect) and test_client.client:
+                    account = await run_in_threadpool(test_client.client.account_status)
                     if account and account.account:
                         username = account.account.login
                         print(
@@ -769,7 +839,7 @@ async def update_account_username_endpoint(account_id: int):
                 print(f"Не удалось получить username: {e}")
 
         if username:
-            success = db_manager.update_account_username(account_id, username)
+            success = await async_db.update_account_username(account_id, username)
             if not success:
                 raise HTTPException(
                     status_code=500, detail="Не удалось обновить username"
@@ -793,11 +863,11 @@ async def test_dual_account_tokens(request: DualTokenTest):
     try:
         # Проверяем OAuth токен
         oauth_client = YandexMusicClient(request.oauth_token)
-        oauth_success = oauth_client.connect()
+        oauth_success = await run_in_threadpool(oauth_client.connect)
 
         # Проверяем Session ID токен
         session_client = YandexMusicClient(request.session_id_token)
-        session_success = session_client.connect()
+        session_success = await run_in_threadpool(session_client.connect)
 
         if oauth_success and session_success:
             # Оба токена работают - проверяем подписку и lossless-доступ
@@ -807,7 +877,7 @@ async def test_dual_account_tokens(request: DualTokenTest):
 
             try:
                 if oauth_client.client:
-                    account = oauth_client.client.account_status()
+                    account = await run_in_threadpool(oauth_client.client.account_status)
                     subscription = account.subscription
 
                     print(f"Full account status: {account}")
@@ -920,7 +990,7 @@ async def get_playlists():
             f"Запрос плейлистов для пользователя: {username or 'текущий пользователь'}"
         )
         try:
-            playlists = yandex_client.get_playlists(username)
+            playlists = await run_in_threadpool(yandex_client.get_playlists, username)
 
             if playlists is None:
                 logger.error("Метод get_playlists вернул None")
@@ -960,8 +1030,8 @@ async def load_playlist_covers(request: Request):
         playlists_data = await request.json()
 
         # Догружаем обложки
-        updated_playlists = yandex_client.load_playlist_covers_background(
-            playlists_data
+        updated_playlists = await run_in_threadpool(
+            yandex_client.load_playlist_covers_background, playlists_data
         )
 
         return {"success": True, "playlists": updated_playlists}
@@ -970,7 +1040,7 @@ async def load_playlist_covers(request: Request):
 
 
 @app.get("/api/playlists/{playlist_id}/tracks", response_model=List[Track])
-async def get_playlist_tracks(playlist_id: str):
+async def get_playlist_tracks(playlist_id: str, request: Request):
     """Получить треки плейлиста"""
     try:
         if not yandex_client:
@@ -982,10 +1052,18 @@ async def get_playlist_tracks(playlist_id: str):
         max_tracks = playlist_settings.get("max_tracks")
 
         # Получаем треки с учетом настроек
-        tracks = yandex_client.get_playlist_tracks(
-            playlist_id, batch_size=batch_size, max_tracks=max_tracks
+        tracks = await run_cancellable(
+            request,
+            yandex_client.get_playlist_tracks,
+            playlist_id,
+            batch_size=batch_size,
+            max_tracks=max_tracks,
         )
         return tracks
+    except HTTPException:
+        raise
+    except ResolveCancelled:
+        raise HTTPException(status_code=499, detail="Клиент отключился")
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -1001,7 +1079,7 @@ async def get_subscription_info():
         if not yandex_client.client:
             raise HTTPException(status_code=400, detail="Клиент не подключен")
 
-        account = yandex_client.client.account_status()
+        account = await run_in_threadpool(yandex_client.client.account_status)
 
         return {
             "has_subscription": account.subscription is not None,
@@ -1024,14 +1102,16 @@ async def get_track_formats(track_id: str):
             raise HTTPException(status_code=400, detail="Клиент не инициализирован")
 
         # Получаем информацию о треке
-        tracks_result = yandex_client.client.tracks([track_id])
+        tracks_result = await run_in_threadpool(yandex_client.get_tracks, [track_id])
         if not tracks_result or len(tracks_result) == 0:
             raise HTTPException(status_code=404, detail="Трек не найден")
 
         track = tracks_result[0]
         print(f"🔍 Получение форматов для трека: {track.title}")
 
-        download_info = track.get_download_info(get_direct_links=True)
+        download_info = await run_in_threadpool(
+            track.get_download_info, get_direct_links=True
+        )
 
         formats = []
         has_flac = False
@@ -1047,7 +1127,7 @@ async def get_track_formats(track_id: str):
 
             # Пробуем получить прямую ссылку
             try:
-                direct_link = info.get_direct_link()
+                direct_link = await run_in_threadpool(info.get_direct_link)
                 format_data["direct_link"] = direct_link[:100] + "..."
                 format_data["has_signature"] = "ysign1=" in direct_link
 
@@ -1065,7 +1145,7 @@ async def get_track_formats(track_id: str):
         # Проверяем подписку
         subscription_status = None
         try:
-            account = yandex_client.client.account_status()
+            account = await run_in_threadpool(yandex_client.client.account_status)
             if account:
                 subscription_status = {
                     "has_plus": account.plus is not None,
@@ -1100,7 +1180,9 @@ async def get_track_file_info(track_id: str, quality: str = "lossless"):
         if not yandex_client:
             raise HTTPException(status_code=400, detail="Клиент не инициализирован")
 
-        file_info = yandex_client.get_file_info(track_id, quality)
+        file_info = await run_in_threadpool(
+            yandex_client.get_file_info, track_id, quality
+        )
 
         if file_info:
             return {"track_id": track_id, "quality": quality, "file_info": file_info}
@@ -1112,89 +1194,29 @@ async def get_track_file_info(track_id: str, quality: str = "lossless"):
 
 
 @app.post("/api/download/playlist/preview")
-async def preview_playlist_download(request: DownloadRequest):
+async def preview_playlist_download(request: DownloadRequest, http_request: Request):
     """Шаг 1: Формирование списка треков для загрузки (без скачивания)"""
     try:
         if not yandex_client:
             raise HTTPException(status_code=400, detail="Клиент не инициализирован")
 
         # Получаем треки плейлиста
-        tracks = yandex_client.get_playlist_tracks(request.playlist_id)
+        tracks = await run_cancellable(
+            http_request, yandex_client.get_playlist_tracks, request.playlist_id
+        )
 
         # Фильтруем только доступные треки
         available_tracks = [t for t in tracks if t.get("available", False)]
 
-        # Добавляем треки в очередь со статусом 'queued' (подготовлены, но не запущены)
-        added_count = 0
-        existing_count = 0
-        already_downloaded_count = 0
-
-        for track in available_tracks:
-            try:
-                with db_manager.get_connection() as conn:
-                    cursor = conn.cursor()
+        # Добавляем треки в очередь со статусом 'queued' (подготовлены, но не запущены).
+        # Дубликаты отсеиваются одним набором запросов в одной транзакции
+        result = await async_db.bulk_enqueue_tracks(available_tracks, request.quality)
+        added_count = result["added"]
+        existing_count = result["existing"]
+        already_downloaded_count = result["already_downloaded"]
 
-                    # Получаем название плейлиста
-                    playlist_name = track.get("playlist_name", "Unknown Playlist")
-
-                    # Проверяем, не добавлен ли уже этот трек в очередь для этого плейлиста
-                    cursor.execute(
-                        "SELECT id FROM download_queue WHERE track_id = ? AND playlist_id = ?",
-                        (track["id"], playlist_name),
-                    )
-                    if cursor.fetchone():
-                        existing_count += 1
-                        continue
-
-                    # Проверяем, не скачан ли уже этот трек для этого плейлиста
-                    # Сначала проверяем по track_id и playlist_id
-                    cursor.execute(
-                        "SELECT id FROM downloaded_tracks WHERE track_id = ? AND playlist_id = ?",
-                        (track["id"], playlist_name),
-                    )
-                    if cursor.fetchone():
-                        already_downloaded_count += 1
-                        continue
-
-                    # Дополнительная проверка по названию и исполнителю для этого плейлиста
-                    cursor.execute(
-                        "SELECT id FROM downloaded_tracks WHERE title = ? AND artist = ? AND playlist_id = ?",
-                        (track["title"], track["artist"], playlist_name),
-                    )
-                    if cursor.fetchone():
-                        already_downloaded_count += 1
-                        continue
-
-                    # Получаем название плейлиста
-                    playlist_name = track.get("playlist_name", "Unknown Playlist")
-
-                    # Добавляем трек в очередь со статусом 'queued'
-                    cursor.execute(
-                        """
-                        INSERT INTO download_queue (
-                            track_id, title, artist, album, playlist_id, cover,
-                            status, progress, quality, created_at, updated_at
-                        )
-                        VALUES (?, ?, ?, ?, ?, ?, 'queued', 0, ?, ?, ?)
-                    """,
-                        (
-                            track["id"],
-                            track["title"],
-                            track["artist"],
-                            track.get("album", "Unknown Album"),
-                            playlist_name,
-                            track.get("cover"),
-                            request.quality,
-                            datetime.now().isoformat(),
-                            datetime.now().isoformat(),
-                        ),
-                    )
-
-                    conn.commit()
-                    added_count += 1
-
-            except Exception as e:
-                logger.error(f"Ошибка добавления трека {track['title']} в очередь: {e}")
+        if added_count:
+            queue_events.publish("queue_changed")
 
         return {
             "status": "success",
@@ -1208,6 +1230,10 @@ async def preview_playlist_download(request: DownloadRequest):
             "already_downloaded": already_downloaded_count,
             "total": len(available_tracks),
         }
+    except HTTPException:
+        raise
+    except ResolveCancelled:
+        raise HTTPException(status_code=499, detail="Клиент отключился")
     except Exception as e:
         logger.error(f"Ошибка подготовки списка загрузки: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -1218,19 +1244,10 @@ async def get_stats():
     """Получить статистику загрузок"""
     try:
         # Получаем статистику очереди
-        queue_stats = db_manager.get_download_queue_stats()
+        queue_stats = await async_db.get_download_queue_stats()
 
-        # Получаем статистику скачанных файлов
-        with db_manager.get_connection() as conn:
-            cursor = conn.cursor()
-
-            cursor.execute("SELECT COUNT(*) FROM downloaded_tracks")
-            downloaded_tracks = cursor.fetchone()[0]
-
-            cursor.execute(
-                "SELECT SUM(file_size) FROM downloaded_tracks WHERE file_size IS NOT NULL"
-            )
-            total_size = cursor.fetchone()[0] or 0
+        # Получаем статистику скачанных файлов (агрегаты file_stats)
+        downloaded_tracks, total_size = await async_db.get_file_totals()
 
         return {
             "totalTracks": downloaded_tracks,  # Всего файлов в БД
@@ -1253,7 +1270,7 @@ async def get_stats():
 async def check_missing_files():
     """Проверить физическое наличие файлов и очистить записи о несуществующих"""
     try:
-        result = db_manager.check_and_cleanup_missing_files()
+        result = await async_db.check_and_cleanup_missing_files()
 
         return {
             "status": "success",
@@ -1288,7 +1305,11 @@ async def cleanup_completed_tracks():
         queue_manager = DownloadQueueManager(db_manager, yandex_client, download_path)
 
         # Очищаем завершенные треки старше 1 часа
-        deleted_count = queue_manager.cleanup_completed_tracks(older_than_hours=1)
+        deleted_count = await async_db.run(
+            queue_manager.cleanup_completed_tracks, older_than_hours=1
+        )
+        if deleted_count:
+            queue_events.publish("queue_changed")
 
         return {
             "status": "success",
@@ -1302,54 +1323,84 @@ async def cleanup_completed_tracks():
 
 
 @app.get("/api/playlists/{playlist_id}/stats")
-async def get_playlist_stats(playlist_id: str):
-    """Получить статистику плейлиста"""
+async def get_playlist_stats(playlist_id: str, request: Request, refresh: bool = False):
+    """
+    Получить статистику плейлиста
+
+    Состав плейлиста берётся из кэша БД; из Яндекс.Музыки он загружается
+    заново, если кэша нет, он старше PLAYLIST_CACHE_TTL или передан refresh.
+    """
     try:
         if not yandex_client:
             raise HTTPException(status_code=400, detail="Клиент не инициализирован")
 
-        # Получаем треки плейлиста
-        tracks = yandex_client.get_playlist_tracks(playlist_id)
-        available_tracks = [t for t in tracks if t.get("available", False)]
+        stats = None
+        if not refresh:
+            stats = await async_db.get_playlist_track_stats(
+                playlist_id, max_age=get_playlist_cache_ttl()
+            )
 
-        # Подсчитываем статистику
-        total_tracks = len(available_tracks)
-        queued_tracks = 0
-        downloaded_tracks = 0
+        if stats is None:
+            # Загрузка треков обновляет кэш состава плейлиста
+            await run_cancellable(request, yandex_client.get_playlist_tracks, playlist_id)
+            stats = await async_db.get_playlist_track_stats(playlist_id)
 
-        for track in available_tracks:
-            playlist_name = track.get("playlist_name", "Unknown Playlist")
+        if stats is None:
+            return {
+                "playlist_id": playlist_id,
+                "total_tracks": 0,
+                "queued_tracks": 0,
+                "downloaded_tracks": 0,
+                "available_tracks": 0,
+            }
+        return stats
 
-            with db_manager.get_connection() as conn:
-                cursor = conn.cursor()
+    except HTTPException:
+        raise
+    except ResolveCancelled:
+        raise HTTPException(status_code=499, detail="Клиент отключился")
+    except Exception as e:
+        logger.error(f"Ошибка получения статистики плейлиста: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
 
-                # Проверяем, есть ли трек в очереди
-                cursor.execute(
-                    "SELECT id FROM download_queue WHERE track_id = ? AND playlist_id = ?",
-                    (track["id"], playlist_name),
-                )
-                if cursor.fetchone():
-                    queued_tracks += 1
-                    continue
 
-                # Проверяем, скачан ли трек
-                cursor.execute(
-                    "SELECT id FROM downloaded_tracks WHERE track_id = ? AND playlist_id = ?",
-                    (track["id"], playlist_name),
-                )
-                if cursor.fetchone():
-                    downloaded_tracks += 1
+@app.post("/api/playlists/{playlist_id}/sync")
+async def sync_playlist(
+    playlist_id: str, http_request: Request, request: SyncPlaylistRequest = None
+):
+    """
+    Инкрементальная синхронизация плейлиста
 
-        return {
-            "playlist_id": playlist_id,
-            "total_tracks": total_tracks,
-            "queued_tracks": queued_tracks,
-            "downloaded_tracks": downloaded_tracks,
-            "available_tracks": total_tracks - queued_tracks - downloaded_tracks,
-        }
+    Сравнивает текущий список треков со снимком в БД и возвращает добавленные
+    треки и ID удалённых. Метаданные запрашиваются только для добавленных.
+    """
+    request = request or SyncPlaylistRequest()
+    try:
+        if not yandex_client:
+            raise HTTPException(status_code=400, detail="Клиент не инициализирован")
 
+        result = await run_cancellable(
+            http_request, yandex_client.sync_playlist, playlist_id
+        )
+
+        result["enqueued"] = 0
+        if request.enqueue and result["added"]:
+            available_tracks = [t for t in result["added"] if t.get("available", False)]
+            enqueue_result = await async_db.bulk_enqueue_tracks(
+                available_tracks, request.quality
+            )
+            result["enqueued"] = enqueue_result["added"]
+            if enqueue_result["added"]:
+                queue_events.publish("queue_changed")
+
+        return result
+
+    except HTTPException:
+        raise
+    except ResolveCancelled:
+        raise HTTPException(status_code=499, detail="Клиент отключился")
     except Exception as e:
-        logger.error(f"Ошибка получения статистики плейлиста: {e}")
+        logger.error(f"Ошибка синхронизации плейлиста {playlist_id}: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
@@ -1358,10 +1409,10 @@ async def get_download_stats():
     """Получить детальную статистику загрузок"""
     try:
         # Получаем статистику из очереди загрузок
-        queue_stats = db_manager.get_download_queue_stats()
+        queue_stats = await async_db.get_download_queue_stats()
 
-        # Получаем и обновляем статистику загруженных файлов
-        file_stats = db_manager.update_file_statistics()
+        # Статистика загруженных файлов (агрегаты поддерживаются триггерами)
+        file_stats = await async_db.get_file_statistics()
 
         return {
             "queue": queue_stats,
@@ -1509,6 +1560,13 @@ async def get_download_progress():
                 result["current_status"] = status
                 result["current_progress"] = progress or 0
 
+            # Актуальный прогресс активной загрузки хранится в памяти
+            active_progress = progress_registry.snapshot()
+            if active_progress:
+                latest = max(active_progress.values(), key=lambda e: e["updated_at"])
+                result["current_status"] = latest["status"]
+                result["current_progress"] = latest["progress"]
+
             return result
 
     except Exception as e:
@@ -1524,7 +1582,7 @@ async def update_download_path(request: dict):
         if not download_path:
             raise HTTPException(status_code=400, detail="downloadPath обязателен")
 
-        db_manager.save_setting("download_path", download_path)
+        await async_db.save_setting("download_path", download_path)
         return {"message": "Путь загрузки обновлен", "downloadPath": download_path}
     except Exception as e:
         logger.error(f"Ошибка обновления пути загрузки: {e}")
@@ -1620,23 +1678,26 @@ async def save_settings(settings: Settings):
         path_changed = settings.downloadPath != current_path
 
         # Сохраняем настройки в базу данных
-        db_manager.save_setting("download_path", settings.downloadPath)
-        db_manager.save_setting("quality", settings.quality)
-        db_manager.save_setting("auto_sync", str(settings.autoSync))
-        db_manager.save_setting("sync_interval", str(settings.syncInterval))
+        await async_db.save_setting("download_path", settings.downloadPath)
+        await async_db.save_setting("quality", settings.quality)
+        await async_db.save_setting("auto_sync", str(settings.autoSync))
+        await async_db.save_setting("sync_interval", str(settings.syncInterval))
 
         # Сохраняем дополнительные настройки
         if settings.fileTemplate:
-            db_manager.save_setting("file_template", settings.fileTemplate)
+            await async_db.save_setting("file_template", settings.fileTemplate)
         if settings.folderStructure:
-            db_manager.save_setting("folder_structure", settings.folderStructure)
+            await async_db.save_setting("folder_structure", settings.folderStructure)
+        if settings.downloadWorkers:
+            # Применяется при следующем запуске очереди
+            await async_db.save_setting("download_workers", str(settings.downloadWorkers))
 
         # Если изменился токен, обновляем клиент
         current_token = db_manager.get_setting("yandex_token", "")
         token_changed = settings.token and settings.token != current_token
         if token_changed:
-            db_manager.save_setting("yandex_token", settings.token)
-            update_yandex_client(settings.token)
+            await async_db.save_setting("yandex_token", settings.token)
+            await run_in_threadpool(update_yandex_client, settings.token)
         # Если изменился путь загрузки или токен, обновляем менеджер очереди
         elif path_changed:
             # Обновляем менеджер очереди с новым путем
@@ -1653,7 +1714,7 @@ async def save_settings(settings: Settings):
                     logger.error(f"Ошибка обновления менеджера очереди: {e}")
             else:
                 # Если клиент не инициализирован, пробуем инициализировать заново
-                update_yandex_client()
+                await run_in_threadpool(update_yandex_client)
                 download_queue_manager = get_download_queue_manager()
 
         return {"status": "saved"}
@@ -1667,32 +1728,32 @@ async def get_settings():
     """Получить текущие настройки"""
     try:
         # Получаем активный токен
-        active_token = db_manager.get_active_token()
+        active_token = await async_db.get_active_token()
         current_token = active_token["token"] if active_token else ""
 
+        # Все настройки одним запросом
+        settings = await async_db.get_all_settings()
+
         # Если нет активного токена, пробуем старый способ
         if not current_token:
-            current_token = db_manager.get_setting("yandex_token", "")
+            current_token = settings.get("yandex_token", "")
 
         return {
             "token": current_token,
-            "downloadPath": db_manager.get_setting(
+            "downloadPath": settings.get(
                 "download_path", os.getenv("DOWNLOAD_PATH", "/home/urch/Music/Yandex")
             ),
-            "quality": db_manager.get_setting(
+            "quality": settings.get(
                 "quality", os.getenv("DEFAULT_QUALITY", "lossless")
             ),
-            "autoSync": db_manager.get_setting("auto_sync", "false").lower() == "true",
-            "syncInterval": int(db_manager.get_setting("sync_interval", "24")),
-            "fileTemplate": db_manager.get_setting(
-                "file_template", "{artist} - {title}"
-            ),
-            "folderStructure": db_manager.get_setting(
-                "folder_structure", "{artist}/{album}"
+            "autoSync": settings.get("auto_sync", "false").lower() == "true",
+            "syncInterval": int(settings.get("sync_interval", "24")),
+            "fileTemplate": settings.get("file_template", "{artist} - {title}"),
+            "folderStructure": settings.get("folder_structure", "{artist}/{album}"),
+            "downloadWorkers": int(
+                settings.get("download_workers", str(get_download_workers()))
             ),
-            "downloads_paused": db_manager.get_setting(
-                "downloads_paused", "false"
-            ).lower()
+            "downloads_paused": settings.get("downloads_paused", "false").lower()
             == "true",
         }
     except Exception as e:
@@ -1723,7 +1784,7 @@ async def update_playlist_settings(request: dict):
             "enable_rate_limiting": request.get("enableRateLimiting", True),
         }
 
-        success = db_manager.update_playlist_settings(settings)
+        success = await async_db.update_playlist_settings(settings)
 
         if success:
             return {"status": "success", "message": "Настройки обновлены"}
@@ -1890,7 +1951,7 @@ async def check_folder_exists(path: str):
 async def get_files_stats():
     """Получить статистику файлов из базы данных"""
     try:
-        stats = db_manager.get_file_statistics()
+        stats = await async_db.get_file_statistics()
         return stats
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -1900,7 +1961,7 @@ async def get_files_stats():
 async def refresh_files_stats():
     """Принудительно обновить статистику файлов"""
     try:
-        stats = db_manager.update_file_statistics()
+        stats = await async_db.update_file_statistics()
         return {
             "status": "success",
             "message": "Статистика файлов обновлена",
@@ -1914,7 +1975,7 @@ async def refresh_files_stats():
 async def clear_files_stats():
     """Очистить статистику файлов (удалить кэшированную статистику)"""
     try:
-        success = db_manager.clear_file_statistics()
+        success = await async_db.clear_file_statistics()
         if success:
             return {
                 "status": "success",
@@ -1937,8 +1998,8 @@ async def clear_download_queue():
                 status_code=400, detail="Менеджер очереди не инициализирован"
             )
 
-        result = download_queue_manager.clear_queue(
-            clear_completed=True, clear_pending=True
+        result = await async_db.run(
+            download_queue_manager.clear_queue, clear_completed=True, clear_pending=True
         )
 
         return {
@@ -1954,7 +2015,7 @@ async def clear_download_queue():
 async def get_recent_files(limit: int = 10):
     """Получить список недавно загруженных файлов"""
     try:
-        recent_files = db_manager.get_recent_downloaded_tracks(limit)
+        recent_files = await async_db.get_recent_downloaded_tracks(limit)
         return {"files": recent_files}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -1970,10 +2031,17 @@ async def get_files_list(
     search: str = None,
     limit: int = 100,
     offset: int = 0,
+    cursor: str = None,
 ):
-    """Получить список загруженных файлов с фильтрацией"""
+    """
+    Получить список загруженных файлов с фильтрацией
+
+    Следующая страница запрашивается по next_cursor из ответа. Результаты
+    поиска упорядочены по релевантности и листаются через offset.
+    """
     try:
-        files = db_manager.get_downloaded_tracks(
+        limit = page_size(limit)
+        files = await async_db.get_downloaded_tracks(
             playlist_id=playlist_id,
             quality=quality,
             year=year,
@@ -1982,8 +2050,14 @@ async def get_files_list(
             search=search,
             limit=limit,
             offset=offset,
+            after=cursor,
         )
-        return {"files": files}
+        return {
+            "files": files,
+            "next_cursor": None if search else next_cursor(files, limit, "download_date", "id"),
+        }
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -1993,10 +2067,7 @@ async def clear_file_stats():
     """Очистить статистику файлов"""
     try:
         # Очищаем таблицу загруженных треков
-        with db_manager.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("DELETE FROM downloaded_tracks")
-            conn.commit()
+        await async_db.write(lambda conn: conn.execute("DELETE FROM downloaded_tracks"))
 
         return {"status": "success", "message": "Статистика файлов очищена"}
     except Exception as e:
@@ -2155,177 +2226,202 @@ async def scan_filesystem(request: ScanRequest):
         # Используем метод analyze_directory из DownloadManager
         stats = download_manager.analyze_directory(request.path)
 
-        # Сохраняем найденные файлы в базу данных
-        with db_manager.get_connection() as conn:
-            cursor = conn.cursor()
+        # Сканируем все файлы заново для полной статистики
+        from pathlib import Path
 
-            # Очищаем старые записи
-            cursor.execute("DELETE FROM downloaded_tracks")
+        audio_extensions = {".flac", ".mp3", ".aac", ".m4a", ".ogg"}
+        files_scanned = 0
+        scanned_rows = []
+        write_futures = []
 
-            # Сканируем все файлы заново для полной статистики
-            from pathlib import Path
+        def insert_rows(rows, clear: bool):
+            def operation(conn):
+                if clear:
+                    conn.execute("DELETE FROM downloaded_tracks")
+                # Обложки кладём в хранилище covers, в строке остаётся только хэш
+                conn.executemany(
+                    """
+                    INSERT INTO downloaded_tracks 
+                    (
+                        track_id, title, artist, album, playlist_id,
+                        file_path, file_size, format, quality,
+                        cover_hash, download_date, year, genre, label, duration, version
+                    )
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                """,
+                    [
+                        row[:9] + (db_manager.store_cover(conn, row[9]),) + row[10:]
+                        for row in rows
+                    ],
+                )
 
-            audio_extensions = {".flac", ".mp3", ".aac", ".m4a", ".ogg"}
-            files_scanned = 0
+            return operation
+
+        def flush_rows():
+            # Старые записи удаляет первая пачка; обложки пачки отпускаем сразу
+            nonlocal scanned_rows
+            write_futures.append(
+                db_manager.write_async(
+                    insert_rows(scanned_rows, clear=not write_futures)
+                )
+            )
+            scanned_rows = []
 
-            # Сканируем директорию рекурсивно
-            for file_path in Path(request.path).rglob("*"):
-                if file_path.is_file() and file_path.suffix.lower() in audio_extensions:
+        # Сканируем директорию рекурсивно
+        for file_path in Path(request.path).rglob("*"):
+            if file_path.is_file() and file_path.suffix.lower() in audio_extensions:
+                try:
+                    file_name = file_path.stem
+                    file_size = file_path.stat().st_size / (1024 * 1024)  # в МБ
+
+                    # Пытаемся извлечь информацию о треке из имени файла
+                    # Простая логика: предполагаем формат "Artist - Title"
+                    parts = file_name.split(" - ", 1)
+                    artist = parts[0] if len(parts) > 0 else "Unknown Artist"
+                    title = parts[1] if len(parts) > 1 else file_name
+
+                    # Определяем формат и качество с помощью универсальной функции
+                    from audio_quality_utils import determine_audio_quality
+
+                    quality_info = determine_audio_quality(str(file_path))
+
+                    format_ext = quality_info["format"]
+                    quality = quality_info["quality_string"]
+                    cover_data = None
+                    year = None
+                    genre = None
+                    label = None
+                    duration = None
+                    version = None
+
+                    # Извлекаем метаданные из тегов файла
                     try:
-                        file_name = file_path.stem
-                        file_size = file_path.stat().st_size / (1024 * 1024)  # в МБ
-
-                        # Пытаемся извлечь информацию о треке из имени файла
-                        # Простая логика: предполагаем формат "Artist - Title"
-                        parts = file_name.split(" - ", 1)
-                        artist = parts[0] if len(parts) > 0 else "Unknown Artist"
-                        title = parts[1] if len(parts) > 1 else file_name
-
-                        # Определяем формат и качество с помощью универсальной функции
-                        from audio_quality_utils import determine_audio_quality
-
-                        quality_info = determine_audio_quality(str(file_path))
-
-                        format_ext = quality_info["format"]
-                        quality = quality_info["quality_string"]
-                        cover_data = None
-                        year = None
-                        genre = None
-                        label = None
-                        duration = None
-                        version = None
-
-                        # Извлекаем метаданные из тегов файла
-                        try:
-                            if format_ext.lower() == "mp3":
-                                from mutagen.mp3 import MP3
-
-                                audio = MP3(str(file_path))
-                                if audio.tags:
-                                    # Обложка
-                                    for key in audio.tags.keys():
-                                        if key.startswith("APIC:"):
-                                            cover_data = audio.tags[key].data
-                                            break
-
-                                    # Год
-                                    if "TDRC" in audio.tags:
-                                        year_str = str(audio.tags["TDRC"][0])
-                                        try:
-                                            year = (
-                                                int(year_str[:4]) if year_str else None
-                                            )
-                                        except (ValueError, TypeError):
-                                            pass
-
-                                    # Жанр
-                                    if "TCON" in audio.tags:
-                                        genre = str(audio.tags["TCON"][0])
-
-                                    # Лейбл
-                                    if "TPUB" in audio.tags:
-                                        label = str(audio.tags["TPUB"][0])
-
-                                    # Версия
-                                    if "TIT3" in audio.tags:
-                                        version = str(audio.tags["TIT3"][0])
-
-                                    # Длительность
-                                    if audio.info:
-                                        duration = int(audio.info.length)
-
-                            elif format_ext.lower() == "flac":
-                                from mutagen.flac import FLAC
-
-                                audio = FLAC(str(file_path))
+                        if format_ext.lower() == "mp3":
+                            from mutagen.mp3 import MP3
 
+                            audio = MP3(str(file_path))
+                            if audio.tags:
                                 # Обложка
-                                if audio.pictures:
-                                    cover_data = audio.pictures[0].data
+                                for key in audio.tags.keys():
+                                    if key.startswith("APIC:"):
+                                        cover_data = audio.tags[key].data
+                                        break
 
                                 # Год
-                                if "date" in audio:
-                                    year_str = str(audio["date"][0])
+                                if "TDRC" in audio.tags:
+                                    year_str = str(audio.tags["TDRC"][0])
                                     try:
-                                        year = int(year_str[:4]) if year_str else None
+                                        year = (
+                                            int(year_str[:4]) if year_str else None
+                                        )
                                     except (ValueError, TypeError):
                                         pass
 
                                 # Жанр
-                                if "genre" in audio:
-                                    genre = str(audio["genre"][0])
+                                if "TCON" in audio.tags:
+                                    genre = str(audio.tags["TCON"][0])
 
                                 # Лейбл
-                                if "label" in audio:
-                                    label = str(audio["label"][0])
-                                elif "organization" in audio:
-                                    label = str(audio["organization"][0])
+                                if "TPUB" in audio.tags:
+                                    label = str(audio.tags["TPUB"][0])
 
                                 # Версия
-                                if "version" in audio:
-                                    version = str(audio["version"][0])
+                                if "TIT3" in audio.tags:
+                                    version = str(audio.tags["TIT3"][0])
 
                                 # Длительность
                                 if audio.info:
                                     duration = int(audio.info.length)
-                        except Exception as e:
-                            # Если не удалось получить метаданные, продолжаем без них
-                            print(f"Ошибка извлечения метаданных из {file_path}: {e}")
-                            pass
 
-                        # Извлекаем название плейлиста из пути
-                        playlist_name = "Scanned Files"  # По умолчанию
-                        try:
-                            base_path = str(request.path)
-                            if str(file_path).startswith(base_path):
-                                relative_path = str(file_path)[len(base_path) :].lstrip(
-                                    "/"
-                                )
-                                path_parts = relative_path.split("/")
-                                if len(path_parts) > 0:
-                                    playlist_name = path_parts[0]
-                        except Exception as e:
-                            print(
-                                f"Не удалось извлечь название плейлиста из {file_path}: {e}"
-                            )
+                        elif format_ext.lower() == "flac":
+                            from mutagen.flac import FLAC
+
+                            audio = FLAC(str(file_path))
+
+                            # Обложка
+                            if audio.pictures:
+                                cover_data = audio.pictures[0].data
+
+                            # Год
+                            if "date" in audio:
+                                year_str = str(audio["date"][0])
+                                try:
+                                    year = int(year_str[:4]) if year_str else None
+                                except (ValueError, TypeError):
+                                    pass
+
+                            # Жанр
+                            if "genre" in audio:
+                                genre = str(audio["genre"][0])
+
+                            # Лейбл
+                            if "label" in audio:
+                                label = str(audio["label"][0])
+                            elif "organization" in audio:
+                                label = str(audio["organization"][0])
 
-                        cursor.execute(
-                            """
-                            INSERT INTO downloaded_tracks 
-                            (
-                                track_id, title, artist, album, playlist_id,
-                                file_path, file_size, format, quality,
-                                cover_data, download_date, year, genre, label, duration, version
+                            # Версия
+                            if "version" in audio:
+                                version = str(audio["version"][0])
+
+                            # Длительность
+                            if audio.info:
+                                duration = int(audio.info.length)
+                    except Exception as e:
+                        # Если не удалось получить метаданные, продолжаем без них
+                        print(f"Ошибка извлечения метаданных из {file_path}: {e}")
+                        pass
+
+                    # Извлекаем название плейлиста из пути
+                    playlist_name = "Scanned Files"  # По умолчанию
+                    try:
+                        base_path = str(request.path)
+                        if str(file_path).startswith(base_path):
+                            relative_path = str(file_path)[len(base_path) :].lstrip(
+                                "/"
                             )
-                            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-                        """,
-                            (
-                                f"scanned_{hash(str(file_path))}",  # Генерируем ID на основе пути
-                                title,
-                                artist,
-                                "Scanned Files",
-                                playlist_name,  # Добавляем playlist_id
-                                str(file_path),
-                                round(file_size, 2),
-                                format_ext,
-                                quality,
-                                cover_data,  # Сохраняем данные обложки
-                                datetime.now().isoformat(),
-                                year,
-                                genre,
-                                label,
-                                duration,
-                                version,
-                            ),
+                            path_parts = relative_path.split("/")
+                            if len(path_parts) > 0:
+                                playlist_name = path_parts[0]
+                    except Exception as e:
+                        print(
+                            f"Не удалось извлечь название плейлиста из {file_path}: {e}"
                         )
 
-                        files_scanned += 1
+                    scanned_rows.append(
+                        (
+                            f"scanned_{hash(str(file_path))}",  # Генерируем ID на основе пути
+                            title,
+                            artist,
+                            "Scanned Files",
+                            playlist_name,  # Добавляем playlist_id
+                            str(file_path),
+                            round(file_size, 2),
+                            format_ext,
+                            quality,
+                            cover_data,  # Сохраняем данные обложки
+                            datetime.now().isoformat(),
+                            year,
+                            genre,
+                            label,
+                            duration,
+                            version,
+                        )
+                    )
 
-                    except Exception as e:
-                        print(f"Ошибка обработки файла {file_path}: {e}")
+                    files_scanned += 1
+                    if len(scanned_rows) >= SCAN_WRITE_BATCH:
+                        flush_rows()
 
-            conn.commit()
-            print(f"Сканировано файлов: {files_scanned}")
+                except Exception as e:
+                    print(f"Ошибка обработки файла {file_path}: {e}")
+
+        # Пачки записываются в потоке записи отдельными операциями
+        if scanned_rows or not write_futures:
+            flush_rows()
+        for future in write_futures:
+            await asyncio.wrap_future(future)
+        print(f"Сканировано файлов: {files_scanned}")
 
         return {
             "status": "success",
@@ -2352,7 +2448,7 @@ async def update_download_progress(track_id: str, request: ProgressUpdateRequest
                 status_code=400, detail="Прогресс должен быть от 0 до 100"
             )
 
-        success = db_manager.update_download_progress(track_id, progress)
+        success = await async_db.update_download_progress(track_id, progress)
         if not success:
             raise HTTPException(status_code=404, detail="Трек не найден в очереди")
 
@@ -2364,11 +2460,24 @@ async def update_download_progress(track_id: str, request: ProgressUpdateRequest
 
 
 @app.get("/api/downloads/queue")
-async def get_downloads_queue():
-    """Получить очередь загрузок из базы данных"""
-    try:
-        queue = db_manager.get_download_queue()
-        return {"queue": queue}
+async def get_downloads_queue(limit: int = None, cursor: str = None):
+    """
+    Получить очередь загрузок из базы данных
+
+    Без limit и cursor — вся очередь (новые сверху), как раньше. С limit —
+    страница по возрастанию (created_at, id) и next_cursor следующей страницы.
+    """
+    try:
+        if limit is None and cursor is None:
+            queue = progress_registry.overlay(await async_db.get_download_queue())
+            return {"queue": queue, "next_cursor": None}
+        limit = page_size(limit)
+        queue = progress_registry.overlay(
+            await async_db.get_download_queue(limit=limit, after=cursor)
+        )
+        return {"queue": queue, "next_cursor": next_cursor(queue, limit, "created_at", "id")}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -2377,9 +2486,10 @@ async def get_downloads_queue():
 async def retry_download(track_id: str):
     """Повторить загрузку трека"""
     try:
-        success = db_manager.retry_download(track_id)
+        success = await async_db.retry_download(track_id)
         if not success:
             raise HTTPException(status_code=404, detail="Трек не найден в очереди")
+        queue_events.publish("queue_changed")
         return {"status": "success", "message": "Загрузка поставлена в очередь"}
     except HTTPException:
         raise
@@ -2509,9 +2619,10 @@ async def get_log_stats():
 async def cancel_download(track_id: str):
     """Отменить загрузку трека"""
     try:
-        success = db_manager.cancel_download(track_id)
+        success = await async_db.cancel_download(track_id)
         if not success:
             raise HTTPException(status_code=404, detail="Трек не найден в очереди")
+        queue_events.publish("queue_changed")
         return {"status": "success", "message": "Загрузка отменена"}
     except HTTPException:
         raise
@@ -2530,7 +2641,8 @@ async def remove_selected_tracks(request: RemoveTracksRequest):
         if len(request.track_ids) > 500:
             removed_count = db_manager.bulk_remove_from_queue(request.track_ids)
         else:
-            removed_count = db_manager.remove_from_queue(request.track_ids)
+            removed_count = await async_db.remove_from_queue(request.track_ids)
+        queue_events.publish("queue_changed")
 
         return {
             "status": "success",
@@ -2545,11 +2657,12 @@ async def remove_selected_tracks(request: RemoveTracksRequest):
 async def clear_queued_downloads():
     """Очистить все подготовленные (queued) загрузки"""
     try:
-        with db_manager.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute("DELETE FROM download_queue WHERE status = 'queued'")
-            deleted_count = cursor.rowcount
-            conn.commit()
+        deleted_count = await async_db.write(
+            lambda conn: conn.execute(
+                "DELETE FROM download_queue WHERE status = 'queued'"
+            ).rowcount
+        )
+        queue_events.publish("queue_changed")
 
         return {
             "status": "success",
@@ -2567,9 +2680,8 @@ async def clear_queued_downloads():
 async def change_track_status(request: ChangeStatusRequest):
     """Изменение статуса треков для тестирования"""
     try:
-        with db_manager.get_connection() as conn:
-            cursor = conn.cursor()
-            cursor.execute(
+        updated_count = await async_db.write(
+            lambda conn: conn.execute(
                 """
                 UPDATE download_queue 
                 SET status = ? 
@@ -2577,9 +2689,9 @@ async def change_track_status(request: ChangeStatusRequest):
                 LIMIT ?
             """,
                 (request.to_status, request.from_status, request.count),
-            )
-            updated_count = cursor.rowcount
-            conn.commit()
+            ).rowcount
+        )
+        queue_events.publish("queue_changed")
 
         return {
             "status": "success",
@@ -2595,7 +2707,7 @@ async def pause_downloads(request: PauseRequest):
     """Приостановить/возобновить все загрузки"""
     try:
         # Сохраняем состояние паузы в настройках
-        db_manager.save_setting("downloads_paused", str(request.paused))
+        await async_db.save_setting("downloads_paused", str(request.paused))
 
         if request.paused:
             # Если пауза, останавливаем все активные загрузки
@@ -2632,8 +2744,11 @@ async def queue_add_tracks(request: AddTracksToQueueRequest):
 
     try:
         # Автоматически очищаем предыдущие загрузки при добавлении новых треков
-        result = download_queue_manager.add_tracks(
-            request.tracks, request.quality, clear_previous=True
+        result = await async_db.run(
+            download_queue_manager.add_tracks,
+            request.tracks,
+            request.quality,
+            clear_previous=True,
         )
         return {
             "status": "success",
@@ -2649,8 +2764,13 @@ async def queue_add_tracks(request: AddTracksToQueueRequest):
 
 
 @app.get("/api/queue/list")
-async def queue_list(limit: Optional[int] = None):
-    """Получить список треков в очереди"""
+async def queue_list(limit: Optional[int] = None, cursor: Optional[str] = None):
+    """
+    Получить список треков в очереди
+
+    Без limit и cursor — вся очередь в порядке статусов, как раньше. С limit —
+    страница по возрастанию (created_at, id) и next_cursor следующей страницы.
+    """
     # Обновляем глобальную переменную на случай, если она была обновлена
     global download_queue_manager
     download_queue_manager = get_download_queue_manager()
@@ -2662,8 +2782,14 @@ async def queue_list(limit: Optional[int] = None):
         )
 
     try:
-        queue = download_queue_manager.get_queue(limit)
-        return {"queue": queue}
+        if limit is None and cursor is None:
+            queue = await async_db.run(download_queue_manager.get_queue)
+            return {"queue": queue, "next_cursor": None}
+        limit = page_size(limit)
+        queue = await async_db.run(download_queue_manager.get_queue, limit, cursor)
+        return {"queue": queue, "next_cursor": next_cursor(queue, limit, "created_at", "id")}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Ошибка получения очереди: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Ошибка получения очереди: {str(e)}")
@@ -2683,13 +2809,92 @@ async def queue_stats():
         )
 
     try:
-        stats = download_queue_manager.get_stats()
+        stats = await async_db.run(download_queue_manager.get_stats)
         return stats
     except Exception as e:
         logger.error(f"Ошибка получения статистики: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=f"Ошибка получения статистики: {str(e)}")
 
 
+@app.get("/api/queue/pipeline")
+async def queue_pipeline():
+    """Состояние стадий конвейера загрузки: глубина очередей и загрузка воркеров"""
+    global download_queue_manager
+    download_queue_manager = get_download_queue_manager()
+
+    if not download_queue_manager:
+        logger.error("Менеджер очереди не инициализирован")
+        raise HTTPException(
+            status_code=400, detail="Менеджер очереди не инициализирован. Проверьте настройки и токен."
+        )
+
+    stages = download_queue_manager.get_pipeline_stats()
+    # Узкое место — стадия с наибольшей загрузкой воркеров
+    bottleneck = max(stages, key=lambda stage: stage["utilization"], default=None)
+    return {
+        "is_running": download_queue_manager.is_running,
+        "stages": stages,
+        "bottleneck": bottleneck["name"] if bottleneck else None,
+        "prefetch": download_queue_manager.prefetcher.stats(),
+    }
+
+
+@app.get("/api/queue/events")
+async def queue_events_stream(request: Request):
+    """
+    Поток событий очереди (Server-Sent Events)
+
+    При подключении отправляется снимок (очередь + статистика), далее —
+    изменения: track (смена статуса), progress, stats, queue_changed.
+    Медленный клиент получает resync вместо потерянных событий, и ему
+    отправляется свежий снимок.
+    """
+    global download_queue_manager
+    download_queue_manager = get_download_queue_manager()
+
+    if not download_queue_manager:
+        raise HTTPException(
+            status_code=400, detail="Менеджер очереди не инициализирован. Проверьте настройки и токен."
+        )
+
+    manager = download_queue_manager
+    subscription = queue_events.subscribe()
+
+    def build_snapshot() -> dict:
+        return {"queue": manager.get_queue(), "stats": manager.get_stats()}
+
+    async def event_generator():
+        try:
+            snapshot = await async_db.run(build_snapshot, name="queue_snapshot")
+            yield queue_events.format_sse("snapshot", snapshot)
+
+            while True:
+                if await request.is_disconnected():
+                    break
+                try:
+                    message = await asyncio.wait_for(
+                        subscription.get(), timeout=KEEPALIVE_INTERVAL
+                    )
+                except asyncio.TimeoutError:
+                    # Комментарий keep-alive, чтобы прокси не закрывали соединение
+                    yield ": keep-alive\n\n"
+                    continue
+
+                if message["event"] == "resync":
+                    snapshot = await async_db.run(build_snapshot, name="queue_snapshot")
+                    yield queue_events.format_sse("snapshot", snapshot)
+                else:
+                    yield queue_events.format_sse(message["event"], message["data"])
+        finally:
+            queue_events.unsubscribe(subscription)
+
+    return StreamingResponse(
+        event_generator(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @app.post("/api/queue/start")
 async def queue_start():
     """Запустить обработку очереди"""
@@ -2779,7 +2984,7 @@ async def queue_clear_completed():
         )
 
     try:
-        deleted = download_queue_manager.clear_completed()
+        deleted = await async_db.run(download_queue_manager.clear_completed)
         return {"status": "success", "deleted": deleted}
     except Exception as e:
         logger.error(f"Ошибка очистки: {e}")
@@ -2795,7 +3000,7 @@ async def queue_remove_track(track_id: str):
         )
 
     try:
-        result = download_queue_manager.remove_track(track_id)
+        result = await async_db.run(download_queue_manager.remove_track, track_id)
         if result:
             return {"status": "success", "message": "Трек удалён"}
         else:
@@ -9,6 +9,11 @@ class DownloadRequest(BaseModel):
     quality: str = "lossless"
 
 
+class SyncPlaylistRequest(BaseModel):
+    enqueue: bool = False  # Поставить добавленные треки в очередь ('queued')
+    quality: str = "lossless"
+
+
 class ProgressUpdateRequest(BaseModel):
     progress: int
 
@@ -12,6 +12,7 @@ class Settings(BaseModel):
     syncInterval: int = 24
     fileTemplate: Optional[str] = "{artist} - {title}"
     folderStructure: Optional[str] = "{artist}/{album}"
+    downloadWorkers: Optional[int] = None
 
 
 class CreateFolderRequest(BaseModel):
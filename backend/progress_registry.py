@@ -0,0 +1,102 @@
+"""
+Реестр прогресса загрузок в памяти
+
+Прогресс скачивания обновляется на каждом чанке (64 КБ) из потоков загрузки.
+Вместо UPDATE в SQLite на каждый чанк значения хранятся здесь, API читает их
+напрямую, а в download_queue.progress они сбрасываются редко и при смене статуса.
+"""
+
+import threading
+import time
+from typing import Dict, List, Optional
+
+# Как часто сбрасывать прогресс активной загрузки в БД (секунды)
+PROGRESS_FLUSH_INTERVAL = 5.0
+
+
+class ProgressRegistry:
+    """Потокобезопасный реестр прогресса активных загрузок"""
+
+    def __init__(self, flush_interval: float = PROGRESS_FLUSH_INTERVAL):
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Dict] = {}
+
+    def start(self, track_id: str, **info) -> None:
+        """Зарегистрировать начало загрузки трека"""
+        now = time.time()
+        with self._lock:
+            self._entries[track_id] = {
+                "track_id": track_id,
+                "status": "downloading",
+                "progress": 0,
+                "downloaded": 0,
+                "total": 0,
+                "started_at": now,
+                "updated_at": now,
+                "flushed_at": now,
+                "flushed_progress": 0,
+                **info,
+            }
+
+    def update(self, track_id: str, downloaded: int, total: int) -> Optional[int]:
+        """
+        Обновить прогресс трека
+
+        Returns:
+            Прогресс в процентах, который пора записать в БД, иначе None
+        """
+        progress = int((downloaded / total) * 100) if total > 0 else 0
+        now = time.time()
+
+        with self._lock:
+            entry = self._entries.get(track_id)
+            if entry is None:
+                return None
+
+            entry["downloaded"] = downloaded
+            entry["total"] = total
+            entry["progress"] = progress
+            entry["updated_at"] = now
+
+            if (
+                progress != entry["flushed_progress"]
+                and now - entry["flushed_at"] >= self.flush_interval
+            ):
+                entry["flushed_at"] = now
+                entry["flushed_progress"] = progress
+                return progress
+
+        return None
+
+    def finish(self, track_id: str) -> Optional[Dict]:
+        """Убрать трек из реестра (статус уже записан в БД)"""
+        with self._lock:
+            return self._entries.pop(track_id, None)
+
+    def get(self, track_id: str) -> Optional[Dict]:
+        """Получить копию записи о прогрессе трека"""
+        with self._lock:
+            entry = self._entries.get(track_id)
+            return dict(entry) if entry else None
+
+    def snapshot(self) -> Dict[str, Dict]:
+        """Получить копию всех активных записей"""
+        with self._lock:
+            return {track_id: dict(entry) for track_id, entry in self._entries.items()}
+
+    def overlay(self, rows: List[Dict]) -> List[Dict]:
+        """Подставить актуальный прогресс из памяти в строки очереди из БД"""
+        active = self.snapshot()
+        if not active:
+            return rows
+
+        for row in rows:
+            entry = active.get(row.get("track_id"))
+            if entry and row.get("status") == "downloading":
+                row["progress"] = entry["progress"]
+        return rows
+
+
+# Глобальный экземпляр реестра
+progress_registry = ProgressRegistry()
@@ -0,0 +1,95 @@
+"""
+Шина событий очереди загрузок для server-push (SSE)
+
+Воркеры и эндпоинты публикуют события (трек захвачен, прогресс, завершён,
+ошибка, счётчики очереди), а подключённые клиенты получают их через
+/api/queue/events вместо опроса БД каждые несколько секунд.
+"""
+
+import asyncio
+import json
+import logging
+import threading
+from typing import Dict, Optional, Set
+
+logger = logging.getLogger("download_queue")
+
+# Размер буфера событий одного клиента. Если клиент не успевает читать,
+# его буфер сбрасывается и он получает событие resync (повторный снимок)
+SUBSCRIBER_QUEUE_SIZE = 200
+
+# Интервал keep-alive комментариев в потоке SSE (секунды)
+KEEPALIVE_INTERVAL = 15.0
+
+
+class QueueEventBus:
+    """Рассылка событий очереди подписчикам с ограниченными буферами"""
+
+    def __init__(self, queue_size: int = SUBSCRIBER_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._subscribers: Set[asyncio.Queue] = set()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._lock = threading.Lock()
+
+    @property
+    def has_subscribers(self) -> bool:
+        """Есть ли подключённые клиенты (без них события не готовим)"""
+        return bool(self._subscribers)
+
+    def subscribe(self) -> asyncio.Queue:
+        """Подписаться на события (вызывается из цикла событий)"""
+        queue: asyncio.Queue = asyncio.Queue(maxsize=self.queue_size)
+        with self._lock:
+            self._loop = asyncio.get_running_loop()
+            self._subscribers.add(queue)
+        logger.info(f"📡 Клиент подписан на события очереди ({len(self._subscribers)})")
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue) -> None:
+        """Отписаться от событий"""
+        with self._lock:
+            self._subscribers.discard(queue)
+        logger.info(f"📡 Клиент отписан от событий очереди ({len(self._subscribers)})")
+
+    def publish(self, event: str, data: Optional[Dict] = None) -> None:
+        """
+        Опубликовать событие всем подписчикам
+
+        Можно вызывать как из цикла событий, так и из потоков загрузки —
+        доставка всегда выполняется в потоке цикла событий.
+        """
+        if not self._subscribers or self._loop is None:
+            return
+
+        message = {"event": event, "data": data or {}}
+
+        try:
+            running_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            running_loop = None
+
+        if running_loop is self._loop:
+            self._deliver(message)
+        elif not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._deliver, message)
+
+    def _deliver(self, message: Dict) -> None:
+        """Разложить событие по буферам подписчиков (в потоке цикла событий)"""
+        for queue in list(self._subscribers):
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                # Медленный клиент: выбрасываем накопленное и просим пересинхронизироваться
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait({"event": "resync", "data": {}})
+
+    @staticmethod
+    def format_sse(event: str, data: Dict) -> str:
+        """Сформировать сообщение в формате text/event-stream"""
+        payload = json.dumps(data, ensure_ascii=False, default=str)
+        return f"event: {event}\ndata: {payload}\n\n"
+
+
+# Глобальный экземпляр шины событий
+queue_events = QueueEventBus()
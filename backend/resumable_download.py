@@ -0,0 +1,383 @@
+"""
+Докачиваемая загрузка файлов по HTTP Range
+
+Данные пишутся в файл <путь>.part, рядом лежит <путь>.part.json со смещением,
+размером и валидаторами (ETag / Last-Modified). После обрыва соединения или
+перезапуска бэкенда загрузка продолжается с уже скачанных байтов: запрос идёт
+с заголовками Range и If-Range, и если файл на сервере изменился, сервер
+отдаёт его целиком, а загрузка начинается заново.
+
+Чанки можно преобразовывать перед записью (например, расшифровывать AES-CTR
+на лету) — преобразование должно сохранять длину, чтобы смещения в .part
+совпадали со смещениями на сервере.
+"""
+
+import json
+import logging
+import os
+import re
+import time
+from typing import Callable, Dict, Optional
+
+import requests
+
+from utils.http_client import http_client
+from utils.rate_limiter import parse_retry_after
+
+download_logger = logging.getLogger("download")
+
+# Размер чанка чтения из сокета
+CHUNK_SIZE = 65536
+
+# Как часто (в байтах) сохранять смещение в .part.json
+STATE_SAVE_INTERVAL = 4 * 1024 * 1024
+
+# Статусы, при которых подписанная ссылка устарела и её нужно получить заново
+EXPIRED_LINK_STATUSES = (401, 403, 410)
+
+# Временные ошибки сервера/CDN: повторяем с паузой, частичный файл сохраняем
+RETRYABLE_STATUSES = (408, 429, 500, 502, 503, 504)
+
+# Дольше этого (секунды) не ждём, даже если сервер просит в Retry-After
+MAX_RETRY_AFTER = 120.0
+
+RETRYABLE_ERRORS = (
+    requests.exceptions.ChunkedEncodingError,
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+    OSError,
+)
+
+
+class DownloadStopped(Exception):
+    """Скачивание прервано остановкой очереди (бросается из progress_callback)"""
+
+
+class IncompleteDownloadError(IOError):
+    """Соединение закрылось раньше, чем пришёл весь файл"""
+
+
+class ResumableDownloader:
+    """Загрузчик с докачкой через Range и сохранением смещения на диск"""
+
+    def __init__(
+        self,
+        session=None,
+        chunk_size: int = CHUNK_SIZE,
+        max_retries: int = 5,
+        retry_delay: float = 2.0,
+        timeout=(30, 300),
+    ):
+        self.session = session or http_client.session
+        self.chunk_size = chunk_size
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.timeout = timeout
+
+    @staticmethod
+    def part_path(dest_path: str) -> str:
+        """Путь к частично скачанному файлу"""
+        return dest_path + ".part"
+
+    @staticmethod
+    def state_path(dest_path: str) -> str:
+        """Путь к файлу состояния докачки"""
+        return dest_path + ".part.json"
+
+    def get_partial_offset(self, dest_path: str) -> int:
+        """Сколько байт уже скачано для файла (0, если докачивать нечего)"""
+        state = self._load_state(dest_path)
+        part_path = self.part_path(dest_path)
+        if state is None or not os.path.exists(part_path):
+            return 0
+        return os.path.getsize(part_path)
+
+    def discard(self, dest_path: str):
+        """Удалить частично скачанный файл и его состояние"""
+        for path in (self.part_path(dest_path), self.state_path(dest_path)):
+            if os.path.exists(path):
+                try:
+                    os.remove(path)
+                except OSError as e:
+                    download_logger.warning(f"⚠️  Не удалось удалить {path}: {e}")
+
+    def download(
+        self,
+        url: str,
+        dest_path: str,
+        progress_callback: Optional[Callable] = None,
+        refresh_url: Optional[Callable[[], str]] = None,
+        callback_interval: float = 0.0,
+        chunk_transform_factory: Optional[
+            Callable[[int], Callable[[bytes], bytes]]
+        ] = None,
+    ) -> int:
+        """
+        Скачать файл с докачкой
+
+        Args:
+            url: Прямая ссылка на файл
+            dest_path: Итоговый путь (до завершения данные лежат в dest_path.part)
+            progress_callback: Функция (bytes_downloaded, total_bytes)
+            refresh_url: Функция получения новой ссылки, если старая истекла
+            callback_interval: Минимальный интервал между вызовами progress_callback
+            chunk_transform_factory: Функция (offset) → преобразователь чанков,
+                начинающий с указанного смещения (вызывается на каждую попытку)
+
+        Returns:
+            Размер скачанного файла в байтах
+        """
+        part_path = self.part_path(dest_path)
+        state = self._load_state(dest_path)
+
+        if state is not None and os.path.exists(part_path):
+            offset = os.path.getsize(part_path)
+            download_logger.info(
+                f"⏯️  Найдена частичная загрузка: {offset / (1024 * 1024):.2f} МБ, продолжаем"
+            )
+        else:
+            # Без состояния нельзя проверить, что .part от того же файла
+            self.discard(dest_path)
+            state = None
+            offset = 0
+
+        last_error: Optional[Exception] = None
+        # Пауза, которую попросил сервер (Retry-After) для следующей попытки
+        retry_after: Optional[float] = None
+        # Ссылка только что обновлена — повторяем сразу, без паузы
+        refreshed = False
+
+        for attempt in range(self.max_retries):
+            if attempt > 0 and not refreshed:
+                delay = self.retry_delay * (2 ** (attempt - 1))
+                if retry_after is not None:
+                    delay = max(delay, min(retry_after, MAX_RETRY_AFTER))
+                    retry_after = None
+                download_logger.warning(
+                    f"🔁 Попытка {attempt + 1}/{self.max_retries} через {delay}с "
+                    f"с позиции {offset / (1024 * 1024):.2f} МБ"
+                )
+                time.sleep(delay)
+            refreshed = False
+
+            headers = {}
+            if offset > 0:
+                headers["Range"] = f"bytes={offset}-"
+                validator = self._if_range_validator(state)
+                if validator:
+                    headers["If-Range"] = validator
+
+            try:
+                response = self.session.get(
+                    url, headers=headers, stream=True, timeout=self.timeout
+                )
+            except RETRYABLE_ERRORS as e:
+                last_error = e
+                download_logger.warning(f"⚠️  Ошибка соединения: {e}")
+                continue
+
+            try:
+                if response.status_code in EXPIRED_LINK_STATUSES and refresh_url:
+                    download_logger.info(
+                        f"🔗 Ссылка устарела (HTTP {response.status_code}), получаем новую"
+                    )
+                    url = refresh_url()
+                    refreshed = True
+                    last_error = IOError(f"HTTP {response.status_code}")
+                    continue
+
+                if response.status_code == 416 and state and offset > 0:
+                    # Range за пределами файла: либо всё уже скачано, либо файл другой
+                    if state.get("total") and offset == state["total"]:
+                        break
+                    download_logger.warning("⚠️  Сервер отклонил Range, начинаем заново")
+                    self.discard(dest_path)
+                    state, offset = None, 0
+                    last_error = IOError("HTTP 416")
+                    continue
+
+                if response.status_code == 206 and offset > 0:
+                    start, total = self._parse_content_range(
+                        response.headers.get("Content-Range", "")
+                    )
+                    if start != offset or (
+                        state.get("total") and total and total != state["total"]
+                    ):
+                        download_logger.warning(
+                            "⚠️  Content-Range не совпадает с частичным файлом, начинаем заново"
+                        )
+                        self.discard(dest_path)
+                        state, offset = None, 0
+                        last_error = IOError("Content-Range mismatch")
+                        continue
+                    total = total or state.get("total", 0)
+                    mode = "ab"
+                elif response.status_code == 200:
+                    if offset > 0:
+                        download_logger.info(
+                            "🔄 Файл на сервере изменился или Range не поддерживается, качаем заново"
+                        )
+                    offset = 0
+                    total = int(response.headers.get("Content-Length", 0) or 0)
+                    mode = "wb"
+                elif response.status_code in RETRYABLE_STATUSES:
+                    retry_after = parse_retry_after(response)
+                    download_logger.warning(
+                        f"⚠️  Сервер временно недоступен: HTTP {response.status_code}"
+                        + (f", Retry-After {retry_after:.0f}с" if retry_after else "")
+                    )
+                    last_error = IOError(f"HTTP {response.status_code}")
+                    continue
+                else:
+                    response.raise_for_status()
+                    raise requests.exceptions.HTTPError(
+                        f"Неожиданный ответ сервера: HTTP {response.status_code}",
+                        response=response,
+                    )
+
+                state = {
+                    "total": total,
+                    "etag": response.headers.get("ETag")
+                    or (state or {}).get("etag"),
+                    "last_modified": response.headers.get("Last-Modified")
+                    or (state or {}).get("last_modified"),
+                    "offset": offset,
+                }
+                self._save_state(dest_path, state)
+
+                transform = (
+                    chunk_transform_factory(offset) if chunk_transform_factory else None
+                )
+                offset = self._write_body(
+                    response,
+                    part_path,
+                    mode,
+                    offset,
+                    total,
+                    dest_path,
+                    state,
+                    progress_callback,
+                    callback_interval,
+                    transform,
+                )
+
+                if total and offset != total:
+                    raise IncompleteDownloadError(
+                        f"Получено {offset} из {total} байт"
+                    )
+                break
+
+            except requests.exceptions.HTTPError:
+                # Ошибка клиента (403, 404 и т.п.) повтором не лечится, .part оставляем
+                raise
+            except RETRYABLE_ERRORS as e:
+                last_error = e
+                offset = (
+                    os.path.getsize(part_path) if os.path.exists(part_path) else 0
+                )
+                if state is not None:
+                    state["offset"] = offset
+                    self._save_state(dest_path, state)
+                download_logger.warning(f"⚠️  Загрузка прервана: {e}")
+            finally:
+                response.close()
+        else:
+            raise IOError(
+                f"Не удалось скачать файл после {self.max_retries} попыток: {last_error}"
+            )
+
+        os.replace(part_path, dest_path)
+        self._remove_state(dest_path)
+
+        if progress_callback:
+            progress_callback(offset, state.get("total") or offset)
+
+        return offset
+
+    def _write_body(
+        self,
+        response,
+        part_path: str,
+        mode: str,
+        offset: int,
+        total: int,
+        dest_path: str,
+        state: Dict,
+        progress_callback: Optional[Callable],
+        callback_interval: float,
+        transform: Optional[Callable[[bytes], bytes]] = None,
+    ) -> int:
+        """Дописать тело ответа в .part, периодически сохраняя смещение"""
+        last_saved = offset
+        last_callback_time = 0.0
+
+        with open(part_path, mode) as f:
+            for chunk in response.iter_content(chunk_size=self.chunk_size):
+                if not chunk:
+                    continue
+
+                if transform:
+                    chunk = transform(chunk)
+                f.write(chunk)
+                offset += len(chunk)
+
+                if offset - last_saved >= STATE_SAVE_INTERVAL:
+                    f.flush()
+                    state["offset"] = offset
+                    self._save_state(dest_path, state)
+                    last_saved = offset
+
+                if progress_callback and total > 0:
+                    now = time.time()
+                    if now - last_callback_time >= callback_interval:
+                        progress_callback(offset, total)
+                        last_callback_time = now
+
+        return offset
+
+    @staticmethod
+    def _if_range_validator(state: Optional[Dict]) -> Optional[str]:
+        """Валидатор для If-Range: сильный ETag, иначе Last-Modified"""
+        if not state:
+            return None
+        etag = state.get("etag")
+        if etag and not etag.startswith("W/"):
+            return etag
+        return state.get("last_modified")
+
+    @staticmethod
+    def _parse_content_range(value: str):
+        """Разобрать 'bytes start-end/total' → (start, total)"""
+        match = re.match(r"bytes\s+(\d+)-\d+/(\d+|\*)", value or "")
+        if not match:
+            return None, 0
+        total = int(match.group(2)) if match.group(2) != "*" else 0
+        return int(match.group(1)), total
+
+    def _load_state(self, dest_path: str) -> Optional[Dict]:
+        """Прочитать состояние докачки"""
+        try:
+            with open(self.state_path(dest_path), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _save_state(self, dest_path: str, state: Dict):
+        """Сохранить состояние докачки (атомарно через временный файл)"""
+        path = self.state_path(dest_path)
+        tmp_path = path + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(dict(state, updated_at=time.time()), f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            download_logger.warning(f"⚠️  Не удалось сохранить состояние докачки: {e}")
+
+    def _remove_state(self, dest_path: str):
+        """Удалить состояние докачки после завершения"""
+        path = self.state_path(dest_path)
+        if os.path.exists(path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
@@ -1,9 +1,10 @@
 """Роуты для аутентификации"""
 
 from fastapi import APIRouter, HTTPException
+from starlette.concurrency import run_in_threadpool
 
+from async_db import async_db
 from config.database import update_yandex_client
-from db_manager import db_manager
 from models.token import DualTokenTest, TokenTest
 from services.subscription_service import check_subscription_status
 from yandex_client import YandexMusicClient
@@ -17,7 +18,7 @@ async def test_token(request: TokenTest):
     try:
         # Создаем временный клиент для проверки
         test_client = YandexMusicClient(request.token)
-        success = test_client.connect()
+        success = await run_in_threadpool(test_client.connect)
 
         if success:
             # Определяем тип токена
@@ -26,16 +27,16 @@ async def test_token(request: TokenTest):
             # Сохраняем токен в базу данных
             try:
                 # Сохраняем в новую таблицу токенов
-                db_manager.save_token(
+                await async_db.save_token(
                     "Основной токен", request.token, token_type, is_active=True
                 )
                 # Также сохраняем в старую таблицу для совместимости
-                db_manager.save_setting("yandex_token", request.token)
+                await async_db.save_setting("yandex_token", request.token)
             except Exception as db_error:
                 print(f"Ошибка сохранения токена в БД: {db_error}")
 
             # Обновляем глобальный клиент
-            update_yandex_client(request.token)
+            await run_in_threadpool(update_yandex_client, request.token)
             return {"status": "success", "message": "Подключение успешно"}
         else:
             print(f"Токен не прошел проверку: {request.token[:20]}...")
@@ -54,23 +55,23 @@ async def test_dual_tokens(request: DualTokenTest):
     try:
         # Проверяем OAuth токен
         oauth_client = YandexMusicClient(request.oauth_token)
-        oauth_success = oauth_client.connect()
+        oauth_success = await run_in_threadpool(oauth_client.connect)
 
         # Проверяем Session ID токен
         session_client = YandexMusicClient(request.session_id_token)
-        session_success = session_client.connect()
+        session_success = await run_in_threadpool(session_client.connect)
 
         if oauth_success and session_success:
             # Оба токена работают - проверяем подписку через OAuth (приоритет)
             has_subscription, has_lossless_access, subscription_dict = (
-                check_subscription_status(oauth_client)
+                await run_in_threadpool(check_subscription_status, oauth_client)
             )
 
             # Если через OAuth не получилось, пробуем через Session ID
             if not has_subscription:
                 print("Пробуем проверить подписку через Session ID клиент...")
                 has_subscription, has_lossless_access, subscription_dict = (
-                    check_subscription_status(session_client)
+                    await run_in_threadpool(check_subscription_status, session_client)
                 )
 
             return {
@@ -85,7 +86,7 @@ async def test_dual_tokens(request: DualTokenTest):
         elif oauth_success:
             # Только OAuth работает - проверяем подписку через OAuth
             has_subscription, has_lossless_access, subscription_dict = (
-                check_subscription_status(oauth_client)
+                await run_in_threadpool(check_subscription_status, oauth_client)
             )
 
             return {
@@ -101,7 +102,7 @@ async def test_dual_tokens(request: DualTokenTest):
             # Только Session ID работает - проверяем подписку через Session ID
             print("OAuth не работает, проверяем подписку через Session ID...")
             has_subscription, has_lossless_access, subscription_dict = (
-                check_subscription_status(session_client)
+                await run_in_threadpool(check_subscription_status, session_client)
             )
 
             return {
@@ -3,10 +3,12 @@
 """
 
 import requests
-import time
 from typing import Optional, Dict, List
 import logging
 
+from utils.http_client import http_client
+from utils.rate_limiter import RateLimiter
+
 logger = logging.getLogger("original_finder")
 
 
@@ -16,16 +18,12 @@ class OriginalTrackFinder:
     def __init__(self):
         self.musicbrainz_base_url = "https://musicbrainz.org/ws/2"
         self.user_agent = "YandexMusicDownloader/1.0 (https://github.com/your-repo)"
-        self.last_request_time = 0
-        self.min_request_interval = 1.0  # Минимум 1 секунда между запросами (лимит MusicBrainz)
+        # Не больше 1 запроса в секунду (лимит MusicBrainz), отдельно от лимитов Яндекса
+        self.limiter = RateLimiter(rate=1.0, burst=1)
 
     def _rate_limit(self):
         """Соблюдение лимита запросов к MusicBrainz"""
-        current_time = time.time()
-        time_since_last = current_time - self.last_request_time
-        if time_since_last < self.min_request_interval:
-            time.sleep(self.min_request_interval - time_since_last)
-        self.last_request_time = time.time()
+        self.limiter.acquire()
 
     def search_musicbrainz(
         self, artist: str, title: str, album: str = None, year: int = None
@@ -77,7 +75,7 @@ class OriginalTrackFinder:
 
             logger.info(f"🔍 Поиск в MusicBrainz: {artist} - {title}")
 
-            response = requests.get(
+            response = http_client.get(
                 f"{self.musicbrainz_base_url}/recording",
                 params=params,
                 headers=headers,
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Проверка встроенного демуксера FLAC против ffmpeg
+
+Для каждого переданного MP4 (расшифрованный flac-mp4 из Яндекс.Музыки)
+извлекает FLAC встроенным демуксером и через `ffmpeg -c:a copy`, затем
+сравнивает аудиофреймы побайтово. Метаданные не сравниваются: ffmpeg
+добавляет свои VORBIS_COMMENT/PADDING, а STREAMINFO сверяется отдельно.
+
+Запуск: python test_flac_demuxer.py track1.mp4 [track2.mp4 ...]
+"""
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from flac_demuxer import demux_file, iter_flac_frames
+
+
+def streaminfo(metadata: bytes) -> bytes:
+    """STREAMINFO без учёта флага последнего блока"""
+    return metadata[5:8 + 34]
+
+
+def check_fixture(mp4_path: str, tmp: str) -> bool:
+    """Сравнить результат встроенного демуксера и ffmpeg для одного файла"""
+    name = os.path.splitext(os.path.basename(mp4_path))[0]
+    native_out = os.path.join(tmp, f"{name}.native.flac")
+    ffmpeg_out = os.path.join(tmp, f"{name}.ffmpeg.flac")
+
+    start = time.perf_counter()
+    stats = demux_file(mp4_path, native_out)
+    native_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    result = subprocess.run(
+        ['ffmpeg', '-i', mp4_path, '-c:a', 'copy', ffmpeg_out, '-y', '-loglevel', 'error'],
+        capture_output=True,
+        text=True
+    )
+    ffmpeg_time = time.perf_counter() - start
+
+    if result.returncode != 0:
+        print(f"❌ {name}: ffmpeg вернул ошибку: {result.stderr}")
+        return False
+
+    native_meta, native_frames = iter_flac_frames(native_out)
+    ffmpeg_meta, ffmpeg_frames = iter_flac_frames(ffmpeg_out)
+
+    frames_equal = native_frames == ffmpeg_frames
+    streaminfo_equal = streaminfo(native_meta) == streaminfo(ffmpeg_meta)
+
+    print(f"📦 {name}: {stats['frames']} фреймов, {stats['bytes'] / (1024 * 1024):.2f} МБ")
+    print(f"   • Встроенный демуксер: {native_time:.3f} с")
+    print(f"   • ffmpeg:              {ffmpeg_time:.3f} с")
+    print(f"   • Аудиофреймы:  {'✅ побайтово идентичны' if frames_equal else '❌ РАЗЛИЧАЮТСЯ'}")
+    print(f"   • STREAMINFO:   {'✅ совпадает' if streaminfo_equal else '⚠️  отличается'}\n")
+
+    return frames_equal
+
+
+def main():
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+
+    if shutil.which('ffmpeg') is None:
+        print("⏭️  ffmpeg не найден — сравнивать не с чем. Установите: sudo apt install ffmpeg")
+        sys.exit(0)
+
+    print(f"\n{'='*80}")
+    print("🎵 Встроенный демуксер FLAC против ffmpeg")
+    print(f"{'='*80}\n")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        results = [check_fixture(path, tmp) for path in sys.argv[1:]]
+
+    passed = sum(results)
+    print(f"Итого: {passed}/{len(results)} файлов совпадают")
+    sys.exit(0 if passed == len(results) else 1)
+
+
+if __name__ == "__main__":
+    main()
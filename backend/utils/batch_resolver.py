@@ -0,0 +1,129 @@
+"""
+Параллельное получение данных батчами
+
+Большой список ID (например, треков плейлиста) делится на батчи, и
+одновременно выполняется не больше concurrency запросов. Каждый запрос
+проходит через ограничитель частоты (свой limiter или транспорт API), поэтому
+время получения упирается в допустимую частоту API, а не в сумму задержек
+запросов.
+Результаты собираются в исходном порядке ID.
+
+Получение можно отменить событием cancel (например, когда HTTP-клиент
+отключился): невыполненные батчи снимаются, ожидающие потоки
+освобождаются, resolve() выбрасывает ResolveCancelled.
+"""
+
+import logging
+import threading
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable, List, Optional, Sequence
+
+from utils.rate_limiter import RateLimiter, RequestCancelled, cancel_scope
+
+logger = logging.getLogger("batch_resolver")
+
+# Как часто проверять отмену, пока батчи выполняются (секунды)
+CANCEL_POLL_INTERVAL = 0.2
+
+
+class ResolveCancelled(Exception):
+    """Получение данных отменено"""
+
+
+class BatchResolver:
+    """Получение батчами с ограничением параллельности и частоты"""
+
+    def __init__(
+        self,
+        fetch: Callable[[List], List],
+        batch_size: int = 100,
+        concurrency: int = 4,
+        limiter: Optional[RateLimiter] = None,
+    ):
+        """
+        Args:
+            fetch: Функция, получающая данные для батча ID (например, client.tracks)
+            batch_size: Размер батча
+            concurrency: Сколько батчей выполнять одновременно
+            limiter: Ограничитель частоты запросов
+        """
+        self.fetch = fetch
+        self.batch_size = max(batch_size, 1)
+        self.concurrency = max(concurrency, 1)
+        self.limiter = limiter
+
+    def resolve(
+        self,
+        ids: Sequence,
+        cancel: Optional[threading.Event] = None,
+        skip_failed: bool = False,
+    ) -> List:
+        """
+        Получить данные для всех ID
+
+        Args:
+            ids: ID в нужном порядке
+            cancel: Событие отмены
+            skip_failed: Пропускать батчи с ошибкой вместо исключения
+
+        Returns:
+            Результаты всех батчей подряд, в порядке батчей
+
+        Raises:
+            ResolveCancelled: Установлено событие отмены
+        """
+        batches = [
+            list(ids[i : i + self.batch_size])
+            for i in range(0, len(ids), self.batch_size)
+        ]
+        if not batches:
+            return []
+
+        cancel = cancel or threading.Event()
+        executor = ThreadPoolExecutor(
+            max_workers=min(self.concurrency, len(batches)),
+            thread_name_prefix="batch-resolve",
+        )
+        futures: List[Future] = [
+            executor.submit(self._fetch_batch, batch, cancel) for batch in batches
+        ]
+        try:
+            pending = set(futures)
+            while pending:
+                done, pending = wait(
+                    pending, timeout=CANCEL_POLL_INTERVAL, return_when=FIRST_COMPLETED
+                )
+                if cancel.is_set():
+                    raise ResolveCancelled()
+                if not skip_failed:
+                    for future in done:
+                        error = future.exception()
+                        if error is not None:
+                            raise error
+
+            result = []
+            for index, future in enumerate(futures):
+                error = future.exception()
+                if error is not None:
+                    logger.error(
+                        f"❌ Ошибка батча {index + 1}/{len(batches)} "
+                        f"({len(batches[index])} ID): {error}"
+                    )
+                    continue
+                result.extend(future.result())
+            return result
+        finally:
+            # Отмена или ошибка: невыполненные батчи не запускаем
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _fetch_batch(self, batch: List, cancel: threading.Event) -> List:
+        if cancel.is_set():
+            raise ResolveCancelled()
+        if self.limiter is not None and not self.limiter.acquire(cancel):
+            raise ResolveCancelled()
+        try:
+            # Ограничители внутри fetch (транспорт API) тоже прерываются отменой
+            with cancel_scope(cancel):
+                return self.fetch(batch) or []
+        except RequestCancelled:
+            raise ResolveCancelled()
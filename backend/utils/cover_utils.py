@@ -1,13 +1,12 @@
 """Утилиты для работы с обложками треков"""
 
 import os
-import sqlite3
 from typing import Optional
 
-import requests
 from fastapi import HTTPException
 from fastapi.responses import Response
 
+from cover_fetcher import cover_fetcher
 from db_manager import db_manager
 from logger_config import get_logger
 
@@ -15,25 +14,9 @@ logger = get_logger(__name__)
 
 
 def get_track_cover_from_db(track_id: str) -> Optional[bytes]:
-    """Получить обложку трека из базы данных downloaded_tracks"""
+    """Получить обложку трека из хранилища обложек БД"""
     try:
-        with db_manager.get_connection() as conn:
-            cursor = conn.cursor()
-
-            cursor.execute(
-                """
-                SELECT cover_data FROM downloaded_tracks 
-                WHERE track_id = ? AND cover_data IS NOT NULL
-                LIMIT 1
-            """,
-                (track_id,),
-            )
-
-            row = cursor.fetchone()
-
-            if row and row[0]:
-                return row[0]
-            return None
+        return db_manager.get_track_cover(track_id)
     except Exception as e:
         logger.error(f"Ошибка получения обложки из БД для трека {track_id}: {e}")
         return None
@@ -62,15 +45,8 @@ def get_queue_track_cover_url(track_id: str) -> Optional[str]:
 
 
 def download_cover_from_url(url: str, timeout: int = 10) -> Optional[bytes]:
-    """Скачать обложку по URL"""
-    try:
-        response = requests.get(url, timeout=timeout)
-        if response.status_code == 200:
-            return response.content
-        return None
-    except Exception as e:
-        logger.warning(f"Ошибка скачивания обложки по URL {url}: {e}")
-        return None
+    """Скачать обложку по URL (через дисковый кэш обложек)"""
+    return cover_fetcher.get(url, timeout=timeout)
 
 
 def get_cover_placeholder() -> bytes:
@@ -126,13 +102,8 @@ def get_file_track_cover_response(track_id: str) -> Response:
         if cover_data:
             # Сохраняем обложку в базу данных загруженных файлов
             try:
-                with db_manager.get_connection() as conn:
-                    cursor = conn.cursor()
-                    cursor.execute(
-                        "UPDATE downloaded_tracks SET cover_data = ? WHERE track_id = ?",
-                        (cover_data, track_id),
-                    )
-                    conn.commit()
+                # Обложка не нужна сразу — запись без ожидания коммита
+                db_manager.set_track_cover(track_id, cover_data)
             except Exception as e:
                 logger.warning(f"Не удалось сохранить обложку в БД для трека {track_id}: {e}")
 
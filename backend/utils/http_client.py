@@ -0,0 +1,177 @@
+"""
+Общий HTTP-клиент с пулом keep-alive соединений
+
+Все исходящие запросы (обложки, MusicBrainz, XML со ссылками, скачивание
+файлов) идут через сессии с общим пулом соединений на каждый хост, поэтому
+TCP+TLS рукопожатие выполняется один раз, а не на каждый запрос. Размеры
+пула и таймауты задаются переменными окружения (см. config/settings.py).
+
+Для каждого хоста считается число запросов и число открытых соединений:
+разница — запросы, обслуженные повторно использованным соединением.
+"""
+
+import logging
+import threading
+from typing import Dict, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from config.settings import get_http_settings
+
+logger = logging.getLogger("http_client")
+
+
+class ConnectionMetrics:
+    """Счётчики запросов и новых соединений по хостам"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hosts: Dict[str, Dict[str, int]] = {}
+
+    def _host(self, host: str) -> Dict[str, int]:
+        return self._hosts.setdefault(host, {"requests": 0, "connections": 0})
+
+    def record_request(self, host: str) -> None:
+        with self._lock:
+            self._host(host)["requests"] += 1
+
+    def record_connection(self, host: str) -> None:
+        with self._lock:
+            self._host(host)["connections"] += 1
+
+    def snapshot(self) -> Dict[str, Dict]:
+        """Метрики по хостам с долей повторно использованных соединений"""
+        with self._lock:
+            result = {}
+            for host, counters in self._hosts.items():
+                requests_count = counters["requests"]
+                reused = max(requests_count - counters["connections"], 0)
+                result[host] = {
+                    "requests": requests_count,
+                    "new_connections": counters["connections"],
+                    "reused": reused,
+                    "reuse_rate": round(reused / requests_count, 3)
+                    if requests_count
+                    else 0.0,
+                }
+            return result
+
+    def reset(self) -> None:
+        with self._lock:
+            self._hosts.clear()
+
+
+# Глобальные метрики соединений (пулы urllib3 создаются без ссылки на клиента)
+connection_metrics = ConnectionMetrics()
+
+
+class MeteredHTTPConnectionPool(HTTPConnectionPool):
+    """Пул соединений urllib3 с учётом запросов и новых соединений"""
+
+    def _new_conn(self):
+        connection_metrics.record_connection(self.host)
+        return super()._new_conn()
+
+    def urlopen(self, method, url, *args, **kwargs):
+        connection_metrics.record_request(self.host)
+        return super().urlopen(method, url, *args, **kwargs)
+
+
+class MeteredHTTPSConnectionPool(HTTPSConnectionPool):
+    """HTTPS-вариант пула с учётом запросов и новых соединений"""
+
+    def _new_conn(self):
+        connection_metrics.record_connection(self.host)
+        return super()._new_conn()
+
+    def urlopen(self, method, url, *args, **kwargs):
+        connection_metrics.record_request(self.host)
+        return super().urlopen(method, url, *args, **kwargs)
+
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """Адаптер requests с настраиваемым пулом и таймаутами по умолчанию"""
+
+    def __init__(self, timeout=None, **kwargs):
+        self.timeout = timeout
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": MeteredHTTPConnectionPool,
+            "https": MeteredHTTPSConnectionPool,
+        }
+
+    def send(self, request, timeout=None, **kwargs):
+        # requests не поддерживает таймаут сессии — подставляем его здесь
+        if timeout is None:
+            timeout = self.timeout
+        return super().send(request, timeout=timeout, **kwargs)
+
+
+class HttpClient:
+    """Фабрика сессий с общим пулом соединений и таймаутами из настроек"""
+
+    def __init__(self, settings: Optional[Dict] = None):
+        self.settings = settings or get_http_settings()
+        self.timeout = (self.settings["connect_timeout"], self.settings["read_timeout"])
+        self._lock = threading.Lock()
+        self._session: Optional[requests.Session] = None
+
+    def create_session(self) -> requests.Session:
+        """
+        Создать отдельную сессию с пулом соединений
+
+        Нужна, когда у сессии свои заголовки или cookies (например, токен
+        в YandexMusicDirectAPI). Метрики учитываются общие.
+        """
+        session = requests.Session()
+        adapter = PooledHTTPAdapter(
+            timeout=self.timeout,
+            pool_connections=self.settings["pool_connections"],
+            pool_maxsize=self.settings["pool_maxsize"],
+        )
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
+    @property
+    def session(self) -> requests.Session:
+        """Общая сессия для запросов без авторизации"""
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    self._session = self.create_session()
+        return self._session
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        """GET через общую сессию"""
+        return self.session.get(url, **kwargs)
+
+    def head(self, url: str, **kwargs) -> requests.Response:
+        """HEAD через общую сессию"""
+        return self.session.head(url, **kwargs)
+
+    def get_metrics(self) -> Dict:
+        """Настройки пула и метрики повторного использования соединений"""
+        hosts = connection_metrics.snapshot()
+        total_requests = sum(host["requests"] for host in hosts.values())
+        total_reused = sum(host["reused"] for host in hosts.values())
+        return {
+            "settings": dict(self.settings),
+            "total_requests": total_requests,
+            "total_new_connections": sum(
+                host["new_connections"] for host in hosts.values()
+            ),
+            "reuse_rate": round(total_reused / total_requests, 3)
+            if total_requests
+            else 0.0,
+            "hosts": hosts,
+        }
+
+
+# Глобальный HTTP-клиент
+http_client = HttpClient()
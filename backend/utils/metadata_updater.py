@@ -3,7 +3,6 @@
 """
 
 import logging
-import time
 from typing import List, Dict, Optional
 from db_manager import db_manager
 
@@ -45,8 +44,8 @@ class MetadataUpdater:
             if track_id.startswith("scanned_"):
                 return False
 
-            # Получаем информацию о треке через API
-            tracks_result = self.yandex_client.client.tracks([track_id])
+            # Получаем информацию о треке (из кэша метаданных или через API)
+            tracks_result = self.yandex_client.get_tracks([track_id])
             if not tracks_result or len(tracks_result) == 0:
                 logger.warning(f"⚠️  Трек {track_id} не найден в API")
                 return False
@@ -82,9 +81,8 @@ class MetadataUpdater:
                         break
 
             # Обновляем запись в БД
-            with db_manager.get_connection() as conn:
-                cursor = conn.cursor()
-                cursor.execute(
+            db_manager.write(
+                lambda conn: conn.execute(
                     """
                     UPDATE downloaded_tracks 
                     SET year = ?, genre = ?, label = ?, isrc = ?, duration = ?, version = ?
@@ -92,7 +90,7 @@ class MetadataUpdater:
                 """,
                     (year, genre, label, isrc, duration, version, track_id),
                 )
-                conn.commit()
+            )
 
             logger.info(f"✅ Обновлены метаданные для трека {track_id}")
             return True
@@ -185,9 +183,8 @@ class MetadataUpdater:
 
             # Обновляем запись в БД по file_path
             if year or genre or label or duration or version:
-                with db_manager.get_connection() as conn:
-                    cursor = conn.cursor()
-                    cursor.execute(
+                db_manager.write(
+                    lambda conn: conn.execute(
                         """
                         UPDATE downloaded_tracks 
                         SET year = COALESCE(?, year), 
@@ -199,7 +196,7 @@ class MetadataUpdater:
                     """,
                         (year, genre, label, duration, version, file_path),
                     )
-                    conn.commit()
+                )
 
                 logger.info(f"✅ Обновлены метаданные из файла: {file_path}")
                 return True
@@ -260,6 +257,18 @@ class MetadataUpdater:
                     f"📦 Обрабатываем батч {batch_num}/{total_batches} ({len(batch)} треков)"
                 )
 
+                # Один запрос к API на весь батч: дальше треки берутся из кэша метаданных
+                api_track_ids = [
+                    track["track_id"]
+                    for track in batch
+                    if track.get("track_id") and not track["track_id"].startswith("scanned_")
+                ]
+                if api_track_ids and self.yandex_client and self.yandex_client.client:
+                    try:
+                        self.yandex_client.get_tracks(api_track_ids, batch_size=batch_size)
+                    except Exception as e:
+                        logger.warning(f"⚠️  Не удалось получить метаданные батча: {e}")
+
                 for track in batch:
                     track_id = track.get("track_id")
                     file_path = track.get("file_path")
@@ -279,13 +288,6 @@ class MetadataUpdater:
                     else:
                         self.skipped_count += 1
 
-                    # Небольшая задержка между треками для снижения нагрузки
-                    time.sleep(0.1)
-
-                # Задержка между батчами
-                if i + batch_size < total_tracks:
-                    time.sleep(0.5)
-
             logger.info(
                 f"✅ Обновление завершено: обновлено {self.updated_count}, "
                 f"ошибок {self.failed_count}, пропущено {self.skipped_count}"
@@ -0,0 +1,66 @@
+"""Постраничная выдача по курсору (keyset pagination)
+
+Вместо LIMIT/OFFSET следующая страница начинается сразу после ключа
+последней строки предыдущей: WHERE (date, id) < (?, ?). Стоимость страницы не
+зависит от её номера — SQLite сразу переходит к нужному месту индекса.
+
+Курсор для клиента непрозрачен: это ключ последней строки в base64.
+"""
+
+import base64
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+# Размер страницы по умолчанию
+DEFAULT_PAGE_SIZE = 100
+
+# Максимальный размер страницы, который может запросить клиент
+MAX_PAGE_SIZE = 2000
+
+
+def page_size(limit: Optional[int], default: int = DEFAULT_PAGE_SIZE) -> int:
+    """Размер страницы в допустимых пределах"""
+    if not limit or limit < 1:
+        return default
+    return min(limit, MAX_PAGE_SIZE)
+
+
+def encode_cursor(*values: Any) -> str:
+    """Закодировать ключ строки в курсор"""
+    raw = json.dumps(values, separators=(",", ":"), ensure_ascii=False)
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, size: int) -> Tuple:
+    """
+    Раскодировать курсор в ключ строки
+
+    Args:
+        cursor: Курсор из ответа API
+        size: Ожидаемое число полей ключа
+
+    Raises:
+        ValueError: Курсор повреждён или от другого списка
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except (ValueError, UnicodeError) as e:
+        raise ValueError(f"Некорректный курсор: {cursor}") from e
+
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError(f"Некорректный курсор: {cursor}")
+    return tuple(values)
+
+
+def next_cursor(items: List[Dict], limit: int, *fields: str) -> Optional[str]:
+    """
+    Курсор следующей страницы
+
+    Returns:
+        Курсор по ключу последней строки или None, если страница неполная
+    """
+    if len(items) < limit or not items:
+        return None
+    last = items[-1]
+    return encode_cursor(*(last[field] for field in fields))
@@ -0,0 +1,425 @@
+"""
+Ограничение частоты запросов к API (token bucket)
+
+Ведро вмещает burst токенов и пополняется со скоростью rate токенов в
+секунду. Каждый запрос забирает токен; если токенов нет, поток ждёт
+пополнения. Ведро общее для всех потоков, поэтому параллельные запросы
+вместе не превышают заданную частоту.
+
+AdaptiveRateLimiter дополнительно подстраивает частоту под ответы API:
+замедляется на 429 (с учётом Retry-After) и на всплеске ошибок, а при
+стабильной работе возвращается к заданной частоте. RateLimiterRegistry
+держит отдельный ограничитель на каждую пару (класс методов, аккаунт).
+"""
+
+import asyncio
+import hashlib
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+
+import requests
+from yandex_music.exceptions import NetworkError, TimedOutError
+
+from config.settings import get_yandex_api_settings
+
+logger = logging.getLogger("rate_limiter")
+
+# Во сколько раз снижать частоту после ответа 429
+THROTTLE_DECREASE = 0.5
+
+# Во сколько раз снижать частоту, когда много сетевых ошибок и 5xx
+ERROR_DECREASE = 0.75
+
+# Сколько последних ответов учитывать при подсчёте доли ошибок
+ERROR_WINDOW = 20
+
+# Доля ошибок в окне, после которой частота снижается
+ERROR_RATIO = 0.3
+
+# На какую долю заданной частоты восстанавливаться после серии успешных ответов
+RECOVERY_STEP = 0.1
+
+# Нижняя граница частоты относительно заданной
+MIN_RATE_FACTOR = 0.1
+
+# Ошибки, которые говорят о проблемах сети или перегрузке сервера
+TRANSIENT_ERRORS = (
+    TimedOutError,
+    NetworkError,
+    requests.Timeout,
+    requests.ConnectionError,
+    TimeoutError,
+    ConnectionError,
+)
+
+
+class RateLimiter:
+    """Потокобезопасный token bucket"""
+
+    def __init__(self, rate: float, burst: int = 1):
+        """
+        Args:
+            rate: Запросов в секунду
+            burst: Сколько запросов можно сделать подряд без ожидания
+        """
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _reserve(self) -> float:
+        """Забрать токен; вернуть, сколько секунд ждать до его появления"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    def acquire(self, cancel: Optional[threading.Event] = None) -> bool:
+        """
+        Дождаться разрешения на запрос
+
+        Args:
+            cancel: Событие отмены — ожидание прерывается, когда оно установлено
+
+        Returns:
+            False, если ожидание прервано отменой
+        """
+        delay = self._reserve()
+        if delay <= 0:
+            return True
+        if cancel is not None:
+            return not cancel.wait(delay)
+        time.sleep(delay)
+        return True
+
+
+class RequestCancelled(Exception):
+    """Ожидание разрешения на запрос прервано отменой"""
+
+
+class RateLimitBusy(Exception):
+    """Запрос из потока цикла событий, а ограничитель требует подождать"""
+
+    def __init__(self, delay: float, name: str):
+        super().__init__(f"{name}: лимит запросов, повторите через {delay:.1f} с")
+        self.delay = delay
+
+
+def _on_event_loop() -> bool:
+    """Вызов идёт из потока, в котором работает цикл событий asyncio"""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+# Событие отмены текущего потока (см. cancel_scope)
+_cancel_local = threading.local()
+
+
+@contextmanager
+def cancel_scope(cancel: Optional[threading.Event]):
+    """
+    Сделать событие отмены текущим для потока
+
+    Запросы к API внутри блока ждут разрешения ограничителя, пока событие не
+    установлено; после отмены ожидание прерывается RequestCancelled. Так
+    отмена доходит до запросов, которые делает библиотека, не принимающая cancel.
+    """
+    previous = getattr(_cancel_local, "event", None)
+    _cancel_local.event = cancel
+    try:
+        yield
+    finally:
+        _cancel_local.event = previous
+
+
+def current_cancel() -> Optional[threading.Event]:
+    """Событие отмены, установленное cancel_scope для текущего потока"""
+    return getattr(_cancel_local, "event", None)
+
+
+def parse_retry_after(response) -> Optional[float]:
+    """Значение заголовка Retry-After в секундах (число или HTTP-дата)"""
+    headers = getattr(response, "headers", None) or {}
+    value = headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def classify_result(
+    result: Any = None, error: Optional[BaseException] = None
+) -> Tuple[str, Optional[float]]:
+    """
+    Оценить ответ API с точки зрения нагрузки
+
+    Returns:
+        ("ok" | "throttled" | "error", Retry-After в секундах или None).
+        Ошибки клиента (404, 401, неверный запрос) считаются "ok": они не
+        говорят о перегрузке и не должны замедлять остальные запросы.
+    """
+    if error is not None:
+        # Библиотека yandex_music не отдаёт заголовки: код 429 есть только в тексте
+        if "(429)" in str(error) or "Too Many Requests" in str(error):
+            return "throttled", None
+        if isinstance(error, TRANSIENT_ERRORS):
+            return "error", None
+        return "ok", None
+
+    status = getattr(result, "status_code", None)
+    if status == 429:
+        return "throttled", parse_retry_after(result)
+    if status is not None and status >= 500:
+        return "error", None
+    return "ok", None
+
+
+class AdaptiveRateLimiter(RateLimiter):
+    """
+    Token bucket, подстраивающий частоту под ответы API (AIMD)
+
+    - 429: частота делится пополам, запросы приостанавливаются на Retry-After
+      (или на экспоненциально растущую паузу), накопленные токены сгорают;
+    - доля сетевых ошибок и 5xx в последних ответах выше порога: частота
+      снижается на четверть;
+    - серия успешных ответов: частота понемногу возвращается к заданной.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        burst: int = 1,
+        min_rate: Optional[float] = None,
+        max_cooldown: float = 60.0,
+        name: str = "api",
+    ):
+        """
+        Args:
+            rate: Заданная частота (запросов в секунду), выше неё не поднимаемся
+            burst: Сколько запросов можно сделать подряд без ожидания
+            min_rate: Нижняя граница частоты при замедлении
+            max_cooldown: Максимальная пауза после 429 без Retry-After (секунды)
+            name: Имя для логов и статистики
+        """
+        super().__init__(rate, burst)
+        self.name = name
+        self.max_rate = rate
+        self.min_rate = (
+            min_rate if min_rate is not None else max(rate * MIN_RATE_FACTOR, 0.1)
+        )
+        self.max_cooldown = max_cooldown
+        self._blocked_until = 0.0
+        self._throttle_streak = 0
+        self._healthy = 0
+        self._recent: Deque[bool] = deque(maxlen=ERROR_WINDOW)
+        self._counters = {"requests": 0, "throttled": 0, "errors": 0, "slowdowns": 0}
+
+    def _reserve(self) -> float:
+        delay = super()._reserve()
+        with self._lock:
+            return max(delay, self._blocked_until - time.monotonic())
+
+    def acquire(self, cancel: Optional[threading.Event] = None) -> bool:
+        """
+        Дождаться разрешения на запрос
+
+        В потоке цикла событий ожидание остановило бы все запросы и воркеры
+        (пауза после 429 длится до max_cooldown), поэтому там ограничитель
+        не ждёт, а сразу отказывает.
+
+        Raises:
+            RateLimitBusy: Нужно ждать, а вызов идёт из цикла событий
+        """
+        if _on_event_loop():
+            delay = self._reserve()
+            if delay > 0:
+                with self._lock:
+                    # Токен не использован — возвращаем его в ведро
+                    self._tokens += 1
+                raise RateLimitBusy(delay, self.name)
+            return True
+        return super().acquire(cancel if cancel is not None else current_cancel())
+
+    def record(self, outcome: str, retry_after: Optional[float] = None):
+        """Учесть результат запроса (ok, throttled или error, см. classify_result)"""
+        with self._lock:
+            self._counters["requests"] += 1
+            if outcome == "throttled":
+                self._on_throttled(retry_after)
+            elif outcome == "error":
+                self._counters["errors"] += 1
+                self._recent.append(False)
+                self._healthy = 0
+                failures = self._recent.count(False)
+                if (
+                    len(self._recent) >= ERROR_WINDOW // 2
+                    and failures / len(self._recent) >= ERROR_RATIO
+                ):
+                    self._slow_down(ERROR_DECREASE, "доля ошибок")
+                    self._recent.clear()
+            else:
+                self._recent.append(True)
+                self._throttle_streak = 0
+                self._healthy += 1
+                # Раз в «секунду» успешных запросов прибавляем долю заданной частоты
+                if self.rate < self.max_rate and self._healthy >= max(self.rate, 1):
+                    self._healthy = 0
+                    self.rate = min(self.max_rate, self.rate + self.max_rate * RECOVERY_STEP)
+
+    def _on_throttled(self, retry_after: Optional[float]):
+        self._counters["throttled"] += 1
+        self._throttle_streak += 1
+        self._healthy = 0
+        if retry_after is None:
+            retry_after = min(self.max_cooldown, 2 ** (self._throttle_streak - 1))
+        now = time.monotonic()
+        self._blocked_until = max(self._blocked_until, now + retry_after)
+        # Накопленные токены сгорают: после паузы не отправляем пачку разом
+        self._tokens = min(self._tokens, 0.0)
+        self._updated = now
+        self._slow_down(THROTTLE_DECREASE, f"429, пауза {retry_after:.1f} с")
+
+    def _slow_down(self, factor: float, reason: str):
+        rate = max(self.min_rate, self.rate * factor)
+        if rate < self.rate:
+            self._counters["slowdowns"] += 1
+            logger.warning(
+                f"🐢 {self.name}: частота {self.rate:.2f} → {rate:.2f} запр/с ({reason})"
+            )
+        self.rate = rate
+
+    def call(
+        self,
+        func: Callable,
+        *args,
+        cancel: Optional[threading.Event] = None,
+        retries: int = 0,
+        **kwargs,
+    ) -> Any:
+        """
+        Выполнить запрос с ожиданием разрешения и учётом результата
+
+        Ответ 429 (исключение или response.status_code) повторяется до retries
+        раз после паузы; последний результат возвращается/пробрасывается как есть.
+
+        Raises:
+            RequestCancelled: Ожидание прервано событием отмены
+        """
+        attempt = 0
+        while True:
+            if not self.acquire(cancel):
+                raise RequestCancelled()
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                outcome, retry_after = classify_result(error=e)
+                self.record(outcome, retry_after)
+                if outcome == "throttled" and attempt < retries:
+                    attempt += 1
+                    continue
+                raise
+            outcome, retry_after = classify_result(result)
+            self.record(outcome, retry_after)
+            if outcome == "throttled" and attempt < retries:
+                attempt += 1
+                continue
+            return result
+
+    def stats(self) -> Dict:
+        """Текущая частота, пауза и счётчики ответов"""
+        with self._lock:
+            return {
+                "rate": round(self.rate, 3),
+                "max_rate": self.max_rate,
+                "min_rate": round(self.min_rate, 3),
+                "burst": self.burst,
+                "cooldown_seconds": round(
+                    max(self._blocked_until - time.monotonic(), 0.0), 2
+                ),
+                **self._counters,
+            }
+
+
+class RateLimiterRegistry:
+    """
+    Ограничители по классам методов API и аккаунтам
+
+    У каждого аккаунта (токена) свой набор ведер: лимиты Яндекса считаются
+    на аккаунт. Классы методов ограничиваются независимо, чтобы 429 на
+    получении ссылок не тормозил чтение каталога и наоборот.
+    """
+
+    def __init__(self, settings: Dict[str, Dict]):
+        """
+        Args:
+            settings: Параметры по классам: {класс: {"rate", "burst"}}, плюс
+                общие "retries" и "max_cooldown"
+        """
+        self.settings = settings
+        self._limiters: Dict[Tuple[str, str], AdaptiveRateLimiter] = {}
+        self._lock = threading.Lock()
+
+    def get(self, endpoint: str, account: str = "default") -> AdaptiveRateLimiter:
+        """Ограничитель для класса методов и аккаунта (создаётся при первом обращении)"""
+        key = (endpoint, account)
+        limiter = self._limiters.get(key)
+        if limiter is not None:
+            return limiter
+        with self._lock:
+            limiter = self._limiters.get(key)
+            if limiter is None:
+                params = self.settings.get(endpoint) or self.settings["catalog"]
+                limiter = AdaptiveRateLimiter(
+                    params["rate"],
+                    params["burst"],
+                    max_cooldown=self.settings["max_cooldown"],
+                    name=f"{endpoint}@{account}",
+                )
+                self._limiters[key] = limiter
+            return limiter
+
+    def call(self, endpoint: str, account: str, func: Callable, *args, **kwargs) -> Any:
+        """Выполнить запрос через ограничитель класса методов и аккаунта"""
+        kwargs.setdefault("retries", self.settings["retries"])
+        return self.get(endpoint, account).call(func, *args, **kwargs)
+
+    def stats(self) -> Dict:
+        """Статистика всех ограничителей: {аккаунт: {класс: ...}}"""
+        with self._lock:
+            limiters = dict(self._limiters)
+        result: Dict[str, Dict] = {}
+        for (endpoint, account), limiter in sorted(limiters.items()):
+            result.setdefault(account, {})[endpoint] = limiter.stats()
+        return result
+
+
+def account_key(token: Optional[str]) -> str:
+    """Ключ аккаунта для ограничителей: хэш токена (сам токен в статистику не попадает)"""
+    if not token:
+        return "anonymous"
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()[:12]
+
+
+# Ограничители запросов к API Яндекс.Музыки по классам методов и аккаунтам
+yandex_api_limits = RateLimiterRegistry(get_yandex_api_settings())
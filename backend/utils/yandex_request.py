@@ -0,0 +1,51 @@
+"""
+Транспорт библиотеки yandex_music с ограничением частоты запросов
+
+Все методы библиотеки (client.tracks, users_playlists, get_download_info,
+track.download и т.д.) выполняют HTTP-запрос через Request._request_wrapper.
+LimitedRequest пропускает каждый такой запрос через ограничитель из
+yandex_api_limits — по классу метода (определяется по URL) и аккаунту.
+Так лимит соблюдается для всех путей вызова API, а не только там, где
+вызывающий код не забыл про паузы.
+"""
+
+from urllib.parse import urlparse
+
+from yandex_music.utils.request import Request
+
+from utils.rate_limiter import yandex_api_limits
+
+
+def endpoint_class(url: str) -> str:
+    """Класс метода API по URL запроса: catalog, download_info или storage"""
+    parsed = urlparse(url)
+    path = parsed.path or ""
+    if path.endswith("/download-info") or "/get-file-info" in path:
+        return "download_info"
+    host = parsed.hostname or ""
+    if host.startswith("api.music.yandex"):
+        return "catalog"
+    # Хранилище: XML с данными прямой ссылки и сами файлы
+    return "storage"
+
+
+class LimitedRequest(Request):
+    """Request библиотеки yandex_music с ограничением частоты на аккаунт"""
+
+    def __init__(self, account: str, *args, **kwargs):
+        """
+        Args:
+            account: Ключ аккаунта (см. rate_limiter.account_key)
+        """
+        super().__init__(*args, **kwargs)
+        self.account = account
+
+    def _request_wrapper(self, *args, **kwargs):
+        url = args[1] if len(args) > 1 else kwargs.get("url", "")
+        return yandex_api_limits.call(
+            endpoint_class(url),
+            self.account,
+            super()._request_wrapper,
+            *args,
+            **kwargs,
+        )
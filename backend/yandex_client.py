@@ -2,16 +2,26 @@
 Клиент для работы с API Яндекс.Музыки
 """
 
+import json
 import logging
 import os
-from typing import Callable, List, Optional
-
+import threading
+from typing import Callable, Dict, Iterable, List, Optional
+
+from config.settings import get_track_metadata_ttl, get_yandex_api_settings
+from resumable_download import DownloadStopped, ResumableDownloader
+from utils.batch_resolver import BatchResolver, ResolveCancelled
+from utils.rate_limiter import RequestCancelled, account_key
+from utils.yandex_request import LimitedRequest
 from yandex_music import Client, Playlist, Track
 
 # Логгер для Яндекс клиента
 logger = logging.getLogger("yandex")
 download_logger = logging.getLogger("download")
 
+# Суффикс расшифрованного MP4, который ещё нужно сконвертировать в FLAC
+PENDING_MUX_SUFFIX = ".decrypted.mp4"
+
 # Импортируем прямой API для FLAC
 try:
     from yandex_direct_api import YandexMusicDirectAPI
@@ -24,6 +34,19 @@ except ImportError:
     )
 
 
+def _compact_json(value):
+    """Убрать пустые поля из JSON трека (при восстановлении они и так None)"""
+    if isinstance(value, dict):
+        return {
+            key: _compact_json(item)
+            for key, item in value.items()
+            if item is not None and item != [] and item != {}
+        }
+    if isinstance(value, list):
+        return [_compact_json(item) for item in value]
+    return value
+
+
 class YandexMusicClient:
     """Обертка для работы с Яндекс.Музыкой"""
 
@@ -35,6 +58,8 @@ class YandexMusicClient:
             token: Токен авторизации Яндекс.Музыки (OAuth или Session_id)
         """
         self.token = token
+        # Ключ аккаунта для ограничителей частоты запросов к API
+        self.account = account_key(token)
         self.client: Optional[Client] = None
         self.uid: Optional[int] = None
         self.direct_api_client: Optional["YandexMusicDirectAPI"] = None
@@ -52,6 +77,10 @@ class YandexMusicClient:
             except Exception as e:
                 logger.warning(f"⚠️  Не удалось инициализировать прямой API: {e}")
 
+    def _new_client(self, token: Optional[str] = None) -> Client:
+        """Клиент библиотеки, все запросы которого проходят через ограничитель аккаунта"""
+        return Client(token, request=LimitedRequest(self.account))
+
     def connect(self) -> bool:
         """
         Подключение к Яндекс.Музыке
@@ -63,19 +92,19 @@ class YandexMusicClient:
             # Пробуем разные способы инициализации в зависимости от типа токена
             if self.token.startswith("y0_"):
                 # OAuth токен
-                self.client = Client(self.token).init()
+                self.client = self._new_client(self.token).init()
             elif self.token.startswith("3:"):
                 # Session_id токен - пробуем использовать как OAuth
                 try:
-                    self.client = Client(self.token).init()
+                    self.client = self._new_client(self.token).init()
                 except:
                     # Если не получилось, пробуем другой способ
-                    self.client = Client().init()
+                    self.client = self._new_client().init()
                     # Устанавливаем session_id вручную
                     self.client._session_id = self.token
             else:
                 # Пробуем как OAuth токен
-                self.client = Client(self.token).init()
+                self.client = self._new_client(self.token).init()
 
             # Проверяем, что клиент действительно подключился
             if self.client:
@@ -311,19 +340,51 @@ class YandexMusicClient:
             raise Exception(f"Ошибка получения плейлистов: {error_msg}")
 
     def get_playlist_tracks(
-        self, playlist_id: str, batch_size: int = 100, max_tracks: Optional[int] = None
+        self,
+        playlist_id: str,
+        batch_size: int = 100,
+        max_tracks: Optional[int] = None,
+        cancel: Optional[threading.Event] = None,
     ) -> List[dict]:
         """
         Получить треки из плейлиста с поддержкой пакетной обработки
 
+        Полный состав плейлиста сохраняется в кэш БД (playlist_cache), по
+        которому считается статистика плейлиста без обращения к API.
+
         Args:
             playlist_id: ID плейлиста
             batch_size: Размер батча для обработки (по умолчанию 100)
             max_tracks: Максимальное количество треков для обработки (None = все)
+            cancel: Событие отмены получения метаданных треков
 
         Returns:
             Список треков
+
+        Raises:
+            ResolveCancelled: Получение отменено событием cancel
         """
+        tracks = self._fetch_playlist_tracks(playlist_id, batch_size, max_tracks, cancel)
+
+        # Усечённый список не описывает плейлист целиком
+        if tracks and not max_tracks:
+            try:
+                from db_manager import db_manager
+
+                db_manager.save_playlist_tracks(playlist_id, tracks)
+            except Exception as e:
+                print(f"Не удалось сохранить состав плейлиста {playlist_id} в кэш: {e}")
+
+        return tracks
+
+    def _fetch_playlist_tracks(
+        self,
+        playlist_id: str,
+        batch_size: int,
+        max_tracks: Optional[int],
+        cancel: Optional[threading.Event] = None,
+    ) -> List[dict]:
+        """Загрузить треки плейлиста из Яндекс.Музыки"""
         if not self.client:
             if not self.connect():
                 print("Не удалось подключиться к Яндекс.Музыке")
@@ -340,30 +401,14 @@ class YandexMusicClient:
 
             # Специальная обработка для плейлиста "Мне нравится"
             if playlist_id == "likes":
-                return self._get_liked_tracks_optimized(batch_size, max_tracks)
+                return self._get_liked_tracks_optimized(batch_size, max_tracks, cancel)
 
             # Для обычных плейлистов
-            try:
-                from db_manager import DatabaseManager
-
-                db_manager = DatabaseManager()
-                token_info = db_manager.get_active_token()
-                username = token_info.get("username") if token_info else None
-
-                if username:
-                    print(f"Используем username: {username}")
-                    playlist = self.client.users_playlists(playlist_id, username)
-                else:
-                    playlist = self.client.users_playlists(playlist_id)
-            except Exception as e:
-                print(f"Ошибка получения плейлиста с username: {e}")
-                playlist = self.client.users_playlists(playlist_id)
-
-            if not playlist:
-                raise Exception(f"Плейлист с ID {playlist_id} не найден")
+            playlist = self._get_user_playlist(playlist_id)
 
             print(f"Плейлист найден: {playlist.title}")
-            tracks = playlist.fetch_tracks()
+            # Ответ users_playlists уже содержит треки; fetch_tracks повторяет тот же запрос
+            tracks = playlist.tracks or playlist.fetch_tracks()
             if not tracks:
                 tracks = []
 
@@ -376,8 +421,12 @@ class YandexMusicClient:
 
             print(f"Получено {len(tracks)} треков из плейлиста {playlist_id}")
 
-            return self._process_tracks_batch(tracks, batch_size, playlist.title)
+            return self._process_tracks_batch(
+                tracks, batch_size, playlist.title, cancel
+            )
 
+        except ResolveCancelled:
+            raise
         except Exception as e:
             print(f"Ошибка получения треков для плейлиста {playlist_id}: {e}")
             import traceback
@@ -385,8 +434,141 @@ class YandexMusicClient:
             traceback.print_exc()
             return []
 
+    def _get_user_playlist(self, playlist_id: str) -> Playlist:
+        """Получить плейлист пользователя (с username активного аккаунта)"""
+        try:
+            from db_manager import db_manager
+
+            token_info = db_manager.get_active_token()
+            username = token_info.get("username") if token_info else None
+
+            if username:
+                print(f"Используем username: {username}")
+                playlist = self.client.users_playlists(playlist_id, username)
+            else:
+                playlist = self.client.users_playlists(playlist_id)
+        except Exception as e:
+            print(f"Ошибка получения плейлиста с username: {e}")
+            playlist = self.client.users_playlists(playlist_id)
+
+        if not playlist:
+            raise Exception(f"Плейлист с ID {playlist_id} не найден")
+        return playlist
+
+    def sync_playlist(
+        self,
+        playlist_id: str,
+        batch_size: int = 100,
+        cancel: Optional[threading.Event] = None,
+    ) -> dict:
+        """
+        Инкрементальная синхронизация плейлиста по сохранённому снимку
+
+        Загружается только список ID треков и ревизия плейлиста. Если ревизия
+        совпадает со снимком в БД, плейлист не изменился. Иначе список
+        сравнивается со снимком: метаданные запрашиваются только для
+        добавленных треков, удалённые возвращаются списком ID. Снимок
+        обновляется до текущего состава.
+
+        Args:
+            playlist_id: ID плейлиста ("likes" — "Мне нравится")
+            batch_size: Размер батча запроса метаданных
+            cancel: Событие отмены получения метаданных
+
+        Returns:
+            Словарь с ревизией, добавленными треками и ID удалённых
+        """
+        from db_manager import db_manager
+
+        if not self.client and not self.connect():
+            raise Exception("Не удалось подключиться к Яндекс.Музыке")
+
+        # Список ID и ревизия — один запрос без метаданных треков
+        if playlist_id == "likes":
+            likes = self.client.users_likes_tracks()
+            playlist_name = "Мне нравится"
+            revision = likes.revision if likes else None
+            track_shorts = likes.tracks if likes else []
+        else:
+            playlist = self._get_user_playlist(playlist_id)
+            playlist_name = playlist.title
+            revision = playlist.revision
+            track_shorts = playlist.tracks or []
+            if not track_shorts and playlist.track_count:
+                track_shorts = playlist.fetch_tracks() or []
+
+            # Полные треки в ответе экономят запрос метаданных
+            self.cache_tracks(
+                track_short.track for track_short in track_shorts if track_short.track
+            )
+
+        track_ids = list(
+            dict.fromkeys(str(track_short.id) for track_short in track_shorts if track_short.id)
+        )
+        snapshot = db_manager.get_playlist_snapshot(playlist_id)
+
+        result = {
+            "playlist_id": playlist_id,
+            "playlist_name": playlist_name,
+            "revision": revision,
+            "previous_revision": snapshot["revision"] if snapshot else None,
+            "total": len(track_ids),
+            "unchanged": False,
+            "added": [],
+            "removed": [],
+        }
+
+        if (
+            snapshot
+            and revision is not None
+            and snapshot["revision"] == revision
+            and len(snapshot["tracks"]) == len(track_ids)
+        ):
+            download_logger.info(
+                f"✅ Плейлист {playlist_id} не изменился (ревизия {revision})"
+            )
+            result["unchanged"] = True
+            return result
+
+        known = dict(snapshot["tracks"]) if snapshot else {}
+        added_ids = [track_id for track_id in track_ids if track_id not in known]
+        current = set(track_ids)
+        result["removed"] = [track_id for track_id in known if track_id not in current]
+
+        added = [
+            self._track_to_dict(track, playlist_name)
+            for track in self.get_tracks(
+                added_ids, batch_size=batch_size, skip_failed=True, cancel=cancel
+            )
+        ]
+        result["added"] = added
+        download_logger.info(
+            f"🔄 Синхронизация {playlist_id}: +{len(added)} / -{len(result['removed'])} "
+            f"(ревизия {result['previous_revision']} → {revision})"
+        )
+
+        # Новый снимок: доступность известных треков берём из старого снимка
+        availability = {track["id"]: track["available"] for track in added}
+        db_manager.save_playlist_tracks(
+            playlist_id,
+            [
+                {
+                    "id": track_id,
+                    "available": availability.get(track_id, known.get(track_id, True)),
+                    "playlist_name": playlist_name,
+                }
+                for track_id in track_ids
+                if track_id in known or track_id in availability
+            ],
+            revision=revision,
+        )
+        return result
+
     def _get_liked_tracks_optimized(
-        self, batch_size: int = 100, max_tracks: Optional[int] = None
+        self,
+        batch_size: int = 100,
+        max_tracks: Optional[int] = None,
+        cancel: Optional[threading.Event] = None,
     ) -> List[dict]:
         """
         Оптимизированное получение лайкнутых треков с пакетной обработкой
@@ -394,6 +576,7 @@ class YandexMusicClient:
         Args:
             batch_size: Размер батча для обработки
             max_tracks: Максимальное количество треков для обработки (None = все)
+            cancel: Событие отмены получения метаданных
 
         Returns:
             Список треков
@@ -427,120 +610,28 @@ class YandexMusicClient:
             ]
             download_logger.info(f"📋 Получено {len(track_ids)} ID треков")
 
-            # Обрабатываем батчами для оптимизации
-            result = []
-            for i in range(0, len(track_ids), batch_size):
-                batch_ids = track_ids[i : i + batch_size]
-                batch_num = (i // batch_size) + 1
-                total_batches = (len(track_ids) + batch_size - 1) // batch_size
-
-                download_logger.info(
-                    f"📦 Обрабатываем батч {batch_num}/{total_batches} ({len(batch_ids)} треков)"
-                )
-
-                try:
-                    # Используем метод tracks() для получения полной информации о батче треков
-                    tracks = self.client.tracks(batch_ids)
-
-                    for track in tracks:
-                        try:
-                            if not track:
-                                continue
-
-                            # Безопасное получение данных трека
-                            artists = []
-                            if track.artists:
-                                artists = [
-                                    artist.name
-                                    for artist in track.artists
-                                    if hasattr(artist, "name")
-                                ]
-
-                            album_title = None
-                            year = None
-                            genre = None
-                            label = None
-                            version = None
-
-                            if track.albums and len(track.albums) > 0:
-                                album = track.albums[0]
-                                album_title = getattr(album, "title", None)
-                                year = getattr(album, "year", None)
-                                genre = getattr(album, "genre", None)
-                                # Получаем первый лейбл если есть
-                                if (
-                                    hasattr(album, "labels")
-                                    and album.labels
-                                    and len(album.labels) > 0
-                                ):
-                                    label = getattr(album.labels[0], "name", None)
-                                version = getattr(album, "version", None)
-
-                            # Получаем версию трека если не найдена в альбоме
-                            if not version:
-                                version = getattr(track, "version", None)
-
-                            # Попытка получить ISRC
-                            isrc = None
-                            if hasattr(track, "isrc"):
-                                isrc = track.isrc
-                            elif hasattr(track, "albums") and track.albums:
-                                for album in track.albums:
-                                    if hasattr(album, "isrc"):
-                                        isrc = album.isrc
-                                        break
-
-                            track_data = {
-                                "id": str(track.id) if track.id else None,
-                                "title": track.title or "Без названия",
-                                "artist": (
-                                    ", ".join(artists)
-                                    if artists
-                                    else "Неизвестный исполнитель"
-                                ),
-                                "album": album_title,
-                                "duration": (
-                                    track.duration_ms // 1000
-                                    if track.duration_ms
-                                    else 0
-                                ),
-                                "year": year,
-                                "genre": genre,
-                                "label": label,
-                                "version": version,
-                                "isrc": isrc,
-                                "available": getattr(track, "available", True),
-                                "playlist_name": "Мне нравится",
-                            }
-
-                            result.append(track_data)
-
-                        except Exception as track_error:
-                            download_logger.warning(
-                                f"Ошибка обработки трека в батче: {track_error}"
-                            )
-                            continue
-
-                    download_logger.info(
-                        f"✅ Батч {batch_num}/{total_batches} обработан: {len(tracks)} треков"
-                    )
-
-                    # Небольшая задержка между батчами для снижения нагрузки на API
-                    import time
-
-                    time.sleep(0.5)
+            # Полная информация о треках: из кэша метаданных, недостающие —
+            # батчами из API (частоту запросов ограничивает yandex_api_limits)
+            all_tracks = self.get_tracks(
+                track_ids, batch_size=batch_size, skip_failed=True, cancel=cancel
+            )
 
-                except Exception as batch_error:
-                    download_logger.error(
-                        f"❌ Ошибка обработки батча {batch_num}: {batch_error}"
-                    )
+            result = []
+            for track in all_tracks:
+                if not track:
                     continue
+                try:
+                    result.append(self._track_to_dict(track, "Мне нравится"))
+                except Exception as track_error:
+                    download_logger.warning(f"Ошибка обработки трека: {track_error}")
 
             download_logger.info(
                 f"✅ Успешно обработано {len(result)} треков из 'Мне нравится'"
             )
             return result
 
+        except ResolveCancelled:
+            raise
         except Exception as e:
             download_logger.error(f"❌ Ошибка получения лайков: {e}")
             import traceback
@@ -549,7 +640,11 @@ class YandexMusicClient:
             return []
 
     def _process_tracks_batch(
-        self, tracks, batch_size: int = 100, playlist_name: str = None
+        self,
+        tracks,
+        batch_size: int = 100,
+        playlist_name: str = None,
+        cancel: Optional[threading.Event] = None,
     ) -> List[dict]:
         """
         Обработка списка треков батчами
@@ -557,6 +652,7 @@ class YandexMusicClient:
         Args:
             tracks: Список треков для обработки
             batch_size: Размер батча
+            cancel: Событие отмены получения недостающих метаданных
 
         Returns:
             Список обработанных треков
@@ -564,6 +660,28 @@ class YandexMusicClient:
         result = []
         total_tracks = len(tracks)
 
+        # Треки плейлиста уже получены полностью — сохраняем их в кэш метаданных
+        self.cache_tracks(
+            track_short.track for track_short in tracks if track_short.track
+        )
+
+        # Треки без полных данных в ответе плейлиста получаем параллельными батчами
+        missing_ids = [
+            track_short.id
+            for track_short in tracks
+            if not track_short.track and track_short.id
+        ]
+        if missing_ids:
+            resolved = {
+                str(track.id): track
+                for track in self.get_tracks(
+                    missing_ids, batch_size=batch_size, skip_failed=True, cancel=cancel
+                )
+            }
+            for track_short in tracks:
+                if not track_short.track and track_short.id:
+                    track_short.track = resolved.get(str(track_short.id).split(":")[0])
+
         for i in range(0, total_tracks, batch_size):
             batch = tracks[i : i + batch_size]
             batch_num = (i // batch_size) + 1
@@ -578,76 +696,9 @@ class YandexMusicClient:
                     if not track_short.track:
                         continue
 
-                    track = track_short.track
-
-                    # Безопасное получение данных трека
-                    artists = []
-                    if track.artists:
-                        artists = [
-                            artist.name
-                            for artist in track.artists
-                            if hasattr(artist, "name")
-                        ]
-
-                    album_title = None
-                    year = None
-                    genre = None
-                    label = None
-                    version = None
-
-                    if track.albums and len(track.albums) > 0:
-                        album = track.albums[0]
-                        album_title = getattr(album, "title", None)
-                        year = getattr(album, "year", None)
-                        genre = getattr(album, "genre", None)
-                        # Получаем первый лейбл если есть
-                        if (
-                            hasattr(album, "labels")
-                            and album.labels
-                            and len(album.labels) > 0
-                        ):
-                            label = getattr(album.labels[0], "name", None)
-                        version = getattr(album, "version", None)
-
-                    # Получаем версию трека если не найдена в альбоме
-                    if not version:
-                        version = getattr(track, "version", None)
-
-                    # Попытка получить ISRC (может быть в разных местах)
-                    isrc = None
-                    if hasattr(track, "isrc"):
-                        isrc = track.isrc
-                    elif hasattr(track, "albums") and track.albums:
-                        # Иногда ISRC может быть в альбоме
-                        for album in track.albums:
-                            if hasattr(album, "isrc"):
-                                isrc = album.isrc
-                                break
-
-                    # Получаем обложку трека
-                    cover_url = self._get_track_cover_url(track)
-
-                    track_data = {
-                        "id": str(track.id) if track.id else None,
-                        "title": track.title or "Без названия",
-                        "artist": (
-                            ", ".join(artists) if artists else "Неизвестный исполнитель"
-                        ),
-                        "album": album_title,
-                        "duration": (
-                            track.duration_ms // 1000 if track.duration_ms else 0
-                        ),
-                        "year": year,
-                        "genre": genre,
-                        "label": label,
-                        "version": version,
-                        "isrc": isrc,
-                        "cover": cover_url,
-                        "available": getattr(track, "available", True),
-                        "playlist_name": playlist_name or "Unknown Playlist",
-                    }
-
-                    result.append(track_data)
+                    result.append(
+                        self._track_to_dict(track_short.track, playlist_name)
+                    )
 
                 except Exception as track_error:
                     download_logger.warning(f"Ошибка обработки трека: {track_error}")
@@ -658,12 +709,181 @@ class YandexMusicClient:
         download_logger.info(f"✅ Всего обработано {len(result)} треков")
         return result
 
+    def _track_to_dict(self, track: Track, playlist_name: Optional[str]) -> dict:
+        """
+        Данные трека для API и очереди загрузок
+
+        Args:
+            track: Объект трека
+            playlist_name: Название плейлиста, из которого получен трек
+
+        Returns:
+            Словарь с данными трека
+        """
+        # Безопасное получение данных трека
+        artists = []
+        if track.artists:
+            artists = [artist.name for artist in track.artists if hasattr(artist, "name")]
+
+        album_title = None
+        year = None
+        genre = None
+        label = None
+        version = None
+
+        if track.albums and len(track.albums) > 0:
+            album = track.albums[0]
+            album_title = getattr(album, "title", None)
+            year = getattr(album, "year", None)
+            genre = getattr(album, "genre", None)
+            # Получаем первый лейбл если есть
+            if hasattr(album, "labels") and album.labels and len(album.labels) > 0:
+                label = getattr(album.labels[0], "name", None)
+            version = getattr(album, "version", None)
+
+        # Получаем версию трека если не найдена в альбоме
+        if not version:
+            version = getattr(track, "version", None)
+
+        # Попытка получить ISRC (может быть в разных местах)
+        isrc = None
+        if hasattr(track, "isrc"):
+            isrc = track.isrc
+        elif hasattr(track, "albums") and track.albums:
+            # Иногда ISRC может быть в альбоме
+            for album in track.albums:
+                if hasattr(album, "isrc"):
+                    isrc = album.isrc
+                    break
+
+        return {
+            "id": str(track.id) if track.id else None,
+            "title": track.title or "Без названия",
+            "artist": ", ".join(artists) if artists else "Неизвестный исполнитель",
+            "album": album_title,
+            "duration": track.duration_ms // 1000 if track.duration_ms else 0,
+            "year": year,
+            "genre": genre,
+            "label": label,
+            "version": version,
+            "isrc": isrc,
+            "cover": self._get_track_cover_url(track),
+            "available": getattr(track, "available", True),
+            "playlist_name": playlist_name or "Unknown Playlist",
+        }
+
+    def get_tracks(
+        self,
+        track_ids: Iterable,
+        batch_size: int = 100,
+        skip_failed: bool = False,
+        cancel: Optional[threading.Event] = None,
+    ) -> List[Track]:
+        """
+        Получить объекты треков через кэш метаданных
+
+        Треки, которые есть в кэше (track_metadata) и не старше
+        TRACK_METADATA_TTL, восстанавливаются из него без запроса к API.
+        Остальные запрашиваются через client.tracks параллельными батчами
+        (BatchResolver, в пределах общего лимита запросов к API) и
+        сохраняются в кэш.
+
+        Args:
+            track_ids: ID треков
+            batch_size: Размер батча запроса к API
+            skip_failed: Пропускать батчи с ошибкой вместо исключения
+            cancel: Событие отмены (например, клиент закрыл соединение)
+
+        Returns:
+            Найденные треки в порядке track_ids
+
+        Raises:
+            ResolveCancelled: Получение отменено событием cancel
+        """
+        from db_manager import db_manager
+
+        # "123:456" (трек:альбом) и "123" — один и тот же трек
+        ids = [str(track_id).split(":")[0] for track_id in track_ids]
+        found: Dict[str, Track] = {}
+
+        for track_id, row in db_manager.get_track_metadata(
+            ids, max_age=get_track_metadata_ttl()
+        ).items():
+            try:
+                track = Track.de_json(json.loads(row["data"]), self.client)
+            except Exception as e:
+                download_logger.warning(f"⚠️  Повреждена запись кэша трека {track_id}: {e}")
+                continue
+            if track:
+                found[track_id] = track
+
+        misses = [track_id for track_id in dict.fromkeys(ids) if track_id not in found]
+        if misses:
+            download_logger.info(
+                f"📇 Метаданные из кэша: {len(found)}, запрашиваем из API: {len(misses)}"
+            )
+
+            resolver = BatchResolver(
+                self.client.tracks,
+                batch_size=batch_size,
+                concurrency=get_yandex_api_settings()["resolve_concurrency"],
+            )
+            tracks = [
+                track
+                for track in resolver.resolve(misses, cancel=cancel, skip_failed=skip_failed)
+                if track
+            ]
+            self.cache_tracks(tracks)
+            for track in tracks:
+                found[str(track.id)] = track
+
+        return [found[track_id] for track_id in ids if track_id in found]
+
+    def cache_tracks(self, tracks: Iterable[Track]):
+        """Сохранить объекты треков, полученные из API, в кэш метаданных"""
+        rows = []
+        for track in tracks:
+            try:
+                rows.append(self._track_metadata_row(track))
+            except Exception as e:
+                download_logger.warning(f"⚠️  Трек не сохранён в кэш метаданных: {e}")
+
+        if rows:
+            from db_manager import db_manager
+
+            db_manager.save_track_metadata(rows)
+
+    def _track_metadata_row(self, track: Track) -> dict:
+        """Запись кэша метаданных для объекта трека"""
+        album = track.albums[0] if track.albums else None
+        labels = getattr(album, "labels", None) if album else None
+        cover_uri = getattr(album, "cover_uri", None) if album else None
+
+        return {
+            "track_id": str(track.id),
+            "title": track.title,
+            "artists": ", ".join(
+                artist.name for artist in (track.artists or []) if artist.name
+            ),
+            "album": getattr(album, "title", None),
+            "year": getattr(album, "year", None),
+            "genre": getattr(album, "genre", None),
+            "label": getattr(labels[0], "name", None) if labels else None,
+            "isrc": getattr(track, "isrc", None),
+            "duration": track.duration_ms // 1000 if track.duration_ms else None,
+            "cover_uri": cover_uri or getattr(track, "cover_uri", None),
+            "available": getattr(track, "available", True) is not False,
+            "data": json.dumps(_compact_json(track.to_dict()), ensure_ascii=False),
+        }
+
     def download_track(
         self,
         track_id: str,
         output_path: str,
         quality: str = "lossless",
         progress_callback: Optional[Callable] = None,
+        defer_mux: bool = False,
+        prefetched: Optional[dict] = None,
     ) -> Optional[str]:
         """
         Скачать трек
@@ -673,6 +893,11 @@ class YandexMusicClient:
             output_path: Путь для сохранения
             quality: Качество (lossless, hq, nq)
             progress_callback: Функция для отслеживания прогресса (bytes_downloaded, total_bytes)
+            defer_mux: Не конвертировать FLAC-MP4 сразу, а вернуть путь к
+                расшифрованному файлу (с суффиксом PENDING_MUX_SUFFIX) —
+                конвертацию затем выполняет finalize_flac()
+            prefetched: Заранее полученные метаданные, форматы и ссылки
+                (см. prefetch_download) — запросы перед скачиванием пропускаются
 
         Returns:
             Путь к скачанному файлу или None в случае ошибки
@@ -687,11 +912,16 @@ class YandexMusicClient:
                 raise Exception("Клиент не инициализирован")
 
             download_logger.info(f"🎵 Загружаем трек с ID: {track_id}")
-            tracks_result = self.client.tracks([track_id])
-            if not tracks_result or len(tracks_result) == 0:
-                raise Exception(f"Трек с ID {track_id} не найден")
+            prefetched = prefetched or {}
+            if prefetched.get("track") is not None:
+                track = prefetched["track"]
+                download_logger.info("⚡ Метаданные и ссылки взяты из предзагрузки")
+            else:
+                tracks_result = self.get_tracks([track_id])
+                if not tracks_result or len(tracks_result) == 0:
+                    raise Exception(f"Трек с ID {track_id} не найден")
 
-            track = tracks_result[0]
+                track = tracks_result[0]
             artist_name = track.artists[0].name if track.artists else "Unknown"
             download_logger.info(f"✅ Найден трек: {track.title} - {artist_name}")
 
@@ -700,82 +930,14 @@ class YandexMusicClient:
                 download_logger.info(f"🔄 Попытка скачать FLAC через прямой API...")
                 try:
                     # Используем прямой API для получения форматов
-                    formats = self.direct_api_client.get_download_info(
-                        track_id, "lossless"
-                    )
+                    formats = prefetched.get("formats")
+                    if formats is None:
+                        formats = self.direct_api_client.get_download_info(
+                            track_id, "lossless"
+                        )
 
                     if formats:
-                        # Ищем FLAC или FLAC-MP4 - проверяем все возможные варианты
-                        flac_format = None
-
-                        # Сначала проверяем по кодеку
-                        for fmt in formats:
-                            codec = fmt.get("codec", "").lower()
-                            if codec in ["flac", "flac-mp4", "flac_mp4"]:
-                                flac_format = fmt
-                                download_logger.info(
-                                    f"✅ FLAC найден в прямом API по кодеку: {codec}"
-                                )
-                                break
-
-                        # Если не нашли по кодеку, проверяем прямые ссылки и download_info_url
-                        if not flac_format:
-                            for fmt in formats:
-                                # Проверяем прямую ссылку
-                                direct_link = fmt.get("direct_link", "")
-                                if direct_link and "flac" in direct_link.lower():
-                                    flac_format = fmt
-                                    download_logger.info(
-                                        f"✅ FLAC найден в прямой ссылке прямого API"
-                                    )
-                                    break
-
-                                # Проверяем download_info_url
-                                download_url = fmt.get("download_info_url", "")
-                                if download_url and "flac" in download_url.lower():
-                                    flac_format = fmt
-                                    download_logger.info(
-                                        f"✅ FLAC найден в download_info_url прямого API"
-                                    )
-                                    break
-
-                        # Если FLAC не найден, пробуем найти aac-mp4 как альтернативу
-                        # aac-mp4 с 256 kbps качественнее MP3 320 kbps
-                        if not flac_format:
-                            download_logger.info(
-                                f"🔄 FLAC не найден, ищем aac-mp4 как альтернативу..."
-                            )
-                            for fmt in formats:
-                                codec = fmt.get("codec", "").lower()
-                                bitrate = fmt.get("bitrate_in_kbps", 0)
-                                # Принимаем aac-mp4 если битрейт >= 256 kbps
-                                if (
-                                    codec in ["aac-mp4", "aac", "he-aac-mp4"]
-                                    and bitrate >= 256
-                                ):
-                                    flac_format = fmt
-                                    download_logger.info(
-                                        f"✅ Найден {codec.upper()} {bitrate} kbps как альтернатива FLAC!"
-                                    )
-                                    break
-
-                        # Логируем все форматы для диагностики, если ничего не нашли
-                        if not flac_format:
-                            download_logger.warning(
-                                f"⚠️  FLAC и качественный aac-mp4 не найдены. Доступные форматы:"
-                            )
-                            for fmt in formats:
-                                codec = fmt.get("codec", "unknown")
-                                bitrate = fmt.get("bitrate_in_kbps", 0)
-                                transport = fmt.get("transport", "unknown")
-                                direct_link = fmt.get("direct_link", "")
-                                download_url = fmt.get("download_info_url", "")
-                                download_logger.warning(
-                                    f"   • {codec.upper()}: {bitrate} kbps, "
-                                    f"transport={transport}, "
-                                    f"direct_link={'есть' if direct_link else 'нет'}, "
-                                    f"download_url={'есть' if download_url else 'нет'}"
-                                )
+                        flac_format = self._select_direct_format(formats)
 
                         if flac_format:
                             codec_name = flac_format.get("codec", "").lower()
@@ -821,27 +983,26 @@ class YandexMusicClient:
                                 download_logger.info(f"💾 Сохраняем в: {output_path}")
                                 download_logger.info(f"📥 Начинаем скачивание...")
 
-                                import tempfile
-
-                                import requests
-
                                 # Проверяем нужна ли расшифровка
                                 needs_decrypt = flac_format.get("transport") == "encraw"
                                 encryption_key = flac_format.get("key", "")
 
                                 import os
 
-                                # Если нужна расшифровка, скачиваем во временный файл
+                                # Если нужна расшифровка, расшифровываем чанки прямо во время
+                                # скачивания — промежуточный .encrypted файл не создаётся
                                 if needs_decrypt and encryption_key:
                                     download_logger.info(
-                                        f"🔐 Файл зашифрован, потребуется расшифровка"
+                                        f"🔐 Файл зашифрован, расшифровываем во время скачивания"
                                     )
-                                    temp_encrypted = output_path + ".encrypted"
-                                    temp_decrypted = output_path + ".decrypted.mp4"
+                                    temp_decrypted = output_path + PENDING_MUX_SUFFIX
+                                    download_target = temp_decrypted
 
                                     # Удаляем существующие временные файлы, если они есть
-                                    if os.path.exists(temp_encrypted):
-                                        os.remove(temp_encrypted)
+                                    # (недокачанный .decrypted.mp4.part сохраняется для докачки)
+                                    legacy_encrypted = output_path + ".encrypted"
+                                    if os.path.exists(legacy_encrypted):
+                                        os.remove(legacy_encrypted)
                                         download_logger.info(
                                             f"🗑️  Удален старый зашифрованный файл"
                                         )
@@ -850,61 +1011,47 @@ class YandexMusicClient:
                                         download_logger.info(
                                             f"🗑️  Удален старый расшифрованный файл"
                                         )
+
+                                    # CTR позволяет начать расшифровку с любого смещения,
+                                    # поэтому докачка продолжает расшифровку с места обрыва
+                                    def chunk_transform_factory(offset: int):
+                                        return self.direct_api_client.create_stream_decryptor(
+                                            encryption_key, offset
+                                        ).decrypt
+
                                 else:
-                                    temp_encrypted = output_path
+                                    download_target = output_path
                                     temp_decrypted = None
-
-                                response = self.direct_api_client.session.get(
-                                    direct_link, stream=True, timeout=120
+                                    chunk_transform_factory = None
+
+                                # Скачиваем с докачкой: при обрыве .part остаётся на диске,
+                                # и следующая попытка продолжит с уже полученных байтов
+                                download_info_url = flac_format.get("download_info_url")
+                                downloaded = self._download_resumable(
+                                    direct_link,
+                                    download_target,
+                                    progress_callback,
+                                    session=self.direct_api_client.session,
+                                    chunk_transform_factory=chunk_transform_factory,
+                                    refresh_url=(
+                                        (
+                                            lambda: self.direct_api_client.get_direct_download_link(
+                                                download_info_url
+                                            )
+                                        )
+                                        if download_info_url
+                                        else None
+                                    ),
                                 )
 
-                                if response.status_code == 200:
-                                    total_size = int(
-                                        response.headers.get("content-length", 0)
+                                if downloaded is not None:
+                                    download_logger.info(f"✅ Файл успешно скачан!")
+                                    download_logger.info(
+                                        f"   Размер: {downloaded / (1024 * 1024):.2f} МБ"
+                                    )
+                                    download_logger.info(
+                                        f"   Временный файл: {download_target}"
                                     )
-                                    downloaded = 0
-
-                                    try:
-                                        with open(temp_encrypted, "wb") as f:
-                                            # Увеличенный chunk_size для лучшей производительности (64 KB вместо 8 KB)
-                                            for chunk in response.iter_content(
-                                                chunk_size=65536
-                                            ):
-                                                if chunk:
-                                                    f.write(chunk)
-                                                    downloaded += len(chunk)
-
-                                                    if (
-                                                        progress_callback
-                                                        and total_size > 0
-                                                    ):
-                                                        progress_callback(
-                                                            downloaded, total_size
-                                                        )
-
-                                        download_logger.info(f"✅ Файл успешно скачан!")
-                                        download_logger.info(
-                                            f"   Размер: {downloaded / (1024 * 1024):.2f} МБ"
-                                        )
-                                        download_logger.info(
-                                            f"   Временный файл: {temp_encrypted}"
-                                        )
-                                    except Exception as download_error:
-                                        download_logger.error(
-                                            f"❌ Ошибка записи файла: {download_error}"
-                                        )
-                                        # Удаляем частично скачанный файл
-                                        import os
-
-                                        if os.path.exists(temp_encrypted):
-                                            try:
-                                                os.remove(temp_encrypted)
-                                                download_logger.info(
-                                                    f"🗑️  Удален частично скачанный файл"
-                                                )
-                                            except:
-                                                pass
-                                        return None
 
                                     # Определяем кодек для выбора правильного расширения
                                     codec_name = flac_format.get("codec", "").lower()
@@ -924,9 +1071,9 @@ class YandexMusicClient:
                                                 os.path.splitext(output_path)[0]
                                                 + ".m4a"
                                             )
-                                            if temp_encrypted != output_path:
+                                            if download_target != output_path:
                                                 os.rename(
-                                                    temp_encrypted, output_path_m4a
+                                                    download_target, output_path_m4a
                                                 )
                                             else:
                                                 os.rename(output_path, output_path_m4a)
@@ -941,75 +1088,9 @@ class YandexMusicClient:
                                             # Для FLAC и других форматов
                                             return output_path
 
-                                    # Если нужна расшифровка и конвертация
+                                    # Если файл был зашифрован — он уже расшифрован, конвертируем
                                     if needs_decrypt and encryption_key:
                                         try:
-                                            # Проверяем, что зашифрованный файл существует и доступен
-                                            import os
-
-                                            if not os.path.exists(temp_encrypted):
-                                                download_logger.error(
-                                                    f"❌ Зашифрованный файл не найден: {temp_encrypted}"
-                                                )
-                                                return None
-
-                                            # Проверяем права доступа
-                                            try:
-                                                if not os.access(
-                                                    temp_encrypted, os.R_OK
-                                                ):
-                                                    download_logger.error(
-                                                        f"❌ Нет прав на чтение зашифрованного файла: {temp_encrypted}"
-                                                    )
-                                                    return None
-                                            except Exception as access_error:
-                                                download_logger.warning(
-                                                    f"⚠️  Не удалось проверить права доступа: {access_error}"
-                                                )
-
-                                            # Расшифровываем
-                                            download_logger.info(
-                                                f"🔓 Начинаем расшифровку: {temp_encrypted} → {temp_decrypted}"
-                                            )
-                                            if not self.direct_api_client.decrypt_track(
-                                                temp_encrypted,
-                                                temp_decrypted,
-                                                encryption_key,
-                                            ):
-                                                download_logger.error(
-                                                    "❌ Не удалось расшифровать файл"
-                                                )
-                                                # Удаляем зашифрованный файл при ошибке
-                                                if os.path.exists(temp_encrypted):
-                                                    try:
-                                                        os.remove(temp_encrypted)
-                                                        download_logger.info(
-                                                            "🗑️  Удален зашифрованный файл после ошибки расшифровки"
-                                                        )
-                                                    except Exception as cleanup_error:
-                                                        download_logger.warning(
-                                                            f"⚠️  Не удалось удалить зашифрованный файл: {cleanup_error}"
-                                                        )
-                                                return None
-
-                                            # Удаляем зашифрованный файл после успешной расшифровки
-                                            import os
-
-                                            if os.path.exists(temp_encrypted):
-                                                try:
-                                                    os.remove(temp_encrypted)
-                                                    download_logger.info(
-                                                        "🗑️  Удален зашифрованный файл после расшифровки"
-                                                    )
-                                                except (
-                                                    PermissionError,
-                                                    OSError,
-                                                ) as cleanup_error:
-                                                    download_logger.warning(
-                                                        f"⚠️  Не удалось удалить зашифрованный файл: {cleanup_error}"
-                                                    )
-                                                    # На NAS это может быть нормально, продолжаем работу
-
                                             # Определяем кодек и выбираем расширение файла
                                             codec_name = flac_format.get(
                                                 "codec", ""
@@ -1021,96 +1102,18 @@ class YandexMusicClient:
                                                 "flac-mp4",
                                                 "flac_mp4",
                                             ]:
-                                                # Проверяем, что расшифрованный файл существует
-                                                import os
-
-                                                if not os.path.exists(temp_decrypted):
-                                                    download_logger.error(
-                                                        f"❌ Расшифрованный файл не найден: {temp_decrypted}"
-                                                    )
-                                                    return None
-
-                                                # Проверяем права доступа к расшифрованному файлу
-                                                try:
-                                                    if not os.access(
-                                                        temp_decrypted, os.R_OK
-                                                    ):
-                                                        download_logger.error(
-                                                            f"❌ Нет прав на чтение расшифрованного файла: {temp_decrypted}"
-                                                        )
-                                                        return None
-
-                                                    # Проверяем размер файла
-                                                    file_size = os.path.getsize(
-                                                        temp_decrypted
-                                                    )
-                                                    if file_size == 0:
-                                                        download_logger.error(
-                                                            f"❌ Расшифрованный файл пуст: {temp_decrypted}"
-                                                        )
-                                                        return None
-
+                                                if defer_mux:
+                                                    # Конвертацию выполнит стадия обработки конвейера
                                                     download_logger.info(
-                                                        f"   Размер расшифрованного файла: {file_size / (1024*1024):.2f} МБ"
-                                                    )
-                                                except (
-                                                    PermissionError,
-                                                    OSError,
-                                                ) as check_error:
-                                                    download_logger.error(
-                                                        f"❌ Ошибка проверки расшифрованного файла: {check_error}"
+                                                        f"⏭️  Конвертация в FLAC передана стадии обработки"
                                                     )
-                                                    return None
+                                                    return temp_decrypted
 
-                                                # Конвертируем MP4 с FLAC в чистый FLAC
-                                                download_logger.info(
-                                                    f"🔄 Конвертируем {temp_decrypted} → {output_path}"
-                                                )
-                                                if not self.direct_api_client.mux_to_flac(
+                                                if not self.finalize_flac(
                                                     temp_decrypted, output_path
                                                 ):
-                                                    download_logger.error(
-                                                        "❌ Не удалось конвертировать в FLAC"
-                                                    )
-                                                    # Удаляем расшифрованный файл при ошибке
-                                                    if os.path.exists(temp_decrypted):
-                                                        try:
-                                                            os.remove(temp_decrypted)
-                                                            download_logger.info(
-                                                                "🗑️  Удален расшифрованный файл после ошибки конвертации"
-                                                            )
-                                                        except (
-                                                            Exception
-                                                        ) as cleanup_error:
-                                                            download_logger.warning(
-                                                                f"⚠️  Не удалось удалить расшифрованный файл: {cleanup_error}"
-                                                            )
                                                     return None
 
-                                                # Удаляем временный MP4 после успешной конвертации
-                                                import os
-
-                                                if os.path.exists(temp_decrypted):
-                                                    try:
-                                                        os.remove(temp_decrypted)
-                                                        download_logger.info(
-                                                            "🗑️  Удален расшифрованный файл после конвертации"
-                                                        )
-                                                    except (
-                                                        PermissionError,
-                                                        OSError,
-                                                    ) as cleanup_error:
-                                                        download_logger.warning(
-                                                            f"⚠️  Не удалось удалить расшифрованный файл: {cleanup_error}"
-                                                        )
-                                                        # На NAS это может быть нормально, продолжаем работу
-
-                                                download_logger.info(
-                                                    f"✅ FLAC файл готов!"
-                                                )
-                                                download_logger.info(
-                                                    f"   Путь: {output_path}"
-                                                )
                                             # Для AAC-MP4 сохраняем как M4A
                                             elif codec_name in [
                                                 "aac-mp4",
@@ -1149,7 +1152,7 @@ class YandexMusicClient:
 
                                         except Exception as e:
                                             download_logger.error(
-                                                f"❌ Ошибка обработки зашифрованного файла: {e}"
+                                                f"❌ Ошибка обработки расшифрованного файла: {e}"
                                             )
                                             import traceback
 
@@ -1174,46 +1177,16 @@ class YandexMusicClient:
                                                         f"⚠️  Не удалось удалить расшифрованный файл: {cleanup_error}"
                                                     )
 
-                                            # Удаляем зашифрованный файл
-                                            if (
-                                                temp_encrypted != output_path
-                                                and os.path.exists(temp_encrypted)
-                                            ):
-                                                try:
-                                                    os.remove(temp_encrypted)
-                                                    download_logger.info(
-                                                        f"🗑️  Удален зашифрованный файл после ошибки"
-                                                    )
-                                                except Exception as cleanup_error:
-                                                    download_logger.warning(
-                                                        f"⚠️  Не удалось удалить зашифрованный файл: {cleanup_error}"
-                                                    )
-                                                    # Если не удалось удалить, предупреждаем пользователя
-                                                    download_logger.warning(
-                                                        f"⚠️  Зашифрованный файл оставлен для ручной обработки: {temp_encrypted}"
-                                                    )
-
                                             return None
 
                                     return output_path
                                 else:
+                                    # Частичный файл не удаляем — он будет докачан при повторе
                                     download_logger.warning(
-                                        f"⚠️  Ошибка скачивания: статус {response.status_code}"
+                                        f"⚠️  Загрузка через прямой API не завершена, "
+                                        f"частичный файл сохранён для докачки"
                                     )
-                                    # Удаляем временный файл, если он был создан
-                                    import os
-
-                                    if (
-                                        temp_encrypted != output_path
-                                        and os.path.exists(temp_encrypted)
-                                    ):
-                                        try:
-                                            os.remove(temp_encrypted)
-                                            download_logger.info(
-                                                f"🗑️  Удален временный файл после ошибки скачивания"
-                                            )
-                                        except:
-                                            pass
+                                    return None
                         else:
                             download_logger.warning(
                                 f"⚠️  FLAC не найден в ответе прямого API"
@@ -1221,6 +1194,9 @@ class YandexMusicClient:
                     else:
                         download_logger.warning(f"⚠️  Прямой API не вернул форматы")
 
+                except (DownloadStopped, RequestCancelled):
+                    # Остановка очереди — не повод переключаться на стандартный API
+                    raise
                 except Exception as e:
                     download_logger.warning(
                         f"⚠️  Ошибка при использовании прямого API: {e}"
@@ -1231,7 +1207,9 @@ class YandexMusicClient:
             download_logger.info(
                 f"📥 Запрашиваем доступные форматы через стандартный API..."
             )
-            download_info = track.get_download_info(get_direct_links=True)
+            download_info = prefetched.get("download_info")
+            if download_info is None:
+                download_info = track.get_download_info(get_direct_links=True)
 
             # Детальная информация о доступных форматах
             download_logger.info(f"📋 Доступно форматов: {len(download_info)}")
@@ -1493,12 +1471,8 @@ class YandexMusicClient:
             # Скачиваем файл с отслеживанием прогресса
             download_logger.info("📥 Начинаем скачивание...")
 
-            if progress_callback:
-                # Скачиваем с отслеживанием прогресса
-                self._download_with_progress(selected_info, filepath, progress_callback)
-            else:
-                # Обычное скачивание без прогресса
-                selected_info.download(filepath)
+            # Скачиваем с докачкой (и с отслеживанием прогресса, если он нужен)
+            self._download_with_progress(selected_info, filepath, progress_callback)
 
             # Проверяем, что файл действительно создался
             if os.path.exists(filepath):
@@ -1516,6 +1490,9 @@ class YandexMusicClient:
             download_logger.info(f"✅ Функция download_track возвращает: {filepath}")
             return filepath
 
+        except (DownloadStopped, RequestCancelled):
+            # Трек вернёт в очередь менеджер очереди
+            raise
         except Exception as e:
             download_logger.error(
                 f"❌ Ошибка скачивания трека {track_id}: {e}", exc_info=True
@@ -1525,6 +1502,213 @@ class YandexMusicClient:
             )
             return None
 
+    @staticmethod
+    def _select_direct_format(formats: List[dict]) -> Optional[dict]:
+        """
+        Выбрать формат из ответа прямого API: FLAC, иначе AAC-MP4 от 256 kbps
+
+        Args:
+            formats: Форматы из YandexMusicDirectAPI.get_download_info
+
+        Returns:
+            Выбранный формат или None
+        """
+        # Ищем FLAC или FLAC-MP4 - проверяем все возможные варианты
+        flac_format = None
+
+        # Сначала проверяем по кодеку
+        for fmt in formats:
+            codec = fmt.get("codec", "").lower()
+            if codec in ["flac", "flac-mp4", "flac_mp4"]:
+                flac_format = fmt
+                download_logger.info(
+                    f"✅ FLAC найден в прямом API по кодеку: {codec}"
+                )
+                break
+
+        # Если не нашли по кодеку, проверяем прямые ссылки и download_info_url
+        if not flac_format:
+            for fmt in formats:
+                # Проверяем прямую ссылку
+                direct_link = fmt.get("direct_link", "")
+                if direct_link and "flac" in direct_link.lower():
+                    flac_format = fmt
+                    download_logger.info(
+                        f"✅ FLAC найден в прямой ссылке прямого API"
+                    )
+                    break
+
+                # Проверяем download_info_url
+                download_url = fmt.get("download_info_url", "")
+                if download_url and "flac" in download_url.lower():
+                    flac_format = fmt
+                    download_logger.info(
+                        f"✅ FLAC найден в download_info_url прямого API"
+                    )
+                    break
+
+        # Если FLAC не найден, пробуем найти aac-mp4 как альтернативу
+        # aac-mp4 с 256 kbps качественнее MP3 320 kbps
+        if not flac_format:
+            download_logger.info(
+                f"🔄 FLAC не найден, ищем aac-mp4 как альтернативу..."
+            )
+            for fmt in formats:
+                codec = fmt.get("codec", "").lower()
+                bitrate = fmt.get("bitrate_in_kbps", 0)
+                # Принимаем aac-mp4 если битрейт >= 256 kbps
+                if (
+                    codec in ["aac-mp4", "aac", "he-aac-mp4"]
+                    and bitrate >= 256
+                ):
+                    flac_format = fmt
+                    download_logger.info(
+                        f"✅ Найден {codec.upper()} {bitrate} kbps как альтернатива FLAC!"
+                    )
+                    break
+
+        # Логируем все форматы для диагностики, если ничего не нашли
+        if not flac_format:
+            download_logger.warning(
+                f"⚠️  FLAC и качественный aac-mp4 не найдены. Доступные форматы:"
+            )
+            for fmt in formats:
+                codec = fmt.get("codec", "unknown")
+                bitrate = fmt.get("bitrate_in_kbps", 0)
+                transport = fmt.get("transport", "unknown")
+                direct_link = fmt.get("direct_link", "")
+                download_url = fmt.get("download_info_url", "")
+                download_logger.warning(
+                    f"   • {codec.upper()}: {bitrate} kbps, "
+                    f"transport={transport}, "
+                    f"direct_link={'есть' if direct_link else 'нет'}, "
+                    f"download_url={'есть' if download_url else 'нет'}"
+                )
+
+        return flac_format
+
+    def prefetch_download(self, track_id: str, quality: str = "lossless") -> Optional[dict]:
+        """
+        Заранее получить всё, что download_track запрашивает перед скачиванием
+
+        Метаданные трека, список форматов прямого API и подписанную прямую
+        ссылку выбранного формата (для lossless), либо форматы стандартного
+        API с прямыми ссылками (для остальных качеств).
+
+        Returns:
+            Словарь для параметра prefetched или None в случае ошибки
+        """
+        if not self.client and not self.connect():
+            return None
+
+        try:
+            tracks_result = self.get_tracks([track_id])
+            if not tracks_result:
+                return None
+
+            track = tracks_result[0]
+            result = {"track": track}
+
+            if quality == "lossless" and self.direct_api_client:
+                formats = self.direct_api_client.get_download_info(track_id, "lossless")
+                if formats:
+                    selected = self._select_direct_format(formats)
+                    if (
+                        selected
+                        and not selected.get("direct_link")
+                        and selected.get("download_info_url")
+                    ):
+                        selected["direct_link"] = (
+                            self.direct_api_client.get_direct_download_link(
+                                selected["download_info_url"]
+                            )
+                        )
+                    result["formats"] = formats
+            else:
+                result["download_info"] = track.get_download_info(get_direct_links=True)
+
+            return result
+        except Exception as e:
+            download_logger.warning(f"⚠️  Не удалось предзагрузить трек {track_id}: {e}")
+            return None
+
+    def finalize_flac(self, decrypted_path: str, output_path: str) -> Optional[str]:
+        """
+        Сконвертировать расшифрованный FLAC-MP4 в FLAC и удалить временный файл
+
+        Args:
+            decrypted_path: Путь к расшифрованному MP4
+            output_path: Путь итогового FLAC файла
+
+        Returns:
+            Путь к FLAC файлу или None в случае ошибки
+        """
+        # Проверяем, что расшифрованный файл существует
+        if not os.path.exists(decrypted_path):
+            download_logger.error(
+                f"❌ Расшифрованный файл не найден: {decrypted_path}"
+            )
+            return None
+
+        # Проверяем права доступа к расшифрованному файлу
+        try:
+            if not os.access(decrypted_path, os.R_OK):
+                download_logger.error(
+                    f"❌ Нет прав на чтение расшифрованного файла: {decrypted_path}"
+                )
+                return None
+
+            # Проверяем размер файла
+            file_size = os.path.getsize(decrypted_path)
+            if file_size == 0:
+                download_logger.error(
+                    f"❌ Расшифрованный файл пуст: {decrypted_path}"
+                )
+                return None
+
+            download_logger.info(
+                f"   Размер расшифрованного файла: {file_size / (1024*1024):.2f} МБ"
+            )
+        except (PermissionError, OSError) as check_error:
+            download_logger.error(
+                f"❌ Ошибка проверки расшифрованного файла: {check_error}"
+            )
+            return None
+
+        # Конвертируем MP4 с FLAC в чистый FLAC
+        download_logger.info(f"🔄 Конвертируем {decrypted_path} → {output_path}")
+        if not self.direct_api_client or not self.direct_api_client.mux_to_flac(
+            decrypted_path, output_path
+        ):
+            download_logger.error("❌ Не удалось конвертировать в FLAC")
+            # Удаляем расшифрованный файл при ошибке
+            if os.path.exists(decrypted_path):
+                try:
+                    os.remove(decrypted_path)
+                    download_logger.info(
+                        "🗑️  Удален расшифрованный файл после ошибки конвертации"
+                    )
+                except Exception as cleanup_error:
+                    download_logger.warning(
+                        f"⚠️  Не удалось удалить расшифрованный файл: {cleanup_error}"
+                    )
+            return None
+
+        # Удаляем временный MP4 после успешной конвертации
+        if os.path.exists(decrypted_path):
+            try:
+                os.remove(decrypted_path)
+                download_logger.info("🗑️  Удален расшифрованный файл после конвертации")
+            except (PermissionError, OSError) as cleanup_error:
+                download_logger.warning(
+                    f"⚠️  Не удалось удалить расшифрованный файл: {cleanup_error}"
+                )
+                # На NAS это может быть нормально, продолжаем работу
+
+        download_logger.info(f"✅ FLAC файл готов!")
+        download_logger.info(f"   Путь: {output_path}")
+        return output_path
+
     def get_playlist_name(self, playlist_id: str) -> Optional[str]:
         """
         Получить название плейлиста по ID
@@ -1550,9 +1734,8 @@ class YandexMusicClient:
 
             # Пробуем получить плейлист с username из базы данных
             try:
-                from db_manager import DatabaseManager
+                from db_manager import db_manager
 
-                db_manager = DatabaseManager()
                 token_info = db_manager.get_active_token()
                 username = token_info.get("username") if token_info else None
 
@@ -1573,96 +1756,77 @@ class YandexMusicClient:
             print(f"Ошибка получения названия плейлиста {playlist_id}: {e}")
             return f"Playlist_{playlist_id}"
 
+    def _download_resumable(
+        self,
+        url: str,
+        dest_path: str,
+        progress_callback: Optional[Callable] = None,
+        session=None,
+        refresh_url: Optional[Callable[[], str]] = None,
+        callback_interval: float = 0.0,
+        chunk_transform_factory: Optional[Callable] = None,
+    ) -> Optional[int]:
+        """
+        Скачать файл с докачкой по HTTP Range
+
+        Args:
+            url: Прямая ссылка на файл
+            dest_path: Путь для сохранения
+            progress_callback: Функция для отслеживания прогресса
+            session: HTTP-сессия (по умолчанию новая)
+            refresh_url: Функция получения новой ссылки, если старая истекла
+            callback_interval: Минимальный интервал между вызовами progress_callback
+            chunk_transform_factory: Функция (offset) → преобразователь чанков
+                (используется для потоковой расшифровки)
+
+        Returns:
+            Размер файла в байтах или None, если скачать не удалось
+            (частичный файл при этом остаётся для следующей попытки)
+        """
+        downloader = ResumableDownloader(session=session)
+        try:
+            return downloader.download(
+                url,
+                dest_path,
+                progress_callback=progress_callback,
+                refresh_url=refresh_url,
+                callback_interval=callback_interval,
+                chunk_transform_factory=chunk_transform_factory,
+            )
+        except Exception as e:
+            download_logger.error(f"❌ Ошибка скачивания {dest_path}: {e}")
+            partial = downloader.get_partial_offset(dest_path)
+            if partial:
+                download_logger.info(
+                    f"💾 Сохранено для докачки: {partial / (1024 * 1024):.2f} МБ"
+                )
+            return None
+
     def _download_with_progress(
-        self, download_info, filepath: str, progress_callback: Callable
+        self, download_info, filepath: str, progress_callback: Optional[Callable]
     ):
         """
-        Скачать файл с отслеживанием прогресса
+        Скачать файл с отслеживанием прогресса и докачкой
 
         Args:
             download_info: Информация о загрузке от yandex-music
             filepath: Путь для сохранения файла
             progress_callback: Функция для отслеживания прогресса
         """
-        import time
-
-        import requests
-
-        # Максимальное количество попыток
-        max_retries = 3
-        retry_delay = 2  # секунды
-
         try:
             # Получаем прямую ссылку
             direct_link = download_info.get_direct_link()
 
-            # Получаем размер файла с timeout
-            try:
-                response = requests.head(direct_link, allow_redirects=True, timeout=30)
-                total_size = int(response.headers.get("content-length", 0))
-            except Exception as e:
-                download_logger.warning(f"Не удалось получить размер файла: {e}")
-                total_size = 0
-
-            download_logger.info(f"📊 Размер файла: {total_size / (1024*1024):.2f} МБ")
-
-            # Скачиваем с прогрессом и повторными попытками
-            for attempt in range(max_retries):
-                try:
-                    # Увеличиваем timeout для больших файлов: connect timeout 30s, read timeout 300s (5 минут)
-                    response = requests.get(direct_link, stream=True, timeout=(30, 300))
-                    response.raise_for_status()
-
-                    downloaded = 0
-                    last_callback_time = time.time()
-                    callback_interval = (
-                        0.1  # Вызывать callback не чаще раза в 0.1 секунды
-                    )
+            # Повторы с докачкой с места обрыва, устаревшая ссылка запрашивается заново
+            downloaded = ResumableDownloader().download(
+                direct_link,
+                filepath,
+                progress_callback=progress_callback,
+                refresh_url=download_info.get_direct_link,
+                callback_interval=0.1,  # Вызывать callback не чаще раза в 0.1 секунды
+            )
 
-                    with open(filepath, "wb") as f:
-                        # Увеличенный chunk_size для лучшей производительности (64 KB вместо 8 KB)
-                        for chunk in response.iter_content(chunk_size=65536):
-                            if chunk:
-                                f.write(chunk)
-                                downloaded += len(chunk)
-
-                                # Вызываем callback с прогрессом (не чаще раза в 0.1 секунды)
-                                if progress_callback:
-                                    current_time = time.time()
-                                    if (
-                                        current_time - last_callback_time
-                                        >= callback_interval
-                                    ):
-                                        progress_callback(downloaded, total_size)
-                                        last_callback_time = current_time
-
-                    # Финальный callback для 100%
-                    if progress_callback:
-                        progress_callback(downloaded, total_size)
-
-                    # Если дошли сюда, значит успешно скачали
-                    return
-
-                except (
-                    requests.exceptions.ChunkedEncodingError,
-                    requests.exceptions.ConnectionError,
-                    requests.exceptions.ProtocolError,
-                    OSError,
-                ) as e:
-                    current_delay = retry_delay * (
-                        2**attempt
-                    )  # Экспоненциальная задержка
-                    if attempt < max_retries - 1:
-                        download_logger.warning(
-                            f"Ошибка соединения при попытке {attempt + 1}/{max_retries}: {e}. Повтор через {current_delay}с..."
-                        )
-                        time.sleep(current_delay)
-                    else:
-                        # Последняя попытка не удалась
-                        download_logger.error(
-                            f"Ошибка скачивания с прогрессом после {max_retries} попыток: {e}"
-                        )
-                        raise
+            download_logger.info(f"📊 Размер файла: {downloaded / (1024*1024):.2f} МБ")
 
         except Exception as e:
             download_logger.error(f"Ошибка скачивания с прогрессом: {e}")
@@ -9,9 +9,15 @@ import time
 import requests
 import subprocess
 import os
+import mmap
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional, Dict, List, Any
 import logging
 
+from flac_demuxer import FlacDemuxError, demux_file
+from utils.http_client import http_client
+from utils.rate_limiter import account_key, yandex_api_limits
+
 logger = logging.getLogger('yandex_direct_api')
 download_logger = logging.getLogger('download')
 
@@ -24,6 +30,112 @@ except ImportError:
     CRYPTO_AVAILABLE = False
     logger.warning("⚠️  pycryptodome не установлен. Расшифровка FLAC будет недоступна.")
 
+# Параллельная расшифровка файлов на диске: файл делится на сегменты,
+# каждый сегмент расшифровывается независимо (CTR позволяет начать с любого блока)
+DECRYPT_SEGMENT_SIZE = 4 * 1024 * 1024  # кратно 16 байтам (размер блока AES)
+PARALLEL_DECRYPT_MIN_SIZE = 8 * 1024 * 1024  # меньшие файлы расшифровываем в одном потоке
+DECRYPT_WORKERS = min(8, os.cpu_count() or 1)
+
+
+class StreamingCTRDecryptor:
+    """
+    Потоковая расшифровка AES-128-CTR (transport=encraw)
+
+    Расшифровывает данные порциями по мере поступления, начиная с любого
+    смещения в файле: счётчик ставится на блок offset // 16, а первые
+    offset % 16 байт ключевого потока пропускаются. Результат совпадает
+    с расшифровкой всего файла с Counter.new(128, initial_value=0).
+    """
+
+    BLOCK_SIZE = 16
+
+    def __init__(self, key: str, offset: int = 0):
+        if not CRYPTO_AVAILABLE:
+            raise RuntimeError("pycryptodome не установлен. Установите: pip install pycryptodome")
+
+        key_bytes = bytes.fromhex(key)
+        if len(key_bytes) != 16:
+            raise ValueError(f"Ключ должен быть 16 байт, получено: {len(key_bytes)}")
+
+        block_index, skip = divmod(offset, self.BLOCK_SIZE)
+        ctr = Counter.new(128, initial_value=block_index)
+        self._cipher = AES.new(key_bytes, AES.MODE_CTR, counter=ctr)
+        if skip:
+            # Сдвигаем ключевой поток внутри блока
+            self._cipher.decrypt(bytes(skip))
+        self.offset = offset
+
+    def decrypt(self, chunk: bytes) -> bytes:
+        """Расшифровать очередную порцию данных"""
+        self.offset += len(chunk)
+        return self._cipher.decrypt(chunk)
+
+    def decrypt_into(self, chunk, output) -> None:
+        """Расшифровать порцию прямо в записываемый буфер output (без копий)"""
+        self.offset += len(chunk)
+        self._cipher.decrypt(chunk, output=output)
+
+
+def decrypt_file(
+    encrypted_path: str,
+    decrypted_path: str,
+    key: str,
+    workers: Optional[int] = None,
+    segment_size: int = DECRYPT_SEGMENT_SIZE,
+) -> int:
+    """
+    Расшифровывает файл AES-128-CTR с диска в файл
+
+    Вход и выход отображаются в память (mmap), файл делится на сегменты,
+    которые расшифровываются в пуле потоков (pycryptodome отпускает GIL)
+    прямо в выходной mmap без промежуточных копий. Небольшие файлы
+    расшифровываются потоково в одном потоке.
+
+    Args:
+        encrypted_path: Путь к зашифрованному файлу
+        decrypted_path: Путь для расшифрованного файла
+        key: Hex-ключ для расшифровки
+        workers: Количество потоков (по умолчанию DECRYPT_WORKERS)
+        segment_size: Размер сегмента, кратный 16 байтам
+
+    Returns:
+        Размер расшифрованного файла в байтах
+    """
+    if segment_size % StreamingCTRDecryptor.BLOCK_SIZE:
+        raise ValueError("Размер сегмента должен быть кратен 16 байтам")
+
+    workers = workers or DECRYPT_WORKERS
+    size = os.path.getsize(encrypted_path)
+
+    if workers <= 1 or size < PARALLEL_DECRYPT_MIN_SIZE:
+        decryptor = StreamingCTRDecryptor(key)
+        with open(encrypted_path, 'rb') as src, open(decrypted_path, 'wb') as dst:
+            while True:
+                chunk = src.read(segment_size)
+                if not chunk:
+                    break
+                dst.write(decryptor.decrypt(chunk))
+        return size
+
+    with open(encrypted_path, 'rb') as src, open(decrypted_path, 'w+b') as dst:
+        dst.truncate(size)
+        with mmap.mmap(src.fileno(), 0, access=mmap.ACCESS_READ) as in_map, \
+                mmap.mmap(dst.fileno(), size, access=mmap.ACCESS_WRITE) as out_map:
+
+            def decrypt_segment(start: int):
+                end = min(start + segment_size, size)
+                with memoryview(in_map)[start:end] as src_view, \
+                        memoryview(out_map)[start:end] as dst_view:
+                    StreamingCTRDecryptor(key, start).decrypt_into(src_view, dst_view)
+
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                # list() пробрасывает исключения из потоков
+                list(executor.map(decrypt_segment, range(0, size, segment_size)))
+
+            out_map.flush()
+
+    return size
+
 
 class YandexMusicDirectAPI:
     """Прямой API клиент для Яндекс.Музыки с поддержкой FLAC"""
@@ -45,7 +157,10 @@ class YandexMusicDirectAPI:
         """
         self.token = token
         self.token_type = token_type
-        self.session = requests.Session()
+        # Ключ аккаунта: лимиты общие с клиентом библиотеки для того же токена
+        self.account = account_key(token)
+        # Своя сессия (заголовки и cookies токена) поверх общего пула соединений
+        self.session = http_client.create_session()
         
         # Базовые headers как в браузере
         self.session.headers.update({
@@ -66,6 +181,10 @@ class YandexMusicDirectAPI:
             self.session.cookies.set('Session_id', token, domain='.yandex.ru')
             logger.info("✅ YandexMusicDirectAPI инициализирован с Session_id токеном")
     
+    def _get(self, endpoint: str, url: str, **kwargs) -> requests.Response:
+        """GET через ограничитель частоты класса методов endpoint для аккаунта"""
+        return yandex_api_limits.call(endpoint, self.account, self.session.get, url, **kwargs)
+    
     def _generate_hmac_sign(self, timestamp: int, track_id: str, quality: str) -> str:
         """
         Генерирует HMAC-SHA256 подпись для запроса (согласно Rust реализации)
@@ -145,7 +264,8 @@ class YandexMusicDirectAPI:
             download_logger.debug(f"   Params: {params}")
             
             # Выполняем запрос
-            response = self.session.get(
+            response = self._get(
+                'download_info',
                 self.GET_FILE_INFO_ENDPOINT,
                 params=params,
                 headers=headers,
@@ -299,7 +419,7 @@ class YandexMusicDirectAPI:
             download_logger.info(f"🔗 Получаем прямую ссылку...")
             
             # Запрашиваем информацию о скачивании
-            response = self.session.get(download_info_url, timeout=30)
+            response = self._get('storage', download_info_url, timeout=30)
             
             if response.status_code != 200:
                 download_logger.error(f"❌ Ошибка получения ссылки: статус {response.status_code}")
@@ -386,7 +506,7 @@ class YandexMusicDirectAPI:
             # Скачиваем файл
             download_logger.info(f"📥 Начинаем скачивание...")
             
-            response = self.session.get(download_url, stream=True, timeout=60)
+            response = self._get('storage', download_url, stream=True, timeout=60)
             
             if response.status_code != 200:
                 download_logger.error(f"❌ Ошибка скачивания: статус {response.status_code}")
@@ -415,6 +535,16 @@ class YandexMusicDirectAPI:
             download_logger.error(traceback.format_exc())
             return False
     
+    def create_stream_decryptor(self, key: str, offset: int = 0) -> StreamingCTRDecryptor:
+        """
+        Создаёт потоковый расшифровщик для файла с transport=encraw
+
+        Args:
+            key: Hex-ключ для расшифровки
+            offset: Смещение в файле, с которого начнутся данные (для докачки)
+        """
+        return StreamingCTRDecryptor(key, offset)
+
     def decrypt_track(self, encrypted_path: str, decrypted_path: str, key: str) -> bool:
         """
         Расшифровывает зашифрованный FLAC файл (transport=encraw)
@@ -472,20 +602,10 @@ class YandexMusicDirectAPI:
                 download_logger.error(f"❌ Нет прав на чтение файла {encrypted_path}: {e}")
                 return False
             
-            # Читаем зашифрованный файл с обработкой ошибок
-            try:
-                with open(encrypted_path, 'rb') as f:
-                    encrypted_data = bytearray(f.read())
-            except PermissionError as e:
-                download_logger.error(f"❌ Ошибка доступа при чтении файла: {e}")
-                return False
-            except OSError as e:
-                download_logger.error(f"❌ Ошибка файловой системы при чтении: {e}")
-                return False
-            
-            download_logger.info(f"   Размер зашифрованного файла: {len(encrypted_data) / (1024*1024):.2f} МБ")
+            encrypted_size = os.path.getsize(encrypted_path)
+            download_logger.info(f"   Размер зашифрованного файла: {encrypted_size / (1024*1024):.2f} МБ")
             
-            # Конвертируем hex-ключ в bytes
+            # Проверяем ключ
             try:
                 key_bytes = bytes.fromhex(key)
             except ValueError as e:
@@ -496,18 +616,6 @@ class YandexMusicDirectAPI:
                 download_logger.error(f"❌ Ключ должен быть 16 байт, получено: {len(key_bytes)}")
                 return False
             
-            # В AES CTR mode нужен counter, а не nonce
-            from Crypto.Util import Counter
-            
-            # Создаём counter из 128 нулевых бит
-            ctr = Counter.new(128, initial_value=0)
-            
-            # Создаём AES-128-CTR cipher
-            cipher = AES.new(key_bytes, AES.MODE_CTR, counter=ctr)
-            
-            # Расшифровываем
-            decrypted_data = cipher.decrypt(bytes(encrypted_data))
-            
             # Сохраняем расшифрованный файл
             output_file = temp_decrypted if use_temp_file else decrypted_path
             
@@ -527,8 +635,8 @@ class YandexMusicDirectAPI:
                     # Используем атомарную запись: сначала пишем во временный файл, затем переименовываем
                     temp_output = output_file + '.tmp'
                     
-                    with open(temp_output, 'wb') as f:
-                        f.write(decrypted_data)
+                    # Расшифровываем сегментами параллельно, не загружая файл в память целиком
+                    decrypt_file(encrypted_path, temp_output, key)
                     
                     # Атомарное переименование (работает на большинстве файловых систем)
                     os.rename(temp_output, output_file)
@@ -592,7 +700,7 @@ class YandexMusicDirectAPI:
     
     def mux_to_flac(self, input_path: str, output_path: str) -> bool:
         """
-        Конвертирует MP4 контейнер в FLAC используя ffmpeg
+        Конвертирует MP4 контейнер в FLAC встроенным демуксером (ffmpeg — запасной вариант)
         Улучшено для работы с удаленными NAS (Synology и др.)
         
         Args:
@@ -656,16 +764,28 @@ class YandexMusicDirectAPI:
             # Увеличиваем timeout для сетевых файловых систем
             timeout = 120 if is_network_path else 60
             
-            # ffmpeg -i input.mp4 -c:a copy output.flac
-            # Используем -loglevel error для уменьшения вывода
-            result = subprocess.run(
-                ['ffmpeg', '-i', input_path, '-c:a', 'copy', output_file, '-y', '-loglevel', 'error'],
-                capture_output=True,
-                text=True,
-                timeout=timeout
-            )
+            # Сначала пробуем встроенный демуксер — без запуска внешнего процесса
+            try:
+                stats = demux_file(input_path, output_file)
+                download_logger.info(
+                    f"⚡ FLAC извлечён без ffmpeg: {stats['frames']} фреймов, "
+                    f"{stats['bytes'] / (1024 * 1024):.2f} МБ"
+                )
+                returncode, stderr = 0, ""
+            except (FlacDemuxError, OSError) as e:
+                download_logger.warning(f"⚠️  Встроенный демуксер не справился ({e}), используем ffmpeg")
+
+                # ffmpeg -i input.mp4 -c:a copy output.flac
+                # Используем -loglevel error для уменьшения вывода
+                result = subprocess.run(
+                    ['ffmpeg', '-i', input_path, '-c:a', 'copy', output_file, '-y', '-loglevel', 'error'],
+                    capture_output=True,
+                    text=True,
+                    timeout=timeout
+                )
+                returncode, stderr = result.returncode, result.stderr
             
-            if result.returncode == 0:
+            if returncode == 0:
                 download_logger.info(f"✅ Конвертация завершена!")
                 
                 # Если использовали временный файл, перемещаем на NAS
@@ -709,7 +829,7 @@ class YandexMusicDirectAPI:
                 
                 return True
             else:
-                download_logger.error(f"❌ ffmpeg вернул ошибку: {result.stderr}")
+                download_logger.error(f"❌ ffmpeg вернул ошибку: {stderr}")
                 # Удаляем временный файл при ошибке
                 if use_temp_file and temp_output and os.path.exists(temp_output):
                     try:
@@ -48,6 +48,8 @@ function DownloadQueue() {
     current_status: null as string | null,
     current_progress: 0
   })
+  // Подключён ли поток событий очереди (SSE); пока нет — работает опрос
+  const [streamConnected, setStreamConnected] = useState(false)
   const { } = useAppContext()
 
   // Функция для фильтрации треков по статусу
@@ -74,8 +76,59 @@ function DownloadQueue() {
     });
   }
 
+  // Поток событий очереди: снимок при подключении, затем изменения по мере их появления
+  useEffect(() => {
+    if (typeof EventSource === 'undefined') return
+
+    const source = new EventSource(`${config.apiBaseUrl}/queue/events`)
+
+    const updateTrack = (trackId: string, changes: Partial<Track>) => {
+      setTracks(prev => prev.map(t => (t.track_id === trackId ? { ...t, ...changes } : t)))
+    }
+
+    source.addEventListener('snapshot', (e) => {
+      const data = JSON.parse((e as MessageEvent).data)
+      setTracks(data.queue || [])
+      applyQueueStats(data.stats || {})
+      loadProgress()
+      setStreamConnected(true)
+      setLoading(false)
+      setInitialLoad(false)
+    })
+
+    source.addEventListener('track', (e) => {
+      const data = JSON.parse((e as MessageEvent).data)
+      const changes: Partial<Track> = { status: data.status, progress: data.progress }
+      if (data.error_message) changes.error_message = data.error_message
+      updateTrack(data.track_id, changes)
+    })
+
+    source.addEventListener('progress', (e) => {
+      const data = JSON.parse((e as MessageEvent).data)
+      updateTrack(data.track_id, { progress: data.progress })
+    })
+
+    source.addEventListener('stats', (e) => {
+      applyQueueStats(JSON.parse((e as MessageEvent).data))
+    })
+
+    source.addEventListener('queue_changed', () => {
+      loadQueue()
+    })
+
+    source.onerror = () => {
+      // EventSource переподключится сам, до этого момента работает опрос
+      setStreamConnected(false)
+    }
+
+    return () => source.close()
+  }, [])
+
   // Загружаем данные при монтировании компонента
   useEffect(() => {
+    // Пока подключён поток событий, данные приходят из него и опрос не нужен
+    if (streamConnected) return
+
     loadQueue()
     loadDownloadStats()
 
@@ -110,7 +163,7 @@ function DownloadQueue() {
     }, 3000)  // Увеличен интервал до 3 секунд
 
     return () => clearInterval(interval)
-  }, [tracks])  // Зависимость от tracks для определения активных загрузок
+  }, [tracks, streamConnected])  // Зависимость от tracks для определения активных загрузок
 
   const loadProgress = async () => {
     try {
@@ -170,39 +223,54 @@ function DownloadQueue() {
   }
 
 
+  // Применение статистики очереди (ответ /queue/stats или событие stats из потока)
+  const applyQueueStats = (data: any) => {
+    const sessionStats = data.session_stats || {}
+    const session = {
+      completedInQueue: sessionStats.completed || 0,
+      downloadingInQueue: sessionStats.downloading || 0,
+      pendingInQueue: sessionStats.pending || 0,
+      queuedInQueue: sessionStats.queued || 0,
+      errorsInQueue: sessionStats.errors || 0,
+      totalInSession: sessionStats.total_in_queue || 0  // Общее количество треков в очереди
+    }
+
+    if (data.general_stats) {
+      // Общая статистика (вся база данных)
+      const generalStats = data.general_stats
+      setDownloadStats({
+        totalInQueue: generalStats.total_files || 0,
+        totalDownloaded: generalStats.total_files || 0,
+        totalSizeMB: generalStats.total_size_mb || 0,
+        totalSizeGB: generalStats.total_size_gb || 0,
+        ...session
+      })
+    } else {
+      setDownloadStats(prev => ({ ...prev, ...session }))
+    }
+
+    // Обновляем состояние паузы
+    const systemState = data.system_state || {}
+    setIsPaused(systemState.is_paused === true)
+
+    // В режиме потока общий прогресс считаем по счётчикам очереди
+    if (data.session_stats && !data.general_stats) {
+      setProgressData(prev => ({
+        ...prev,
+        is_active: session.downloadingInQueue > 0,
+        overall_progress: session.completedInQueue + session.errorsInQueue,
+        overall_total: session.totalInSession
+      }))
+    }
+  }
+
   const loadDownloadStats = async () => {
     try {
       // Используем новый API для статистики очереди
       const response = await fetch(`${config.apiBaseUrl}/queue/stats`)
       if (response.ok) {
         const data = await response.json()
-        
-        // Получаем общую статистику
-        const generalStats = data.general_stats || {}
-        
-        // Получаем статистику текущей сессии
-        const sessionStats = data.session_stats || {}
-        
-        // Преобразуем данные в формат, ожидаемый компонентом
-        setDownloadStats({
-          // Общая статистика
-          totalInQueue: generalStats.total_files || 0,
-          totalDownloaded: generalStats.total_files || 0,
-          totalSizeMB: generalStats.total_size_mb || 0,
-          totalSizeGB: generalStats.total_size_gb || 0,
-          
-          // Статистика текущей сессии
-          completedInQueue: sessionStats.completed || 0,
-          downloadingInQueue: sessionStats.downloading || 0,
-          pendingInQueue: sessionStats.pending || 0,
-          queuedInQueue: sessionStats.queued || 0,
-          errorsInQueue: sessionStats.errors || 0,
-          totalInSession: sessionStats.total_in_queue || 0  // Общее количество треков в очереди
-        })
-
-        // Обновляем состояние паузы
-        const systemState = data.system_state || {}
-        setIsPaused(systemState.is_paused === true)
+        applyQueueStats(data)
 
         // НЕ сбрасываем progressData здесь - это вызывает прыжки!
         // setProgressData будет обновлен в loadProgress()
@@ -696,13 +764,13 @@ function DownloadQueue() {
                             </span>
                           </div>
                           <span className="text-sm font-bold text-blue-600 dark:text-blue-400">
-                            {(progressData.current_progress || track.progress || 0).toFixed(1)}%
+                            {(track.progress || 0).toFixed(1)}%
                           </span>
                         </div>
                         <div className="w-full bg-gray-200 dark:bg-gray-700 rounded-full h-2">
                           <div
                             className="bg-blue-500 h-2 rounded-full transition-all duration-300 ease-out"
-                            style={{ width: `${Math.min(Math.max(progressData.current_progress || track.progress || 0, 0), 100)}%` }}
+                            style={{ width: `${Math.min(Math.max(track.progress || 0, 0), 100)}%` }}
                           />
                         </div>
                       </div>
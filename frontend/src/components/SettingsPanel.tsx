@@ -35,6 +35,7 @@ function SettingsPanel({ onConnectionChange }: SettingsPanelProps) {
   const [quality, setQuality] = useState('lossless')
   const [fileTemplate, setFileTemplate] = useState('{artist} - {title}')
   const [folderStructure, setFolderStructure] = useState('{artist}/{album}')
+  const [downloadWorkers, setDownloadWorkers] = useState(3)
 
   // Состояние для логов
   const [logs, setLogs] = useState<string[]>([])
@@ -99,6 +100,7 @@ function SettingsPanel({ onConnectionChange }: SettingsPanelProps) {
         setQuality(settings.quality || 'lossless')
         setFileTemplate(settings.fileTemplate || '{artist} - {title}')
         setFolderStructure(settings.folderStructure || '{artist}/{album}')
+        setDownloadWorkers(settings.downloadWorkers || 3)
 
         // Проверяем соединение по наличию токена
         if (settings.token) {
@@ -218,7 +220,8 @@ function SettingsPanel({ onConnectionChange }: SettingsPanelProps) {
           downloadPath: downloadPath,
           quality: quality,
           fileTemplate: fileTemplate,
-          folderStructure: folderStructure
+          folderStructure: folderStructure,
+          downloadWorkers: downloadWorkers
         })
       })
 
@@ -538,6 +541,25 @@ function SettingsPanel({ onConnectionChange }: SettingsPanelProps) {
                 </p>
               </div>
 
+              <div className="space-y-4 pt-6 border-t border-gray-200 dark:border-gray-700">
+                <div className="flex items-center gap-3">
+                  <Palette size={20} className="text-primary-500" />
+                  <h4 className="text-lg font-semibold text-gray-900 dark:text-gray-100">Параллельные загрузки</h4>
+                </div>
+                <select
+                  value={downloadWorkers}
+                  onChange={(e) => setDownloadWorkers(Number(e.target.value))}
+                  className="w-full px-4 py-2 border border-gray-300 dark:border-gray-600 rounded-lg bg-white dark:bg-gray-800 text-gray-900 dark:text-gray-100 focus:ring-2 focus:ring-primary-500 focus:border-primary-500"
+                >
+                  {[1, 2, 3, 4, 5, 6, 7, 8].map((count) => (
+                    <option key={count} value={count}>{count}</option>
+                  ))}
+                </select>
+                <p className="mt-2 text-sm text-gray-600 dark:text-gray-400">
+                  💡 Количество треков, скачиваемых одновременно. Применяется при следующем запуске очереди.
+                </p>
+              </div>
+
               <div className="space-y-4 pt-6 border-t border-gray-200 dark:border-gray-700">
                 <div className="flex items-center gap-3">
                   <FileText size={20} className="text-primary-500" />